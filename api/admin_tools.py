@@ -1,9 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from pydantic import BaseModel
 from db import get_db
 from datetime import datetime
+from core import availability, indexes, patch, projections, refdata, rollups, slowlog, writes
+from core.sequences import next_id
+from core.schema import check_name
+from core.paging import Page, page_rows, respond
+from core.coalesce import SingleFlightRoute
+
+# Одинаковые GET, пришедшие одновременно, считаются один раз (core/coalesce.py)
+router = APIRouter(route_class=SingleFlightRoute)
 
-router = APIRouter()
+# Записи в справочники и столы: кэши процесса сбрасываются сразу после COMMIT писателя
+def _written(ent_name):
+    if ent_name in refdata.ENTS:
+        refdata.invalidate()
+    if ent_name in availability.ENTS:
+        availability.invalidate()
 
 # ------------------------------
 #  Работа с блюдами
@@ -18,50 +33,53 @@ class DishIn(BaseModel):
     is_active: bool = True
 
 @router.post("/admin/dish")
-async def create_dish(dish: DishIn, db=Depends(get_db)):
-    cursor = await db.execute("SELECT IFNULL(MAX(ent_instance_id), 0)+1 FROM t_sys_attr_values WHERE ent_name = 'dish'")
-    dish_id = (await cursor.fetchone())[0]
-
-    fields = [
-        ("name", dish.name),
-        ("price", str(dish.price)),
-        ("description", dish.description),
-        ("category", dish.category),
-        ("image_url", dish.image_url),
-        ("is_active", "true" if dish.is_active else "false"),
-        ("created_at", datetime.now().isoformat())
-    ]
+async def create_dish(dish: DishIn):
+    async def insert(db):
+        dish_id = await next_id(db, 'dish')
 
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('dish', ?, ?, ?)",
-        [(attr, dish_id, val) for attr, val in fields]
-    )
-    await db.commit()
+        fields = [
+            ("name", dish.name),
+            ("price", str(dish.price)),
+            ("description", dish.description),
+            ("category", dish.category),
+            ("image_url", dish.image_url),
+            ("is_active", "true" if dish.is_active else "false"),
+            ("created_at", datetime.now().isoformat())
+        ]
+
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('dish', ?, ?, ?)",
+            [(attr, dish_id, val) for attr, val in fields]
+        )
+        return dish_id
+
+    dish_id = await writes.submit(insert)
+    _written('dish')
     return {"status": "created", "dish_id": dish_id}
 
 @router.put("/admin/dish/{dish_id}")
-async def update_dish(dish_id: int, dish: DishIn, db=Depends(get_db)):
-    await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = 'dish' AND ent_instance_id = ?", (dish_id,))
-    fields = [
-        ("name", dish.name),
-        ("price", str(dish.price)),
-        ("description", dish.description),
-        ("category", dish.category),
-        ("image_url", dish.image_url),
-        ("is_active", "true" if dish.is_active else "false"),
-        ("updated_at", datetime.now().isoformat())
-    ]
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('dish', ?, ?, ?)",
-        [(attr, dish_id, val) for attr, val in fields]
-    )
-    await db.commit()
-    return {"status": "updated", "dish_id": dish_id}
+async def update_dish(dish_id: int, dish: DishIn):
+    fields = {
+        "name": dish.name,
+        "price": str(dish.price),
+        "description": dish.description,
+        "category": dish.category,
+        "image_url": dish.image_url,
+        "is_active": "true" if dish.is_active else "false",
+    }
+    # Меняются только отличающиеся атрибуты, created_at остаётся (core/patch.py)
+    changed = await _update('dish', {dish_id: fields}, True)
+    if changed[dish_id] is None:
+        raise HTTPException(status_code=404, detail="Блюдо не найдено")
+    return {"status": "updated", "dish_id": dish_id, "changed": changed[dish_id]}
 
 @router.delete("/admin/dish/{dish_id}")
-async def delete_dish(dish_id: int, db=Depends(get_db)):
-    await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = 'dish' AND ent_instance_id = ?", (dish_id,))
-    await db.commit()
+async def delete_dish(dish_id: int):
+    async def delete(db):
+        await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = 'dish' AND ent_instance_id = ?", (dish_id,))
+
+    await writes.submit(delete)
+    _written('dish')
     return {"status": "deleted", "dish_id": dish_id}
 
 # ------------------------------
@@ -72,22 +90,133 @@ class CategoryIn(BaseModel):
     name: str
 
 @router.post("/admin/category")
-async def create_category(data: CategoryIn, db=Depends(get_db)):
-    cursor = await db.execute("SELECT IFNULL(MAX(ent_instance_id), 0)+1 FROM t_sys_attr_values WHERE ent_name = 'category'")
-    cat_id = (await cursor.fetchone())[0]
-    await db.execute(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('category', 'name', ?, ?)",
-        (cat_id, data.name)
-    )
-    await db.commit()
+async def create_category(data: CategoryIn):
+    async def insert(db):
+        cat_id = await next_id(db, 'category')
+        await db.execute(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('category', 'name', ?, ?)",
+            (cat_id, data.name)
+        )
+        return cat_id
+
+    await writes.submit(insert)
+    _written('category')
     return {"status": "created", "category": data.name}
 
 @router.delete("/admin/category/{name}")
-async def delete_category(name: str, db=Depends(get_db)):
-    await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = 'category' AND attr_name = 'name' AND value = ?", (name,))
-    await db.commit()
+async def delete_category(name: str):
+    async def delete(db):
+        await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = 'category' AND attr_name = 'name' AND value = ?", (name,))
+
+    await writes.submit(delete)
+    _written('category')
     return {"status": "deleted", "category": name}
 
+# ------------------------------
+#  Индексы по значениям атрибутов
+#  (объявлены до универсальных маршрутов, иначе /admin/{ent_name}/{ent_id} перехватит путь)
+# ------------------------------
+
+# DDL индексов и проекций коммитит сам, поэтому идёт к писателю вне пачек (exclusive=True)
+
+class IndexIn(BaseModel):
+    ent_name: str
+    attr_name: str
+    range: bool = False  # индекс по value_num / value_ts вместо текстового value
+
+@router.get("/admin/_index")
+async def list_indexes(db=Depends(get_db)):
+    present = await indexes.existing(db)
+    result = [
+        {"ent_name": ent, "attr_name": attr, "index": indexes.index_name(ent, attr),
+         "built": indexes.index_name(ent, attr) in present, "range": False}
+        for ent, attr in await indexes.declared(db)
+    ]
+    result += [
+        {"ent_name": ent, "attr_name": attr, "index": indexes.range_index_name(ent, attr),
+         "built": indexes.range_index_name(ent, attr) in present, "range": True}
+        for ent, attr, _ in await indexes.declared_ranges(db)
+    ]
+    return result
+
+@router.post("/admin/_index")
+async def add_index(data: IndexIn):
+    set_indexed = indexes.set_range_indexed if data.range else indexes.set_indexed
+    try:
+        name = await writes.submit(lambda db: set_indexed(db, data.ent_name, data.attr_name, True), exclusive=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "created", "index": name}
+
+@router.delete("/admin/_index/{ent_name}/{attr_name}")
+async def drop_index(ent_name: str, attr_name: str, range: bool = False):
+    set_indexed = indexes.set_range_indexed if range else indexes.set_indexed
+    try:
+        name = await writes.submit(lambda db: set_indexed(db, ent_name, attr_name, False), exclusive=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "deleted", "index": name}
+
+# ------------------------------
+#  Проекции (широкие таблицы proj_<ent_name>)
+# ------------------------------
+
+@router.get("/admin/_proj")
+async def list_projections(db=Depends(get_db)):
+    rows = await db.execute_fetchall("SELECT ent_name, is_projected FROM t_sys_ent ORDER BY ent_name")
+    return [{"ent_name": row["ent_name"], "enabled": bool(row["is_projected"])} for row in rows]
+
+@router.post("/admin/_proj/{ent_name}")
+async def enable_projection(ent_name: str):
+    try:
+        await writes.submit(lambda db: projections.enable(db, ent_name), exclusive=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "enabled", "table": projections.table_name(ent_name)}
+
+@router.post("/admin/_proj/{ent_name}/rebuild")
+async def rebuild_projection(ent_name: str):
+    try:
+        rebuilt = await writes.submit(lambda db: projections.rebuild(db, [ent_name]), exclusive=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not rebuilt:
+        raise HTTPException(status_code=404, detail="Проекция не включена")
+    return {"status": "rebuilt", "table": projections.table_name(ent_name)}
+
+@router.delete("/admin/_proj/{ent_name}")
+async def disable_projection(ent_name: str):
+    try:
+        await writes.submit(lambda db: projections.disable(db, ent_name), exclusive=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "disabled", "ent_name": ent_name}
+
+# ------------------------------
+#  Медленные запросы (core/slowlog.py)
+# ------------------------------
+
+@router.get("/admin/_slow_queries")
+async def list_slow_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order: str = Query("total_ms", pattern="^(total_ms|max_ms|count)$"),
+):
+    return {"threshold_ms": slowlog.THRESHOLD_MS, "queries": slowlog.worst(limit, order)}
+
+@router.get("/admin/_slow_queries/recent")
+async def recent_slow_queries(limit: int = Query(50, ge=1, le=slowlog.BUFFER_SIZE)):
+    return list(slowlog.recent)[-limit:][::-1]
+
+@router.get("/admin/_slow_queries/scans")
+async def full_scan_queries():
+    # Все встреченные формы запросов с полным просмотром t_sys_attr_values, даже быстрые
+    return slowlog.full_scans()
+
+@router.delete("/admin/_slow_queries")
+async def clear_slow_queries():
+    slowlog.clear()
+    return {"status": "cleared"}
+
 # ------------------------------
 #  Универсальные GET / PUT / DELETE
 # ------------------------------
@@ -95,6 +224,55 @@ async def delete_category(name: str, db=Depends(get_db)):
 class EntityUpdateIn(BaseModel):
     fields: dict
 
+class EntityItemIn(BaseModel):
+    ent_id: int
+    fields: dict
+
+class BulkUpdateIn(BaseModel):
+    items: List[EntityItemIn]
+
+# Правка по разнице (core/patch.py) одной единицей писателя, затем сброс кэшей процесса.
+# replace=True — PUT (полный набор атрибутов), иначе PATCH. Возвращает {ent_id: [атрибуты]}.
+async def _update(ent_name, changes, replace):
+    async def update(db):
+        days = {}
+        if ent_name in rollups.ENTS:
+            for ent_id in changes:
+                days[ent_id] = await rollups.days_of(db, ent_name, ent_id)
+        result = await patch.apply(db, ent_name, changes, replace)
+        touched = set()
+        for ent_id in days:
+            if result[ent_id]:
+                # заказ мог переехать на другой день: пересчитываем и старый, и новый
+                touched |= days[ent_id] | await rollups.days_of(db, ent_name, ent_id)
+        if touched:
+            await rollups.refresh(db, touched)
+        return result
+
+    result = await writes.submit(update)
+    if any(result.values()):
+        _written(ent_name)
+    return result
+
+def _bulk(ent_name, data):
+    try:
+        check_name(ent_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    changes = {item.ent_id: item.fields for item in data.items}
+    if len(changes) != len(data.items):
+        raise HTTPException(status_code=400, detail="ent_id в items повторяются")
+    return changes
+
+def _bulk_result(ent_name, result):
+    return {
+        "status": "updated",
+        "ent_name": ent_name,
+        "updated": {ent_id: attrs for ent_id, attrs in result.items() if attrs},
+        "unchanged": [ent_id for ent_id, attrs in result.items() if attrs == []],
+        "missing": [ent_id for ent_id, attrs in result.items() if attrs is None],
+    }
+
 @router.get("/admin/{ent_name}/{ent_id}")
 async def get_entity(ent_name: str, ent_id: int, db=Depends(get_db)):
     cursor = await db.execute(
@@ -111,45 +289,57 @@ async def get_entity(ent_name: str, ent_id: int, db=Depends(get_db)):
     return result
 
 @router.put("/admin/{ent_name}/{ent_id}")
-async def update_entity(ent_name: str, ent_id: int, data: EntityUpdateIn, db=Depends(get_db)):
-    await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = ? AND ent_instance_id = ?", (ent_name, ent_id))
-    now = datetime.now().isoformat()
-
-    field_items = [(k, v) for k, v in data.fields.items()]
-    field_items.append(("updated_at", now))
+async def update_entity(ent_name: str, ent_id: int, data: EntityUpdateIn):
+    # PUT — полный набор атрибутов: недостающие снимаются (кроме created_at), остальное как в PATCH
+    changed = await _update(ent_name, {ent_id: data.fields}, True)
+    if changed[ent_id] is None:
+        raise HTTPException(status_code=404, detail="Сущность не найдена")
+    return {"status": "updated", "ent_name": ent_name, "ent_id": ent_id, "changed": changed[ent_id]}
 
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES (?, ?, ?, ?)",
-        [(ent_name, attr, ent_id, val) for attr, val in field_items]
-    )
-    await db.commit()
-    return {"status": "updated", "ent_name": ent_name, "ent_id": ent_id}
+@router.patch("/admin/{ent_name}/{ent_id}")
+async def patch_entity(ent_name: str, ent_id: int, data: EntityUpdateIn):
+    # Только переданные атрибуты; null снимает атрибут
+    changed = await _update(ent_name, {ent_id: data.fields}, False)
+    if changed[ent_id] is None:
+        raise HTTPException(status_code=404, detail="Сущность не найдена")
+    return {"status": "updated", "ent_name": ent_name, "ent_id": ent_id, "changed": changed[ent_id]}
 
 @router.delete("/admin/{ent_name}/{ent_id}")
-async def delete_entity(ent_name: str, ent_id: int, db=Depends(get_db)):
-    await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = ? AND ent_instance_id = ?", (ent_name, ent_id))
-    await db.commit()
+async def delete_entity(ent_name: str, ent_id: int):
+    async def delete(db):
+        days = await rollups.days_of(db, ent_name, ent_id) if ent_name in rollups.ENTS else set()
+        await db.execute("DELETE FROM t_sys_attr_values WHERE ent_name = ? AND ent_instance_id = ?", (ent_name, ent_id))
+        if days:
+            await rollups.refresh(db, days)
+
+    await writes.submit(delete)
+    _written(ent_name)
     return {"status": "deleted", "ent_name": ent_name, "ent_id": ent_id}
 
 # ------------------------------
-#  Список всех сущностей заданного типа
+#  Список всех сущностей заданного типа и пакетная правка
 # ------------------------------
 
 @router.get("/admin/{ent_name}")
-async def get_entity_list(ent_name: str, db=Depends(get_db)):
-    query = f'''
-    SELECT ent_instance_id,
-           MAX(CASE WHEN attr_name = 'name' THEN value END) AS name,
-           MAX(CASE WHEN attr_name = 'title' THEN value END) AS title,
-           MAX(CASE WHEN attr_name = 'created_at' THEN value END) AS created_at
-    FROM t_sys_attr_values
-    WHERE ent_name = ?
-    GROUP BY ent_instance_id
-    ORDER BY ent_instance_id DESC
-    '''
-    cursor = await db.execute(query, (ent_name,))
-    rows = await cursor.fetchall()
-    return [dict(row) for row in rows]
+async def get_entity_list(ent_name: str, request: Request, page: Page = Depends(), db=Depends(get_db)):
+    try:
+        check_name(ent_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def fetch_page(db, after, limit):
+        return await page_rows(db, ent_name, ('name', 'title', 'created_at'), after, limit, desc=True)
+    return await respond(request, db, page, fetch_page)
+
+@router.patch("/admin/{ent_name}")
+async def patch_entities(ent_name: str, data: BulkUpdateIn):
+    # Много экземпляров одной транзакцией; несуществующие попадают в missing
+    return _bulk_result(ent_name, await _update(ent_name, _bulk(ent_name, data), False))
+
+@router.put("/admin/{ent_name}")
+async def update_entities(ent_name: str, data: BulkUpdateIn):
+    # Как PATCH, но с полным набором атрибутов; новые экземпляры создаются только через POST
+    return _bulk_result(ent_name, await _update(ent_name, _bulk(ent_name, data), True))
 
 # ------------------------------
 #  Работа с t_sys_ent
@@ -160,16 +350,20 @@ class SysEntityIn(BaseModel):
     ent_app: str
 
 @router.post("/admin/_ent")
-async def create_sys_ent(data: SysEntityIn, db=Depends(get_db)):
-    await db.execute(
-        "INSERT INTO t_sys_ent (ent_name, ent_app) VALUES (?, ?)",
-        (data.ent_name, data.ent_app)
-    )
-    await db.commit()
+async def create_sys_ent(data: SysEntityIn):
+    async def insert(db):
+        await db.execute(
+            "INSERT INTO t_sys_ent (ent_name, ent_app) VALUES (?, ?)",
+            (data.ent_name, data.ent_app)
+        )
+
+    await writes.submit(insert)
     return {"status": "created", "ent_name": data.ent_name}
 
 @router.delete("/admin/_ent/{ent_name}")
-async def delete_sys_ent(ent_name: str, db=Depends(get_db)):
-    await db.execute("DELETE FROM t_sys_ent WHERE ent_name = ?", (ent_name,))
-    await db.commit()
+async def delete_sys_ent(ent_name: str):
+    async def delete(db):
+        await db.execute("DELETE FROM t_sys_ent WHERE ent_name = ?", (ent_name,))
+
+    await writes.submit(delete)
     return {"status": "deleted", "ent_name": ent_name}
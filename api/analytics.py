@@ -1,153 +1,234 @@
-from fastapi import APIRouter, Depends
-from db import get_db
+import os
+from datetime import date, timedelta
+from typing import Literal, Optional
 
-router = APIRouter()
+from fastapi import APIRouter, HTTPException, Query, Response
+from core import columnar, resultcache
+from core.projections import entity_table
+from core.coalesce import SingleFlightRoute
+
+# Одинаковые GET, пришедшие одновременно, считаются один раз (core/coalesce.py)
+router = APIRouter(route_class=SingleFlightRoute)
+
+# Период [from, to] включительно; без границ — вся история
+def _period(date_from, date_to):
+    return (date_from.isoformat() if date_from else "0000-00-00",
+            date_to.isoformat() if date_to else "9999-99-99")
+
+# Сущности, от которых зависят отчёты
+ORDER_ENTS = ("order", "order_item")
+STAFF_ENTS = ("order", "staff_shift")
+
+# Чем считать отчёты: sql — агрегаты rollups, numpy — колоночный снимок core/columnar.py
+BACKEND = os.environ.get("ANALYTICS_BACKEND", "sql")
+
+def _backend():
+    return Query(BACKEND, description="sql — таблицы агрегатов, numpy — колоночный снимок в памяти")
+
+# Ответ из кэша готовых результатов (core/resultcache.py); Age — сколько секунд ему
+async def _cached(response, name, ent_names, compute, *params):
+    value, age = await resultcache.get(name, ent_names, compute, *params)
+    response.headers["Age"] = str(age)
+    return value
 
 #  Ежедневное количество заказов
-@router.get("/analytics/daily-orders")
-async def daily_orders(db=Depends(get_db)):
+async def _daily_orders(db, backend, date_from, date_to):
+    if backend == "numpy":
+        return (await columnar.get(db)).daily_orders(*columnar.days(date_from, date_to))
     query = '''
-    SELECT DATE(value) AS day, COUNT(DISTINCT ent_instance_id) AS order_count
-    FROM t_sys_attr_values
-    WHERE ent_name = 'order' AND attr_name = 'created_at'
-    GROUP BY day
+    SELECT day, order_count
+    FROM agg_daily_orders
+    WHERE day >= ? AND day <= ?
     ORDER BY day DESC
     '''
-    cursor = await db.execute(query)
+    cursor = await db.execute(query, _period(date_from, date_to))
     rows = await cursor.fetchall()
     return [dict(row) for row in rows]
 
+@router.get("/analytics/daily-orders")
+async def daily_orders(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                       date_to: Optional[date] = Query(None, alias="to"),
+                       backend: Literal["sql", "numpy"] = _backend()):
+    return await _cached(response, "daily-orders", ORDER_ENTS, _daily_orders, backend, date_from, date_to)
+
 #  Популярные блюда (по количеству)
-@router.get("/analytics/popular-dishes")
-async def popular_dishes(db=Depends(get_db)):
+async def _popular_dishes(db, backend, date_from, date_to, limit):
+    if backend == "numpy":
+        return (await columnar.get(db)).popular_dishes(*columnar.days(date_from, date_to), limit)
     query = '''
-    SELECT value AS dish_id, SUM(CAST(quantity.value AS INT)) AS total_quantity
-    FROM t_sys_attr_values AS dish
-    JOIN t_sys_attr_values AS quantity
-      ON dish.ent_instance_id = quantity.ent_instance_id
-     AND dish.ent_name = 'order_item'
-     AND quantity.ent_name = 'order_item'
-     AND quantity.attr_name = 'quantity'
-    WHERE dish.attr_name = 'dish_id'
-    GROUP BY value
-    ORDER BY total_quantity DESC
-    LIMIT 10
+    SELECT dish_id, SUM(qty) AS total_quantity, ROUND(SUM(revenue), 2) AS total_revenue
+    FROM agg_dish_daily
+    WHERE day >= ? AND day <= ?
+    GROUP BY dish_id
+    ORDER BY total_quantity DESC, dish_id
+    LIMIT ?
     '''
-    cursor = await db.execute(query)
+    cursor = await db.execute(query, _period(date_from, date_to) + (limit,))
     rows = await cursor.fetchall()
     return [dict(row) for row in rows]
 
+@router.get("/analytics/popular-dishes")
+async def popular_dishes(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                         date_to: Optional[date] = Query(None, alias="to"),
+                         limit: int = Query(10, ge=1, le=1000),
+                         backend: Literal["sql", "numpy"] = _backend()):
+    return await _cached(response, "popular-dishes", ORDER_ENTS, _popular_dishes,
+                         backend, date_from, date_to, limit)
+
 #  Выручка по дням
-@router.get("/analytics/revenue-by-day")
-async def revenue_by_day(db=Depends(get_db)):
+async def _revenue_by_day(db, backend, date_from, date_to):
+    if backend == "numpy":
+        return (await columnar.get(db)).revenue_by_day(*columnar.days(date_from, date_to))
     query = '''
-    SELECT DATE(created.value) AS day,
-           SUM(CAST(total.value AS FLOAT)) AS total_revenue
-    FROM t_sys_attr_values AS created
-    JOIN t_sys_attr_values AS total
-      ON created.ent_instance_id = total.ent_instance_id
-     AND created.ent_name = 'order'
-     AND total.ent_name = 'order'
-     AND total.attr_name = 'total_price'
-    WHERE created.attr_name = 'created_at'
-    GROUP BY day
+    SELECT day, revenue AS total_revenue
+    FROM agg_daily_orders
+    WHERE day >= ? AND day <= ?
     ORDER BY day DESC
     '''
-    cursor = await db.execute(query)
+    cursor = await db.execute(query, _period(date_from, date_to))
     rows = await cursor.fetchall()
     return [dict(row) for row in rows]
 
-#  Загруженность столов по времени (heatmap)
+@router.get("/analytics/revenue-by-day")
+async def revenue_by_day(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                         date_to: Optional[date] = Query(None, alias="to"),
+                         backend: Literal["sql", "numpy"] = _backend()):
+    return await _cached(response, "revenue-by-day", ORDER_ENTS, _revenue_by_day, backend, date_from, date_to)
+
+#  Загруженность столов по времени (heatmap): матрица дни (или дни недели) × корзины суток.
+#  Считается по массиву времени броней в памяти (core/columnar.py), без группировки строк.
+HEATMAP_DAYS = 28       # период по умолчанию: четыре недели до ...
+HEATMAP_AHEAD = 7       # ... недели вперёд от сегодня
+HEATMAP_MAX_DAYS = 366
+HEATMAP_BUCKETS = (15, 30, 60)
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+
+async def _booking_heatmap(db, date_from, date_to, bucket, group, weight, occupancy):
+    bookings = await columnar.bookings(db)
+    values = bookings.heatmap(*columnar.days(date_from, date_to), bucket, group, weight, occupancy)
+    if group == "weekday":
+        rows = list(WEEKDAYS)
+    else:
+        rows = [(date_from + timedelta(days=i)).isoformat() for i in range(len(values))]
+    return {
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "bucket": bucket,
+        "group": group,
+        "weight": weight,
+        "occupancy": occupancy,
+        "capacity": bookings.capacity,
+        "rows": rows,
+        "columns": [f"{m // 60:02d}:{m % 60:02d}" for m in range(0, 1440, bucket)],
+        "values": values.astype(int).tolist(),
+    }
+
 @router.get("/analytics/booking-heatmap")
-async def booking_heatmap(db=Depends(get_db)):
-    query = '''
-    SELECT SUBSTR(value, 0, 11) AS date,
-           SUBSTR(value, 12, 5) AS time,
-           COUNT(*) AS count
-    FROM t_sys_attr_values
-    WHERE ent_name = 'booking' AND attr_name = 'datetime'
-    GROUP BY date, time
-    ORDER BY date DESC, time
-    '''
-    cursor = await db.execute(query)
-    rows = await cursor.fetchall()
-    return [dict(row) for row in rows]
+async def booking_heatmap(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                          date_to: Optional[date] = Query(None, alias="to"),
+                          bucket: int = Query(60, description="минут в корзине: 15, 30 или 60"),
+                          group: Literal["date", "weekday"] = Query("weekday"),
+                          weight: Literal["count", "guests", "seats"] = Query("count"),
+                          occupancy: bool = Query(False, description="бронь занимает все корзины своей длительности")):
+    date_to = date_to or date.today() + timedelta(days=HEATMAP_AHEAD)
+    date_from = date_from or date_to - timedelta(days=HEATMAP_DAYS + HEATMAP_AHEAD - 1)
+    if bucket not in HEATMAP_BUCKETS:
+        raise HTTPException(status_code=400, detail="Размер корзины: 15, 30 или 60 минут")
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="Конец периода раньше начала")
+    if (date_to - date_from).days >= HEATMAP_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Период не длиннее {HEATMAP_MAX_DAYS} дней")
+    return await _cached(response, "booking-heatmap", columnar.BOOKING_ENTS, _booking_heatmap,
+                         date_from, date_to, bucket, group, weight, occupancy)
 
 #  Лояльность пользователей
-@router.get("/analytics/user-loyalty")
-async def user_loyalty(db=Depends(get_db)):
-    query = '''
-    SELECT ent_instance_id AS user_id,
-           MAX(CASE WHEN attr_name = 'name' THEN value END) AS name,
-           MAX(CASE WHEN attr_name = 'phone' THEN value END) AS phone,
-           MAX(CASE WHEN attr_name = 'loyalty_total' THEN value END) AS loyalty_total,
-           MAX(CASE WHEN attr_name = 'loyalty_discount' THEN value END) AS loyalty_discount
-    FROM t_sys_attr_values
-    WHERE ent_name = 'user'
-    GROUP BY ent_instance_id
+async def _user_loyalty(db):
+    fields = ('name', 'phone', 'loyalty_total', 'loyalty_discount')
+    query = f'''
+    SELECT ent_instance_id AS user_id, name, phone, loyalty_total, loyalty_discount
+    FROM {entity_table('user', fields)}
     ORDER BY CAST(loyalty_total AS FLOAT) DESC
     '''
     cursor = await db.execute(query)
     rows = await cursor.fetchall()
     return [dict(row) for row in rows]
 
+@router.get("/analytics/user-loyalty")
+async def user_loyalty(response: Response):
+    return await _cached(response, "user-loyalty", ("user",), _user_loyalty)
+
+
+# Условие на agg_staff_daily: диапазон по ключу (day, waiter_id)
+# или, если задан официант, по индексу (waiter_id, day)
+def _staff_filter(date_from, date_to, waiter_id):
+    if waiter_id is None:
+        return "day >= ? AND day <= ?", _period(date_from, date_to)
+    return "waiter_id = ? AND day >= ? AND day <= ?", (waiter_id,) + _period(date_from, date_to)
+
+
+# Работа официантов за период одним запросом к agg_staff_daily
+async def _staff_totals(db, backend, date_from, date_to, waiter_id):
+    if backend == "numpy":
+        return (await columnar.get(db)).staff_totals(*columnar.days(date_from, date_to), waiter_id)
+    where, params = _staff_filter(date_from, date_to, waiter_id)
+    query = f'''
+    SELECT waiter_id,
+           SUM(order_count) AS order_count,
+           ROUND(SUM(revenue), 2) AS total_revenue,
+           ROUND(SUM(hours), 2) AS total_hours,
+           SUM(shift_count) AS shift_count,
+           ROUND(SUM(revenue) / NULLIF(SUM(hours), 0), 2) AS revenue_per_hour
+    FROM agg_staff_daily
+    WHERE {where}
+    GROUP BY waiter_id
+    ORDER BY total_revenue DESC
+    '''
+    cursor = await db.execute(query, params)
+    return [dict(row) for row in await cursor.fetchall()]
 
-@router.get("/analytics/staff/shifts")
-async def staff_shifts(db=Depends(get_db)):
-    query = """
-    SELECT ent_instance_id AS shift_id,
-           MAX(CASE WHEN attr_name = 'user_id' THEN value END) AS user_id,
-           MAX(CASE WHEN attr_name = 'start_time' THEN value END) AS start_time,
-           MAX(CASE WHEN attr_name = 'end_time' THEN value END) AS end_time
-    FROM t_sys_attr_values
-    WHERE ent_name = 'staff_shift'
-    GROUP BY ent_instance_id
-    """
-    cursor = await db.execute(query)
-    rows = await cursor.fetchall()
 
-    from collections import defaultdict
-    from datetime import datetime
-
-    shift_summary = defaultdict(lambda: {"total_hours": 0, "shift_count": 0})
-
-    for row in rows:
-        user_id = row["user_id"]
-        try:
-            start = datetime.fromisoformat(row["start_time"])
-            end = datetime.fromisoformat(row["end_time"])
-            hours = round((end - start).total_seconds() / 3600, 2)
-        except:
-            hours = 0
-        shift_summary[user_id]["total_hours"] += hours
-        shift_summary[user_id]["shift_count"] += 1
-
-    # форматируем
-    result = [
-        {"user_id": uid, "total_hours": data["total_hours"], "shift_count": data["shift_count"]}
-        for uid, data in shift_summary.items()
+async def _staff_shifts(db, backend, date_from, date_to, waiter_id):
+    rows = await _staff_totals(db, backend, date_from, date_to, waiter_id)
+    return [
+        {"user_id": row["waiter_id"], "total_hours": row["total_hours"], "shift_count": row["shift_count"]}
+        for row in rows if row["shift_count"]
     ]
-    return result
-
-@router.get("/analytics/staff/revenue")
-async def staff_revenue(db=Depends(get_db)):
-    query = """
-    SELECT o.ent_instance_id AS order_id,
-           MAX(CASE WHEN o.attr_name = 'waiter_id' THEN o.value END) AS waiter_id,
-           MAX(CASE WHEN p.attr_name = 'total_price' THEN p.value END) AS total_price
-    FROM t_sys_attr_values o
-    JOIN t_sys_attr_values p ON o.ent_instance_id = p.ent_instance_id
-    WHERE o.ent_name = 'order' AND p.ent_name = 'order'
-    GROUP BY o.ent_instance_id
-    """
-    cursor = await db.execute(query)
-    rows = await cursor.fetchall()
 
-    from collections import defaultdict
-
-    revenue = defaultdict(float)
-    for row in rows:
-        if row["waiter_id"] and row["total_price"]:
-            revenue[row["waiter_id"]] += float(row["total_price"])
+@router.get("/analytics/staff/shifts")
+async def staff_shifts(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                       date_to: Optional[date] = Query(None, alias="to"),
+                       waiter_id: Optional[int] = None,
+                       backend: Literal["sql", "numpy"] = _backend()):
+    return await _cached(response, "staff-shifts", STAFF_ENTS, _staff_shifts,
+                         backend, date_from, date_to, waiter_id)
 
-    return [{"waiter_id": waiter_id, "total_revenue": round(total, 2)} for waiter_id, total in revenue.items()]
+@router.get("/analytics/staff/revenue")
+async def staff_revenue(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                        date_to: Optional[date] = Query(None, alias="to"),
+                        waiter_id: Optional[int] = None,
+                        backend: Literal["sql", "numpy"] = _backend()):
+    return await _cached(response, "staff-revenue", STAFF_ENTS, _staff_totals,
+                         backend, date_from, date_to, waiter_id)
+
+# По дням: строка на официанта и день
+async def _staff_daily(db, backend, date_from, date_to, waiter_id):
+    if backend == "numpy":
+        return (await columnar.get(db)).staff_daily(*columnar.days(date_from, date_to), waiter_id)
+    where, params = _staff_filter(date_from, date_to, waiter_id)
+    query = f'''
+    SELECT day, waiter_id, order_count, ROUND(revenue, 2) AS revenue, ROUND(hours, 2) AS hours, shift_count,
+           ROUND(revenue / NULLIF(hours, 0), 2) AS revenue_per_hour
+    FROM agg_staff_daily
+    WHERE {where}
+    ORDER BY day DESC, waiter_id
+    '''
+    cursor = await db.execute(query, params)
+    return [dict(row) for row in await cursor.fetchall()]
+
+@router.get("/analytics/staff/daily")
+async def staff_daily(response: Response, date_from: Optional[date] = Query(None, alias="from"),
+                      date_to: Optional[date] = Query(None, alias="to"),
+                      waiter_id: Optional[int] = None,
+                      backend: Literal["sql", "numpy"] = _backend()):
+    return await _cached(response, "staff-daily", STAFF_ENTS, _staff_daily,
+                         backend, date_from, date_to, waiter_id)
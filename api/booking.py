@@ -1,145 +1,231 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import List, Literal, Optional, Union
+
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from db import get_db
 from datetime import datetime
+from core import availability, refdata, writes
+from core.sequences import next_id, next_ids
+from core.loader import EntityLoader
+from core.paging import Page, page_ids, respond
+from core.coalesce import SingleFlightRoute
 
-router = APIRouter()
+# Одинаковые GET, пришедшие одновременно, считаются один раз (core/coalesce.py)
+router = APIRouter(route_class=SingleFlightRoute)
 
 class BookingIn(BaseModel):
     user_id: int
     datetime: str  # ISO формат
-    table_id: int
+    table_id: Union[int, Literal["auto"]]  # "auto" — подобрать самый маленький подходящий стол
+    guests: int
+    comment: str = ""
+    location: Optional[str] = None  # пожелание к залу для table_id = "auto"
+
+
+class AllocationRequest(BaseModel):
+    user_id: int
+    time: str  # ЧЧ:ММ
     guests: int
+    location: Optional[str] = None
     comment: str = ""
 
+
+class AllocationIn(BaseModel):
+    date: str  # ГГГГ-ММ-ДД
+    requests: List[AllocationRequest]
+    dry_run: bool = False
+
+
+def _start(value):
+    try:
+        return availability.to_minutes(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректная дата: {value}")
+
+
+def _booking_rows(booking_id, user_id, start, table_id, guests, comment, created_at):
+    return [
+        ('user_id', booking_id, str(user_id)),
+        ('datetime', booking_id, start),
+        ('table_id', booking_id, str(table_id)),
+        ('guests', booking_id, str(guests)),
+        ('comment', booking_id, comment),
+        ('created_at', booking_id, created_at)
+    ]
+
+
+# Проверка и вставка идут одной единицей писателя (core/writes.py) внутри BEGIN IMMEDIATE:
+# между чтением занятости и INSERT другой писатель (в том числе другой воркер) не вставит
+# бронь на тот же стол.
+# Занятость читается диапазоном по индексу booking.datetime, а не всеми бронями стола.
 @router.post("/booking")
-async def create_booking(booking: BookingIn, db=Depends(get_db)):
-    # Проверка: существует ли стол
-    cursor = await db.execute(
-        "SELECT value FROM t_sys_attr_values WHERE ent_name = 'table' AND attr_name = 'seats' AND ent_instance_id = ?",
-        (booking.table_id,)
-    )
-    row = await cursor.fetchone()
-    if not row:
-        raise HTTPException(status_code=404, detail="Столик не найден")
-
-    seats = int(row["value"])
-    if booking.guests > seats:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Столик рассчитан на {seats} человек, а гостей: {booking.guests}"
+async def create_booking(booking: BookingIn):
+    start = _start(booking.datetime)
+    end = start + availability.BOOKING_MINUTES
+
+    async def insert(db):
+        engine = await availability.window(db, start, end)
+
+        if booking.table_id == "auto":
+            free = engine.free_tables(start, end, booking.guests, booking.location)
+            if not free:
+                raise HTTPException(status_code=409, detail="Нет свободного стола на это время")
+            # candidates идут по возрастанию мест: первый свободный — самый тесный подходящий
+            table_id = free[0].table_id
+        else:
+            table_id = booking.table_id
+            table = engine.tables.get(table_id)
+            if table is None:
+                raise HTTPException(status_code=404, detail="Столик не найден")
+            if booking.guests > table.seats:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Столик рассчитан на {table.seats} человек, а гостей: {booking.guests}"
+                )
+            conflicts = table.overlapping(start, end)
+            if conflicts:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"message": "Столик уже забронирован на это время", "bookings": conflicts}
+                )
+
+        # Получаем новый booking_id
+        booking_id = await next_id(db, 'booking')
+
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('booking', ?, ?, ?)",
+            _booking_rows(booking_id, booking.user_id, booking.datetime, table_id, booking.guests,
+                          booking.comment, datetime.now().isoformat())
+        )
+        return booking_id, table_id
+
+    booking_id, table_id = await writes.submit(insert)
+    availability.booking_added(table_id, booking.datetime, booking_id)
+    return {"status": "created", "booking_id": booking_id, "table_id": table_id}
+
+
+# Рассадка пачки заявок (звонки, гости с улицы) на один вечер.
+# Жадно, как в bin packing «best fit decreasing»: сначала большие компании, каждой —
+# самый маленький свободный стол, куда она помещается. Так крупные столы не уходят
+# парам, пока их ждут компании. Всё в одной транзакции; dry_run только показывает план.
+@router.post("/booking/allocate")
+async def allocate_bookings(batch: AllocationIn):
+    starts = [_start(f"{batch.date}T{r.time}") for r in batch.requests]
+    if not starts:
+        return {"assigned": [], "rejected": [], "guests": 0}
+
+    async def allocate(db):
+        engine = await availability.window(db, min(starts), max(starts) + availability.BOOKING_MINUTES)
+
+        order = sorted(range(len(batch.requests)), key=lambda i: (-batch.requests[i].guests, starts[i]))
+        assigned, rejected = [], []
+        for i in order:
+            request, start = batch.requests[i], starts[i]
+            free = engine.free_tables(start, start + availability.BOOKING_MINUTES, request.guests, request.location)
+            if not free:
+                rejected.append({"index": i, "reason": "Нет свободного стола на это время"})
+                continue
+            table = free[0]
+            engine.add_booking(table.table_id, start, None)
+            assigned.append({
+                "index": i,
+                "table_id": table.table_id,
+                "table_number": table.number,
+                "seats": table.seats,
+                "datetime": availability.from_minutes(start).isoformat(timespec="minutes"),
+                "guests": request.guests,
+            })
+
+        assigned.sort(key=lambda a: a["index"])
+        rejected.sort(key=lambda r: r["index"])
+        result = {"assigned": assigned, "rejected": rejected, "guests": sum(a["guests"] for a in assigned)}
+        if batch.dry_run or not assigned:
+            return result
+
+        booking_ids = await next_ids(db, 'booking', len(assigned))
+        created_at = datetime.now().isoformat()
+        rows = []
+        for booking_id, a in zip(booking_ids, assigned):
+            a["booking_id"] = booking_id
+            request = batch.requests[a["index"]]
+            rows += _booking_rows(booking_id, request.user_id, a["datetime"], a["table_id"], request.guests,
+                                  request.comment, created_at)
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('booking', ?, ?, ?)",
+            rows
         )
+        return result
 
-    # Получаем новый booking_id
-    cursor = await db.execute(
-        "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'booking'"
-    )
-    booking_id = (await cursor.fetchone())[0]
+    result = await writes.submit(allocate)
+    if not batch.dry_run:
+        for a in result["assigned"]:
+            availability.booking_added(a["table_id"], a["datetime"], a["booking_id"])
+    return result
 
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('booking', ?, ?, ?)",
-        [
-            ('user_id', booking_id, str(booking.user_id)),
-            ('datetime', booking_id, booking.datetime),
-            ('table_id', booking_id, str(booking.table_id)),
-            ('guests', booking_id, str(booking.guests)),
-            ('comment', booking_id, booking.comment),
-            ('created_at', booking_id, datetime.now().isoformat())
-        ]
-    )
 
-    await db.commit()
-    return {"status": "created", "booking_id": booking_id}
+def _table_json(table_id, table):
+    if table is None:
+        return {"id": table_id, "number": 0, "seats": 0, "location": ""}
+    return {"id": table_id, "number": int(table.number or 0), "seats": table.seats, "location": table.location}
 
 
-@router.get("/booking/{user_id}")
-async def get_user_bookings(user_id: int, db=Depends(get_db)):
-    query = """
-    SELECT ent_instance_id AS booking_id
-    FROM t_sys_attr_values
-    WHERE ent_name = 'booking' AND attr_name = 'user_id' AND value = ?
-    """
-    cursor = await db.execute(query, (str(user_id),))
-    rows = await cursor.fetchall()
-    if not rows:
-        return {"bookings": []}
+async def _user_bookings_page(db, user_id, after, limit):
+    booking_ids, next_cursor = await page_ids(db, 'booking', after, limit, where_attr='user_id', where_value=user_id)
 
-    result = []
-    for row in rows:
-        bid = row["booking_id"]
+    # Брони читаются одной пачкой, столы — из справочника в памяти
+    loader = EntityLoader(db)
+    bookings = await loader.load_many('booking', booking_ids)
+    ref = await refdata.get(db)
 
-        cursor = await db.execute(
-            "SELECT attr_name, value FROM t_sys_attr_values WHERE ent_name = 'booking' AND ent_instance_id = ?",
-            (bid,)
-        )
-        booking_attrs = {r["attr_name"]: r["value"] for r in await cursor.fetchall()}
+    result = []
+    for bid, booking_attrs in bookings.items():
         table_id = int(booking_attrs.get("table_id", 0))
-
-        cursor = await db.execute(
-            "SELECT attr_name, value FROM t_sys_attr_values WHERE ent_name = 'table' AND ent_instance_id = ?",
-            (table_id,)
-        )
-        table_attrs = {r["attr_name"]: r["value"] for r in await cursor.fetchall()}
+        table = ref.table(table_id)
 
         result.append({
             "booking_id": bid,
             "datetime": booking_attrs.get("datetime"),
             "guests": int(booking_attrs.get("guests", 0)),
-            "table": {
-                "id": table_id,
-                "number": int(table_attrs.get("number", 0)),
-                "seats": int(table_attrs.get("seats", 0)),
-                "location": table_attrs.get("location", "")
-            },
+            "table": _table_json(table_id, table),
             "comment": booking_attrs.get("comment", ""),
             "created_at": booking_attrs.get("created_at")
         })
 
-    return {"bookings": result}
+    return result, next_cursor
 
 
-@router.get("/booking")
-async def get_all_bookings(db=Depends(get_db)):
-    query = """
-    SELECT DISTINCT ent_instance_id AS booking_id
-    FROM t_sys_attr_values
-    WHERE ent_name = 'booking'
-    """
-    cursor = await db.execute(query)
-    rows = await cursor.fetchall()
-    if not rows:
-        return {"bookings": []}
+@router.get("/booking/{user_id}")
+async def get_user_bookings(user_id: int, request: Request, page: Page = Depends(), db=Depends(get_db)):
+    async def fetch_page(db, after, limit):
+        return await _user_bookings_page(db, user_id, after, limit)
+    return await respond(request, db, page, fetch_page, wrap="bookings")
 
-    result = []
-    for row in rows:
-        bid = row["booking_id"]
 
-        cursor = await db.execute(
-            "SELECT attr_name, value FROM t_sys_attr_values WHERE ent_name = 'booking' AND ent_instance_id = ?",
-            (bid,)
-        )
-        booking_attrs = {r["attr_name"]: r["value"] for r in await cursor.fetchall()}
-        table_id = int(booking_attrs.get("table_id", 0))
+async def _bookings_page(db, after, limit):
+    booking_ids, next_cursor = await page_ids(db, 'booking', after, limit)
 
-        cursor = await db.execute(
-            "SELECT attr_name, value FROM t_sys_attr_values WHERE ent_name = 'table' AND ent_instance_id = ?",
-            (table_id,)
-        )
-        table_attrs = {r["attr_name"]: r["value"] for r in await cursor.fetchall()}
+    loader = EntityLoader(db)
+    bookings = await loader.load_many('booking', booking_ids)
+    ref = await refdata.get(db)
+
+    result = []
+    for bid, booking_attrs in bookings.items():
+        table_id = int(booking_attrs.get("table_id", 0))
+        table = ref.table(table_id)
 
         result.append({
             "booking_id": bid,
             "user_id": int(booking_attrs.get("user_id", 0)),
             "datetime": booking_attrs.get("datetime"),
             "guests": int(booking_attrs.get("guests", 0)),
-            "table": {
-                "id": table_id,
-                "number": int(table_attrs.get("number", 0)),
-                "seats": int(table_attrs.get("seats", 0)),
-                "location": table_attrs.get("location", "")
-            },
+            "table": _table_json(table_id, table),
             "comment": booking_attrs.get("comment", ""),
             "created_at": booking_attrs.get("created_at")
         })
 
-    return {"bookings": result}
\ No newline at end of file
+    return result, next_cursor
+
+
+@router.get("/booking")
+async def get_all_bookings(request: Request, page: Page = Depends(), db=Depends(get_db)):
+    return await respond(request, db, page, _bookings_page, wrap="bookings")
@@ -2,6 +2,8 @@ from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from db import get_db
 from datetime import datetime
+from core import writes
+from core.sequences import next_id
 
 router = APIRouter()
 
@@ -24,23 +26,23 @@ class ContactMessageIn(BaseModel):
     message: str
 
 @router.post("/contact_message")
-async def contact_message(data: ContactMessageIn, db=Depends(get_db)):
-    cursor = await db.execute(
-        "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'support_message'"
-    )
-    msg_id = (await cursor.fetchone())[0]
-
-    fields = [
-        ("name", data.name),
-        ("phone", data.phone),
-        ("message", data.message),
-        ("created_at", datetime.now().isoformat())
-    ]
-
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('support_message', ?, ?, ?)",
-        [(attr, msg_id, val) for attr, val in fields]
-    )
-    await db.commit()
+async def contact_message(data: ContactMessageIn):
+    async def insert(db):
+        msg_id = await next_id(db, 'support_message')
 
+        fields = [
+            ("name", data.name),
+            ("phone", data.phone),
+            ("message", data.message),
+            ("created_at", datetime.now().isoformat())
+        ]
+
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('support_message', ?, ?, ?)",
+            [(attr, msg_id, val) for attr, val in fields]
+        )
+
+        return msg_id
+
+    msg_id = await writes.submit(insert)
     return {"status": "received", "message_id": msg_id}
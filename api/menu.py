@@ -1,19 +1,28 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends
 from db import get_db
+from core.projections import entity_table
 
 router = APIRouter()
 
 @router.get("/menu")
-async def get_menu(db=Depends(get_db)):
-    query = """
-    SELECT
-        ent_instance_id AS dish_id,
-        MAX(CASE WHEN attr_name = 'name' THEN value END) AS name,
-        MAX(CASE WHEN attr_name = 'price' THEN value END) AS price
-    FROM t_sys_attr_values
-    WHERE ent_name = 'dish'
-    GROUP BY ent_instance_id
+async def get_menu(min_price: Optional[float] = None, max_price: Optional[float] = None, db=Depends(get_db)):
+    query = f"""
+    SELECT ent_instance_id AS dish_id, name, price
+    FROM {entity_table('dish', ('name', 'price'))}
+    """
+    params = ()
+    if min_price is not None or max_price is not None:
+        # Диапазон цен — по индексу idx_rng_dish__price на value_num
+        query += """
+    WHERE ent_instance_id IN (
+        SELECT ent_instance_id FROM t_sys_attr_values
+        WHERE ent_name = 'dish' AND attr_name = 'price' AND value_num >= ? AND value_num <= ?
+    )
     """
-    cursor = await db.execute(query)
+        params = (min_price if min_price is not None else float("-inf"),
+                  max_price if max_price is not None else float("inf"))
+    cursor = await db.execute(query, params)
     rows = await cursor.fetchall()
     return [dict(row) for row in rows]
@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from db import get_db
 from datetime import datetime
+from core import writes
+from core.sequences import next_id
+from core.paging import Page, page_rows, respond
+from core.coalesce import SingleFlightRoute
 
-router = APIRouter()
+# Одинаковые GET, пришедшие одновременно, считаются один раз (core/coalesce.py)
+router = APIRouter(route_class=SingleFlightRoute)
 
 #  Модель входа для публикации
 class NewsIn(BaseModel):
@@ -15,48 +20,39 @@ class NewsIn(BaseModel):
 
 #  POST /news — создать новость/акцию/событие
 @router.post("/news")
-async def create_news(data: NewsIn, db=Depends(get_db)):
-    cursor = await db.execute(
-        "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'news'"
-    )
-    news_id = (await cursor.fetchone())[0]
+async def create_news(data: NewsIn):
+    async def insert(db):
+        news_id = await next_id(db, 'news')
 
-    fields = [
-        ("title", data.title),
-        ("body", data.body),
-        ("type", data.type),
-        ("image_url", data.image_url),
-        ("tags", data.tags),
-        ("created_at", datetime.now().isoformat())
-    ]
+        fields = [
+            ("title", data.title),
+            ("body", data.body),
+            ("type", data.type),
+            ("image_url", data.image_url),
+            ("tags", data.tags),
+            ("created_at", datetime.now().isoformat())
+        ]
 
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('news', ?, ?, ?)",
-        [(attr, news_id, val) for attr, val in fields]
-    )
-    await db.commit()
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('news', ?, ?, ?)",
+            [(attr, news_id, val) for attr, val in fields]
+        )
 
+        return news_id
+
+    news_id = await writes.submit(insert)
     return {"status": "published", "news_id": news_id}
 
+async def _news_page(db, after, limit):
+    # Новые первыми: id растут вместе с created_at
+    fields = ('title', 'body', 'type', 'image_url', 'tags', 'created_at')
+    rows, next_cursor = await page_rows(db, 'news', fields, after, limit, desc=True)
+    return [{"news_id": row.pop("ent_instance_id"), **row} for row in rows], next_cursor
+
 #  GET /news — список всех публикаций
 @router.get("/news")
-async def get_all_news(db=Depends(get_db)):
-    query = """
-    SELECT ent_instance_id AS news_id,
-           MAX(CASE WHEN attr_name = 'title' THEN value END) AS title,
-           MAX(CASE WHEN attr_name = 'body' THEN value END) AS body,
-           MAX(CASE WHEN attr_name = 'type' THEN value END) AS type,
-           MAX(CASE WHEN attr_name = 'image_url' THEN value END) AS image_url,
-           MAX(CASE WHEN attr_name = 'tags' THEN value END) AS tags,
-           MAX(CASE WHEN attr_name = 'created_at' THEN value END) AS created_at
-    FROM t_sys_attr_values
-    WHERE ent_name = 'news'
-    GROUP BY ent_instance_id
-    ORDER BY created_at DESC
-    """
-    cursor = await db.execute(query)
-    rows = await cursor.fetchall()
-    return [dict(row) for row in rows]
+async def get_all_news(request: Request, page: Page = Depends(), db=Depends(get_db)):
+    return await respond(request, db, page, _news_page)
 
 #  GET /news/{id} — одна публикация
 @router.get("/news/{news_id}")
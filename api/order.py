@@ -1,16 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel
 from db import get_db
+from core import rollups, writes
+from core.sequences import next_id, next_ids
+from core.loader import EntityLoader
+from core.paging import Page, page_ids, respond
+from core.coalesce import SingleFlightRoute
 
-router = APIRouter()
+# Одинаковые GET, пришедшие одновременно, считаются один раз (core/coalesce.py)
+router = APIRouter(route_class=SingleFlightRoute)
 
 class OrderIn(BaseModel):
     user_id: int
     address_id: int
     status: str = "pending"  # по умолчанию
+    waiter_id: Optional[int] = None  # заказ в зале: кто обслуживал
 
-@router.post("/order")
-async def place_order(order: OrderIn, db=Depends(get_db)):
+# Оформление заказа за один проход внутри транзакции писателя (единица core/writes.py):
+# цены блюд одним запросом, id позиций одним резервом, все строки одним executemany
+async def checkout(db, order: OrderIn):
     # Получаем cart_id
     cursor = await db.execute(
         "SELECT ent_instance_id FROM t_sys_attr_values WHERE ent_name = 'cart' AND attr_name = 'user_id' AND value = ?",
@@ -39,65 +49,66 @@ async def place_order(order: OrderIn, db=Depends(get_db)):
     if not cart_items:
         raise HTTPException(status_code=404, detail="Корзина пуста")
 
-    # Получаем новый order_id
+    # Цены всех блюд корзины — одним запросом в той же транзакции: справочник в памяти
+    # не видит правок, закоммиченных этим же писателем (или идущих в этой же пачке),
+    # а в order_item.price копируется строка ровно в том виде, в каком её хранит dish
+    dish_ids = sorted({int(item["dish_id"]) for item in cart_items})
+    marks = ",".join("?" * len(dish_ids))
     cursor = await db.execute(
-        "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'order'"
+        f"SELECT ent_instance_id, value FROM t_sys_attr_values "
+        f"WHERE ent_name = 'dish' AND attr_name = 'price' AND ent_instance_id IN ({marks})",
+        dish_ids
     )
-    order_id = (await cursor.fetchone())[0]
+    prices = {r["ent_instance_id"]: r["value"] for r in await cursor.fetchall()}
+    missing = [d for d in dish_ids if d not in prices]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Блюда не найдены: {missing}")
 
     # Считаем сумму заказа
     total_price = 0.0
     for item in cart_items:
-        cursor = await db.execute(
-            "SELECT value FROM t_sys_attr_values WHERE ent_name = 'dish' AND attr_name = 'price' AND ent_instance_id = ?",
-            (item["dish_id"],)
-        )
-        price = float((await cursor.fetchone())["value"])
-        total_price += price * int(item["quantity"])
-
-    # Добавляем order (user_id, address_id, created_at, status, total_price)
+        total_price += float(prices[int(item["dish_id"])]) * int(item["quantity"])
+
+    order_id = await next_id(db, 'order')
+    order_item_ids = await next_ids(db, 'order_item', len(cart_items))
+
     from datetime import datetime
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('order', ?, ?, ?)",
-        [
-            ('user_id', order_id, str(order.user_id)),
-            ('address_id', order_id, str(order.address_id)),
-            ('status', order_id, order.status),
-            ('total_price', order_id, str(total_price)),
-            ('created_at', order_id, datetime.now().isoformat()),
+    created_at = datetime.now().isoformat()
+    rows = [
+        ('order', 'user_id', order_id, str(order.user_id)),
+        ('order', 'address_id', order_id, str(order.address_id)),
+        ('order', 'status', order_id, order.status),
+        ('order', 'total_price', order_id, str(total_price)),
+        ('order', 'created_at', order_id, created_at),
+    ]
+    if order.waiter_id is not None:
+        rows.append(('order', 'waiter_id', order_id, str(order.waiter_id)))
+    for order_item_id, item in zip(order_item_ids, cart_items):
+        rows += [
+            ('order_item', 'order_id', order_item_id, str(order_id)),
+            ('order_item', 'dish_id', order_item_id, str(item["dish_id"])),
+            ('order_item', 'quantity', order_item_id, str(item["quantity"])),
+            ('order_item', 'price', order_item_id, prices[int(item["dish_id"])]),
         ]
+    await db.executemany(
+        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES (?, ?, ?, ?)",
+        rows
     )
 
-    # Добавляем order_item для каждого блюда
-    for item in cart_items:
-        cursor = await db.execute(
-            "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'order_item'"
-        )
-        order_item_id = (await cursor.fetchone())[0]
-
-        cursor = await db.execute(
-            "SELECT value FROM t_sys_attr_values WHERE ent_name = 'dish' AND attr_name = 'price' AND ent_instance_id = ?",
-            (item["dish_id"],)
-        )
-        price = (await cursor.fetchone())["value"]
-
-        await db.executemany(
-            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('order_item', ?, ?, ?)",
-            [
-                ('order_id', order_item_id, str(order_id)),
-                ('dish_id', order_item_id, str(item["dish_id"])),
-                ('quantity', order_item_id, str(item["quantity"])),
-                ('price', order_item_id, price),
-            ]
-        )
-
     # Очищаем корзину
+    cart_item_ids = [item["cart_item_id"] for item in cart_items]
+    marks = ",".join("?" * len(cart_item_ids))
     await db.execute(
-        "DELETE FROM t_sys_attr_values WHERE ent_name = 'cart_item' AND ent_instance_id IN (" +
-        ",".join(str(row["cart_item_id"]) for row in cart_items) + ")"
+        f"DELETE FROM t_sys_attr_values WHERE ent_name = 'cart_item' AND ent_instance_id IN ({marks})",
+        cart_item_ids
     )
 
-    await db.commit()
+    # Дневные агрегаты аналитики — в той же транзакции, что и сам заказ
+    await rollups.order_placed(
+        db, created_at, total_price,
+        [(item["dish_id"], item["quantity"], prices[int(item["dish_id"])]) for item in cart_items],
+        order.waiter_id
+    )
 
     return {
         "status": "success",
@@ -106,49 +117,24 @@ async def place_order(order: OrderIn, db=Depends(get_db)):
         "items": len(cart_items)
     }
 
-@router.get("/orders/{user_id}")
-async def get_user_orders(user_id: int, db=Depends(get_db)):
-    # Находим все заказы пользователя
-    query = """
-    SELECT ent_instance_id AS order_id
-    FROM t_sys_attr_values
-    WHERE ent_name = 'order' AND attr_name = 'user_id' AND value = ?
-    """
-    cursor = await db.execute(query, (str(user_id),))
-    rows = await cursor.fetchall()
-
-    if not rows:
-        return {"orders": []}
+@router.post("/order")
+async def place_order(order: OrderIn):
+    # повтор при SQLITE_BUSY от писателя другого воркера — в core/writes.py
+    return await writes.submit(lambda db: checkout(db, order))
 
-    order_ids = [row["order_id"] for row in rows]
+async def _user_orders_page(db, user_id, after, limit):
+    # Заказы пользователя по частичному индексу order.user_id
+    order_ids, next_cursor = await page_ids(db, 'order', after, limit, where_attr='user_id', where_value=user_id)
     result = []
 
-    for order_id in order_ids:
-        # Получаем все атрибуты заказа
-        order_data_query = """
-        SELECT attr_name, value
-        FROM t_sys_attr_values
-        WHERE ent_name = 'order' AND ent_instance_id = ?
-        """
-        cursor = await db.execute(order_data_query, (order_id,))
-        attrs = {row["attr_name"]: row["value"] for row in await cursor.fetchall()}
-
-        # Получаем order_items
-        order_items_query = """
-        SELECT ent_instance_id AS order_item_id,
-               MAX(CASE WHEN attr_name = 'dish_id' THEN value END) AS dish_id,
-               MAX(CASE WHEN attr_name = 'quantity' THEN value END) AS quantity,
-               MAX(CASE WHEN attr_name = 'price' THEN value END) AS price
-        FROM t_sys_attr_values
-        WHERE ent_name = 'order_item'
-          AND ent_instance_id IN (
-            SELECT ent_instance_id FROM t_sys_attr_values
-            WHERE ent_name = 'order_item' AND attr_name = 'order_id' AND value = ?
-          )
-        GROUP BY ent_instance_id
-        """
-        cursor = await db.execute(order_items_query, (str(order_id),))
-        items = await cursor.fetchall()
+    # Заказы, их позиции и атрибуты позиций — три пакетных чтения вместо двух запросов на заказ
+    loader = EntityLoader(db)
+    orders = await loader.load_many('order', order_ids)
+    items_by_order = await loader.find('order_item', 'order_id', order_ids)
+    await loader.load_many('order_item', [i for ids in items_by_order.values() for i in ids])
+
+    for order_id, attrs in orders.items():
+        items = [loader.get('order_item', i) for i in items_by_order.get(str(order_id), [])]
 
         result.append({
             "order_id": order_id,
@@ -167,36 +153,23 @@ async def get_user_orders(user_id: int, db=Depends(get_db)):
             ]
         })
 
-    return {"orders": result}
+    return result, next_cursor
 
-@router.get("/orders")
-async def get_all_orders(db=Depends(get_db)):
-    # Получаем все уникальные order_id
-    query = """
-    SELECT DISTINCT ent_instance_id AS order_id
-    FROM t_sys_attr_values
-    WHERE ent_name = 'order'
-    """
-    cursor = await db.execute(query)
-    order_rows = await cursor.fetchall()
+@router.get("/orders/{user_id}")
+async def get_user_orders(user_id: int, request: Request, page: Page = Depends(), db=Depends(get_db)):
+    async def fetch_page(db, after, limit):
+        return await _user_orders_page(db, user_id, after, limit)
+    return await respond(request, db, page, fetch_page, wrap="orders")
 
-    if not order_rows:
-        return {"orders": []}
+async def _orders_page(db, after, limit):
+    # Очередная страница order_id по индексу (ent_name, ent_instance_id)
+    order_ids, next_cursor = await page_ids(db, 'order', after, limit)
 
     result = []
 
-    for row in order_rows:
-        order_id = row["order_id"]
-
-        # Получаем атрибуты заказа
-        query_attrs = """
-        SELECT attr_name, value
-        FROM t_sys_attr_values
-        WHERE ent_name = 'order' AND ent_instance_id = ?
-        """
-        cursor = await db.execute(query_attrs, (order_id,))
-        attrs = {r["attr_name"]: r["value"] for r in await cursor.fetchall()}
-
+    loader = EntityLoader(db)
+    orders = await loader.load_many('order', order_ids)
+    for order_id, attrs in orders.items():
         result.append({
             "order_id": order_id,
             "user_id": int(attrs.get("user_id", 0)),
@@ -206,4 +179,8 @@ async def get_all_orders(db=Depends(get_db)):
             "created_at": attrs.get("created_at", "unknown")
         })
 
-    return {"orders": result}
+    return result, next_cursor
+
+@router.get("/orders")
+async def get_all_orders(request: Request, page: Page = Depends(), db=Depends(get_db)):
+    return await respond(request, db, page, _orders_page, wrap="orders")
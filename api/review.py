@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 from datetime import datetime
 from db import get_db
+from core import writes
+from core.sequences import next_id
+from core.paging import Page, page_rows, respond
+from core.coalesce import SingleFlightRoute
 
-router = APIRouter()
+# Одинаковые GET, пришедшие одновременно, считаются один раз (core/coalesce.py)
+router = APIRouter(route_class=SingleFlightRoute)
 
 # ✅ Модель отзыва
 class ReviewIn(BaseModel):
@@ -15,80 +20,59 @@ class ReviewIn(BaseModel):
 
 # ✅ POST /review
 @router.post("/review")
-async def add_review(review: ReviewIn, db=Depends(get_db)):
+async def add_review(review: ReviewIn):
     if not review.dish_id and not review.is_restaurant:
         raise HTTPException(status_code=400, detail="Нужно указать dish_id или is_restaurant=True")
 
-    # получаем новый review_id
-    cursor = await db.execute(
-        "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'review'"
-    )
-    review_id = (await cursor.fetchone())[0]
+    async def insert(db):
+        # получаем новый review_id
+        review_id = await next_id(db, 'review')
 
-    data = [
-        ("user_id", str(review.user_id)),
-        ("rating", str(review.rating)),
-        ("comment", review.comment),
-        ("created_at", datetime.now().isoformat())
-    ]
-    if review.dish_id:
-        data.append(("dish_id", str(review.dish_id)))
-    if review.is_restaurant:
-        data.append(("restaurant", "true"))
+        data = [
+            ("user_id", str(review.user_id)),
+            ("rating", str(review.rating)),
+            ("comment", review.comment),
+            ("created_at", datetime.now().isoformat())
+        ]
+        if review.dish_id:
+            data.append(("dish_id", str(review.dish_id)))
+        if review.is_restaurant:
+            data.append(("restaurant", "true"))
 
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('review', ?, ?, ?)",
-        [(attr, review_id, val) for attr, val in data]
-    )
-    await db.commit()
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('review', ?, ?, ?)",
+            [(attr, review_id, val) for attr, val in data]
+        )
+        return review_id
+
+    review_id = await writes.submit(insert)
     return {"status": "created", "review_id": review_id}
 
+REVIEW_FIELDS = ('user_id', 'rating', 'comment', 'created_at')
+
+async def _reviews_page(db, attr_name, value, after, limit):
+    # Новые первыми; отзывы отбираются по частичному индексу review.<attr_name>
+    rows, next_cursor = await page_rows(
+        db, 'review', REVIEW_FIELDS, after, limit, desc=True, where_attr=attr_name, where_value=value
+    )
+    return [{"review_id": row.pop("ent_instance_id"), **row} for row in rows], next_cursor
+
 @router.get("/reviews/dish/{dish_id}")
-async def get_reviews_for_dish(dish_id: int, db=Depends(get_db)):
-    query = """
-    SELECT r1.ent_instance_id AS review_id,
-           MAX(CASE WHEN attr_name = 'user_id' THEN value END) AS user_id,
-           MAX(CASE WHEN attr_name = 'rating' THEN value END) AS rating,
-           MAX(CASE WHEN attr_name = 'comment' THEN value END) AS comment,
-           MAX(CASE WHEN attr_name = 'created_at' THEN value END) AS created_at
-    FROM t_sys_attr_values r1
-    WHERE ent_name = 'review'
-      AND ent_instance_id IN (
-        SELECT ent_instance_id FROM t_sys_attr_values
-        WHERE ent_name = 'review' AND attr_name = 'dish_id' AND value = ?
-      )
-    GROUP BY r1.ent_instance_id
-    ORDER BY created_at DESC
-    """
-    cursor = await db.execute(query, (str(dish_id),))
-    rows = await cursor.fetchall()
-    return [dict(row) for row in rows]
+async def get_reviews_for_dish(dish_id: int, request: Request, page: Page = Depends(), db=Depends(get_db)):
+    async def fetch_page(db, after, limit):
+        return await _reviews_page(db, 'dish_id', dish_id, after, limit)
+    return await respond(request, db, page, fetch_page)
 
 @router.get("/reviews/restaurant")
-async def get_reviews_for_restaurant(db=Depends(get_db)):
-    query = """
-    SELECT r1.ent_instance_id AS review_id,
-           MAX(CASE WHEN attr_name = 'user_id' THEN value END) AS user_id,
-           MAX(CASE WHEN attr_name = 'rating' THEN value END) AS rating,
-           MAX(CASE WHEN attr_name = 'comment' THEN value END) AS comment,
-           MAX(CASE WHEN attr_name = 'created_at' THEN value END) AS created_at
-    FROM t_sys_attr_values r1
-    WHERE ent_name = 'review'
-      AND ent_instance_id IN (
-        SELECT ent_instance_id FROM t_sys_attr_values
-        WHERE ent_name = 'review' AND attr_name = 'restaurant' AND value = 'true'
-      )
-    GROUP BY r1.ent_instance_id
-    ORDER BY created_at DESC
-    """
-    cursor = await db.execute(query)
-    rows = await cursor.fetchall()
-    return [dict(row) for row in rows]
+async def get_reviews_for_restaurant(request: Request, page: Page = Depends(), db=Depends(get_db)):
+    async def fetch_page(db, after, limit):
+        return await _reviews_page(db, 'restaurant', 'true', after, limit)
+    return await respond(request, db, page, fetch_page)
 
 @router.get("/rating/dish/{dish_id}")
 async def get_dish_rating(dish_id: int, db=Depends(get_db)):
     query = """
-    SELECT AVG(CAST(value AS FLOAT)) AS avg_rating
+    SELECT AVG(value_num) AS avg_rating
     FROM t_sys_attr_values
     WHERE ent_name = 'review' AND attr_name = 'rating'
       AND ent_instance_id IN (
@@ -103,7 +87,7 @@ async def get_dish_rating(dish_id: int, db=Depends(get_db)):
 @router.get("/rating/restaurant")
 async def get_restaurant_rating(db=Depends(get_db)):
     query = """
-    SELECT AVG(CAST(value AS FLOAT)) AS avg_rating
+    SELECT AVG(value_num) AS avg_rating
     FROM t_sys_attr_values
     WHERE ent_name = 'review' AND attr_name = 'rating'
       AND ent_instance_id IN (
@@ -1,132 +1,109 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from db import get_db
-from datetime import datetime, timedelta
+from core import availability
+from core.projections import entity_table
 
 router = APIRouter()
 
 #  Все столы
 @router.get("/tables")
 async def get_all_tables(db=Depends(get_db)):
-    query = """
-    SELECT ent_instance_id AS table_id,
-           MAX(CASE WHEN attr_name = 'number' THEN value END) AS number,
-           MAX(CASE WHEN attr_name = 'seats' THEN value END) AS seats,
-           MAX(CASE WHEN attr_name = 'location' THEN value END) AS location
-    FROM t_sys_attr_values
-    WHERE ent_name = 'table'
-    GROUP BY ent_instance_id
+    query = f"""
+    SELECT ent_instance_id AS table_id, number, seats, location
+    FROM {entity_table('table', ('number', 'seats', 'location'))}
     ORDER BY number
     """
     cursor = await db.execute(query)
     rows = await cursor.fetchall()
     return [dict(row) for row in rows]
 
+def _window(datetime_str, duration_minutes):
+    try:
+        start = availability.to_minutes(datetime_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат времени")
+    return start, start + duration_minutes
+
 #  Доступность по дате/времени
 @router.get("/tables/availability")
-async def get_table_availability(datetime: str = Query(...), db=Depends(get_db)):
-    table_query = """
-    SELECT ent_instance_id AS table_id,
-           MAX(CASE WHEN attr_name = 'number' THEN value END) AS number,
-           MAX(CASE WHEN attr_name = 'seats' THEN value END) AS seats,
-           MAX(CASE WHEN attr_name = 'location' THEN value END) AS location
-    FROM t_sys_attr_values
-    WHERE ent_name = 'table'
-    GROUP BY ent_instance_id
-    ORDER BY number
-    """
-    cursor = await db.execute(table_query)
-    tables = await cursor.fetchall()
-
-    result = []
-    for row in tables:
-        table_id = row["table_id"]
-
-        check_query = """
-        SELECT 1 FROM t_sys_attr_values
-        WHERE ent_name = 'booking' AND attr_name = 'table_id' AND value = ?
-          AND ent_instance_id IN (
-            SELECT ent_instance_id FROM t_sys_attr_values
-            WHERE ent_name = 'booking' AND attr_name = 'datetime' AND value = ?
-          )
-        """
-        cursor = await db.execute(check_query, (str(table_id), datetime))
-        is_busy = await cursor.fetchone()
-
-        result.append({
-            "table_id": table_id,
-            "number": row["number"],
-            "seats": int(row["seats"]),
-            "location": row["location"],
-            "is_available": not bool(is_busy)
-        })
+async def get_table_availability(
+    datetime: str = Query(...),
+    duration_minutes: int = Query(availability.BOOKING_MINUTES, ge=1),
+    db=Depends(get_db)
+):
+    start, end = _window(datetime, duration_minutes)
+    engine = await availability.get(db)
 
+    result = [
+        {
+            "table_id": t.table_id,
+            "number": t.number,
+            "seats": t.seats,
+            "location": t.location,
+            "is_available": t.is_free(start, end)
+        }
+        for t in engine.tables.values()
+    ]
+    result.sort(key=lambda t: str(t["number"]))
     return result
 
 #  Только свободные с фильтрацией
 @router.get("/tables/free")
 async def get_free_tables(
     datetime_str: str = Query(..., alias="datetime"),
-    duration_minutes: int = Query(120),
+    duration_minutes: int = Query(availability.BOOKING_MINUTES, ge=1),
     min_seats: int = Query(1),
     location: str = Query(None),
     db=Depends(get_db)
 ):
-    try:
-        start = datetime.fromisoformat(datetime_str)
-        end = start + timedelta(minutes=duration_minutes)
-    except ValueError:
-        raise HTTPException(status_code=400, detail="Неверный формат времени")
-
-    base_query = """
-    SELECT ent_instance_id AS table_id,
-           MAX(CASE WHEN attr_name = 'number' THEN value END) AS number,
-           MAX(CASE WHEN attr_name = 'seats' THEN value END) AS seats,
-           MAX(CASE WHEN attr_name = 'location' THEN value END) AS location
-    FROM t_sys_attr_values
-    WHERE ent_name = 'table'
-    GROUP BY ent_instance_id
-    HAVING CAST(MAX(CASE WHEN attr_name = 'seats' THEN value END) AS INT) >= ?
-    """
-    if location:
-        base_query += " AND MAX(CASE WHEN attr_name = 'location' THEN value END) = ?"
-        params = (min_seats, location)
-    else:
-        params = (min_seats,)
+    start, end = _window(datetime_str, duration_minutes)
+    engine = await availability.get(db)
 
-    cursor = await db.execute(base_query, params)
-    tables = await cursor.fetchall()
+    return [
+        {"table_id": t.table_id, "number": t.number, "seats": t.seats, "location": t.location}
+        for t in engine.free_tables(start, end, min_seats, location)
+    ]
 
-    result = []
-    for row in tables:
-        table_id = row["table_id"]
-
-        booking_query = '''
-        SELECT value FROM t_sys_attr_values
-        WHERE ent_name = 'booking' AND attr_name = 'datetime' AND ent_instance_id IN (
-            SELECT ent_instance_id FROM t_sys_attr_values
-            WHERE ent_name = 'booking' AND attr_name = 'table_id' AND value = ?
-        )
-        '''
-        cursor = await db.execute(booking_query, (str(table_id),))
-        bookings = await cursor.fetchall()
+#  Сетка занятости всех столов на вечер: по слоту на каждые step минут
+@router.get("/tables/grid")
+async def get_tables_grid(
+    date: str = Query(..., description="YYYY-MM-DD"),
+    start: str = Query("17:00"),
+    end: str = Query("23:00"),
+    step: int = Query(15, ge=5, le=120),
+    duration_minutes: int = Query(None, ge=1, description="слот свободен, только если стол свободен столько минут подряд"),
+    min_seats: int = Query(1),
+    location: str = Query(None),
+    db=Depends(get_db)
+):
+    try:
+        first = availability.to_minutes(f"{date}T{start}")
+        last = availability.to_minutes(f"{date}T{end}")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Неверный формат даты или времени")
+    if last <= first:
+        raise HTTPException(status_code=400, detail="Конец вечера раньше начала")
 
-        conflict = False
-        for b in bookings:
-            try:
-                b_start = datetime.fromisoformat(b["value"])
-                b_end = b_start + timedelta(minutes=duration_minutes)
-                if (start < b_end) and (end > b_start):
-                    conflict = True
-                    break
-            except:
-                continue
+    slots = list(range(first, last, step))
+    length = duration_minutes or step
+    engine = await availability.get(db)
 
-        if not conflict:
-            result.append({
-                "table_id": table_id,
-                "number": row["number"],
-                "seats": int(row["seats"]),
-                "location": row["location"]
-            })
+    tables = []
+    for t in engine.candidates(min_seats, location):
+        # Брони стола за вечер берутся одним бинарным поиском, слоты размечаются по ним
+        busy = t.busy_between(first, slots[-1] + length)
+        free = [all(b_end <= slot or b_start >= slot + length for b_start, b_end in busy) for slot in slots]
+        tables.append({
+            "table_id": t.table_id,
+            "number": t.number,
+            "seats": t.seats,
+            "location": t.location,
+            "free": free
+        })
 
-    return result
+    return {
+        "date": date,
+        "step": step,
+        "slots": [availability.from_minutes(slot).strftime("%H:%M") for slot in slots],
+        "tables": tables
+    }
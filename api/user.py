@@ -1,9 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from pydantic import BaseModel, Field
 from db import get_db
 from datetime import datetime
+from core import writes
+from core.sequences import next_id
+from core.loader import EntityLoader
+from core.paging import Page, page_ids, respond
+from core.coalesce import SingleFlightRoute
 
-router = APIRouter()
+# Одинаковые GET, пришедшие одновременно, считаются один раз (core/coalesce.py)
+router = APIRouter(route_class=SingleFlightRoute)
 
 #  Модель регистрации
 class UserRegisterIn(BaseModel):
@@ -18,43 +24,44 @@ class UserRegisterIn(BaseModel):
 
 #  POST /register
 @router.post("/register")
-async def register_user(user: UserRegisterIn, db=Depends(get_db)):
-    # Проверка по телефону
-    check_query = """
-    SELECT ent_instance_id FROM t_sys_attr_values
-    WHERE ent_name = 'user' AND attr_name = 'phone' AND value = ?
-    """
-    cursor = await db.execute(check_query, (user.phone,))
-    if await cursor.fetchone():
-        raise HTTPException(status_code=400, detail="Пользователь с таким телефоном уже зарегистрирован")
-
-    # Получаем новый user_id
-    cursor = await db.execute(
-        "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'user'"
-    )
-    user_id = (await cursor.fetchone())[0]
-
-    # Все поля + лояльность
-    fields = [
-        ('name', user.name),
-        ('phone', user.phone),
-        ('city', user.city),
-        ('street', user.street),
-        ('house', user.house),
-        ('building', user.building),
-        ('floor', user.floor),
-        ('flat', user.flat),
-        ('created_at', datetime.now().isoformat()),
-        ('loyalty_discount', "3"),      # стартовая скидка 3%
-        ('loyalty_total', "0")          # сумма заказов
-    ]
-
-    await db.executemany(
-        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('user', ?, ?, ?)",
-        [(attr, user_id, val) for attr, val in fields]
-    )
-    await db.commit()
+async def register_user(user: UserRegisterIn):
+    # Проверка телефона и вставка — одной единицей писателя, без гонки двух регистраций
+    async def insert(db):
+        # Проверка по телефону
+        check_query = """
+        SELECT ent_instance_id FROM t_sys_attr_values
+        WHERE ent_name = 'user' AND attr_name = 'phone' AND value = ?
+        """
+        cursor = await db.execute(check_query, (user.phone,))
+        if await cursor.fetchone():
+            raise HTTPException(status_code=400, detail="Пользователь с таким телефоном уже зарегистрирован")
+
+        # Получаем новый user_id
+        user_id = await next_id(db, 'user')
+
+        # Все поля + лояльность
+        fields = [
+            ('name', user.name),
+            ('phone', user.phone),
+            ('city', user.city),
+            ('street', user.street),
+            ('house', user.house),
+            ('building', user.building),
+            ('floor', user.floor),
+            ('flat', user.flat),
+            ('created_at', datetime.now().isoformat()),
+            ('loyalty_discount', "3"),      # стартовая скидка 3%
+            ('loyalty_total', "0")          # сумма заказов
+        ]
+
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('user', ?, ?, ?)",
+            [(attr, user_id, val) for attr, val in fields]
+        )
 
+        return user_id
+
+    user_id = await writes.submit(insert)
     return {"status": "registered", "user_id": user_id}
 
 #  GET /user/{user_id}
@@ -74,26 +81,13 @@ async def get_user_profile(user_id: int, db=Depends(get_db)):
     profile["user_id"] = user_id
     return profile
 
-# Получение всех пользователей
-@router.get("/users")
-async def get_all_users(db=Depends(get_db)):
-    query_ids = """
-    SELECT DISTINCT ent_instance_id AS user_id
-    FROM t_sys_attr_values
-    WHERE ent_name = 'user'
-    ORDER BY user_id
-    """
-    cursor = await db.execute(query_ids)
-    users = await cursor.fetchall()
+async def _users_page(db, after, limit):
+    user_ids, next_cursor = await page_ids(db, 'user', after, limit)
     result = []
 
-    for row in users:
-        user_id = row["user_id"]
-        cursor = await db.execute(
-            "SELECT attr_name, value FROM t_sys_attr_values WHERE ent_name = 'user' AND ent_instance_id = ?",
-            (user_id,)
-        )
-        attrs = {r["attr_name"]: r["value"] for r in await cursor.fetchall()}
+    loader = EntityLoader(db)
+    profiles = await loader.load_many('user', user_ids)
+    for user_id, attrs in profiles.items():
         result.append({
             "user_id": user_id,
             "name": attrs.get("name"),
@@ -103,7 +97,12 @@ async def get_all_users(db=Depends(get_db)):
             "loyalty_total": attrs.get("loyalty_total")
         })
 
-    return result
+    return result, next_cursor
+
+# Получение всех пользователей
+@router.get("/users")
+async def get_all_users(request: Request, page: Page = Depends(), db=Depends(get_db)):
+    return await respond(request, db, page, _users_page)
 
 class LoginIn(BaseModel):
     phone: str
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from datetime import date
+
+import db as database
+from api import analytics
+from bench.endpoints import prepared_db
+from core import columnar, rollups
+
+# Отчёты аналитики двумя бэкендами на одной базе: sql (таблицы агрегатов rollups)
+# против numpy (колоночный снимок core/columnar.py), плюс время сборки снимка.
+# Для справки — тот же отчёт пивотом прямо по t_sys_attr_values, без агрегатов.
+#   python -m bench.analytics --items 1000000 --runs 20
+
+# Позиций в среднем на заказ у сидера (веса 1..6 строк в Seeder)
+LINES_PER_ORDER = 2.9
+
+REPORTS = (
+    ("daily-orders", analytics._daily_orders, (None, None)),
+    ("revenue-by-day", analytics._revenue_by_day, (None, None)),
+    ("popular-dishes", analytics._popular_dishes, (None, None, 10)),
+    ("popular-dishes/month", analytics._popular_dishes, (date(2025, 6, 1), date(2025, 6, 30), 10)),
+    ("staff/revenue", analytics._staff_totals, (None, None, None)),
+    ("staff/daily", analytics._staff_daily, (None, None, None)),
+    ("staff/daily?waiter", analytics._staff_daily, (None, None, 3)),
+)
+
+_ORDERS = rollups._ORDERS.format(where="")
+
+# Отчёты без агрегатов: пивот по t_sys_attr_values на каждый запрос
+PIVOTS = {
+    "daily-orders": f"SELECT day, COUNT(*) FROM ({_ORDERS}) WHERE day IS NOT NULL GROUP BY day ORDER BY day DESC",
+    "revenue-by-day": f"SELECT day, SUM(total) FROM ({_ORDERS}) WHERE day IS NOT NULL GROUP BY day ORDER BY day DESC",
+    "popular-dishes": """
+        SELECT d.value_num AS dish_id, SUM(q.value_num) AS qty
+        FROM t_sys_attr_values d
+        JOIN t_sys_attr_values q
+          ON q.ent_name = 'order_item' AND q.attr_name = 'quantity' AND q.ent_instance_id = d.ent_instance_id
+        WHERE d.ent_name = 'order_item' AND d.attr_name = 'dish_id'
+        GROUP BY d.value_num ORDER BY qty DESC LIMIT 10
+    """,
+}
+
+
+async def timed(call, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+async def main(args):
+    orders = int(args.items / LINES_PER_ORDER)
+    path = await prepared_db(orders, args)
+    db = await database.connect(path, readonly=True)
+    try:
+        items = (await db.execute_fetchall(
+            "SELECT COUNT(*) FROM t_sys_attr_values WHERE ent_name = 'order_item' AND attr_name = 'order_id'"
+        ))[0][0]
+        print(f"База {path}: {orders} заказов, {items} позиций")
+
+        database.DB_PATH = path
+        build = await timed(columnar.build, max(1, args.runs // 5))
+        print(f"Сборка снимка: {build:.1f} мс\n")
+        columnar.invalidate()
+        await columnar.get(db)
+
+        print(f"  {'отчёт':<22} {'пивот, мс':>10} {'sql, мс':>10} {'numpy, мс':>10} {'к пивоту':>9} {'к sql':>7}")
+        for name, report, params in REPORTS:
+            sql = await timed(lambda: report(db, "sql", *params), args.runs)
+            vec = await timed(lambda: report(db, "numpy", *params), args.runs)
+            if name in PIVOTS:
+                pivot = await timed(lambda: db.execute_fetchall(PIVOTS[name]), max(1, args.runs // 5))
+                print(f"  {name:<22} {pivot:>10.2f} {sql:>10.2f} {vec:>10.2f} {pivot / vec:>8.1f}x {sql / vec:>6.1f}x")
+            else:
+                print(f"  {name:<22} {'—':>10} {sql:>10.2f} {vec:>10.2f} {'—':>9} {sql / vec:>6.1f}x")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQL против NumPy-снимка для аналитики")
+    parser.add_argument("--items", type=int, default=1000000, help="позиций заказов в базе")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2025, 1, 1))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--template", default=database.DB_PATH, help="база со схемой, на основе которой сеять")
+    parser.add_argument("--cache", default=os.path.join(tempfile.gettempdir(), "restoflow-bench"))
+    asyncio.run(main(parser.parse_args()))
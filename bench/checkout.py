@@ -0,0 +1,149 @@
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import db as database
+from api.order import OrderIn, checkout
+from core import sequences
+from core.schema import migrate
+
+# Сравнение оформления заказа: прежний путь (MAX+1 и цена на каждую позицию)
+# против checkout() из api/order.py на корзинах из 1, 10 и 50 позиций.
+#   python -m bench.checkout --runs 200
+
+DISHES = 50
+
+
+async def legacy_place_order(db, user_id):
+    cursor = await db.execute(
+        "SELECT ent_instance_id FROM t_sys_attr_values WHERE ent_name = 'cart' AND attr_name = 'user_id' AND value = ?",
+        (str(user_id),)
+    )
+    cart_id = (await cursor.fetchone())["ent_instance_id"]
+    cursor = await db.execute("""
+    SELECT ent_instance_id AS cart_item_id,
+           MAX(CASE WHEN attr_name = 'dish_id' THEN value END) AS dish_id,
+           MAX(CASE WHEN attr_name = 'quantity' THEN value END) AS quantity
+    FROM t_sys_attr_values
+    WHERE ent_name = 'cart_item'
+      AND ent_instance_id IN (
+        SELECT ent_instance_id FROM t_sys_attr_values
+        WHERE ent_name = 'cart_item' AND attr_name = 'cart_id' AND value = ?
+      )
+    GROUP BY ent_instance_id
+    """, (str(cart_id),))
+    cart_items = await cursor.fetchall()
+    cursor = await db.execute(
+        "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'order'"
+    )
+    order_id = (await cursor.fetchone())[0]
+    total_price = 0.0
+    for item in cart_items:
+        cursor = await db.execute(
+            "SELECT value FROM t_sys_attr_values WHERE ent_name = 'dish' AND attr_name = 'price' AND ent_instance_id = ?",
+            (item["dish_id"],)
+        )
+        total_price += float((await cursor.fetchone())["value"]) * int(item["quantity"])
+    await db.executemany(
+        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('order', ?, ?, ?)",
+        [('user_id', order_id, str(user_id)), ('address_id', order_id, '1'), ('status', order_id, 'pending'),
+         ('total_price', order_id, str(total_price)), ('created_at', order_id, '2025-01-01T12:00:00')]
+    )
+    for item in cart_items:
+        cursor = await db.execute(
+            "SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = 'order_item'"
+        )
+        order_item_id = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT value FROM t_sys_attr_values WHERE ent_name = 'dish' AND attr_name = 'price' AND ent_instance_id = ?",
+            (item["dish_id"],)
+        )
+        price = (await cursor.fetchone())["value"]
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('order_item', ?, ?, ?)",
+            [('order_id', order_item_id, str(order_id)), ('dish_id', order_item_id, str(item["dish_id"])),
+             ('quantity', order_item_id, str(item["quantity"])), ('price', order_item_id, price)]
+        )
+    await db.execute(
+        "DELETE FROM t_sys_attr_values WHERE ent_name = 'cart_item' AND ent_instance_id IN (" +
+        ",".join(str(row["cart_item_id"]) for row in cart_items) + ")"
+    )
+    await db.commit()
+
+
+async def prepare(path):
+    db = await database.connect(path)
+    await db.execute_fetchall("PRAGMA journal_mode = WAL")
+    await migrate(db)
+    await sequences.sync(db)
+    await db.executemany(
+        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES ('dish', ?, ?, ?)",
+        [(attr, d, val) for d in range(1, DISHES + 1) for attr, val in (("name", f"Блюдо {d}"), ("price", str(100 + d)))]
+    )
+    await db.commit()
+    await sequences.sync(db)
+    return db
+
+
+async def fill_cart(db, user_id, lines):
+    cart_id = await sequences.next_id(db, 'cart')
+    rows = [('cart', 'user_id', cart_id, str(user_id))]
+    for item_id, dish_id in zip(await sequences.next_ids(db, 'cart_item', lines), range(1, lines + 1)):
+        rows += [('cart_item', 'cart_id', item_id, str(cart_id)), ('cart_item', 'dish_id', item_id, str(dish_id)),
+                 ('cart_item', 'quantity', item_id, '2')]
+    await db.executemany(
+        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES (?, ?, ?, ?)", rows
+    )
+    await db.commit()
+    sequences.committed()
+
+
+async def measure(path, lines, runs, new_path):
+    db = await prepare(path)
+    timings = []
+    try:
+        for run in range(runs):
+            user_id = lines * 100000 + run
+            await fill_cart(db, user_id, lines)
+            started = time.perf_counter()
+            if new_path:
+                # так checkout выполняет писатель core/writes.py, только без пачки
+                await db.execute("BEGIN IMMEDIATE")
+                await checkout(db, OrderIn(user_id=user_id, address_id=1))
+                await db.commit()
+                sequences.committed()
+            else:
+                await legacy_place_order(db, user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+    finally:
+        await db.close()
+    return timings
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print(f"{'позиций':>8} {'путь':>8} {'p50, мс':>10} {'p95, мс':>10} {'среднее':>10}")
+        for lines in args.sizes:
+            for name, new_path in (("legacy", False), ("pipeline", True)):
+                path = os.path.join(workdir, f"{name}_{lines}.db")
+                shutil.copy(database.DB_PATH, path)
+                timings = sorted(await measure(path, lines, args.runs, new_path))
+                p95 = timings[int(len(timings) * 0.95) - 1]
+                print(f"{lines:>8} {name:>8} {statistics.median(timings):>10.2f} {p95:>10.2f} "
+                      f"{statistics.mean(timings):>10.2f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
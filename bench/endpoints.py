@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import httpx
+
+import db as database
+from core.schema import migrate
+from core.seed import Seeder, seed
+
+# Нагрузочный прогон API на засеянных базах разного размера.
+# Смесь сценариев (меню, поиск столов, корзина, оформление заказа, брони, аналитика)
+# крутится заданным числом параллельных клиентов; по каждому маршруту считаются
+# p50/p95/p99, итог пишется в JSON. Сравнение двух JSON показывает замедления.
+#   python -m bench.endpoints --sizes 10000 100000 --concurrency 1 8 --duration 15 --out after.json
+#   python -m bench.endpoints --uvicorn --sizes 100000 --concurrency 16
+#   python -m bench.endpoints compare before.json after.json --threshold 0.2
+
+# Сценарий: (вес, функция); маршрут в отчёте — шаблон пути, а не конкретный URL
+ANALYTICS = ("/analytics/daily-orders", "/analytics/popular-dishes",
+             "/analytics/revenue-by-day", "/analytics/user-loyalty")
+BOOKING_SLOTS = ("12:00", "14:00", "16:00", "18:00", "20:00")
+
+
+class Session:
+    def __init__(self, client, refs, rng, samples):
+        self.client = client
+        self.refs = refs
+        self.rng = rng
+        self.samples = samples
+
+    async def call(self, route, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            ok = response.status_code < 500
+        except httpx.HTTPError:
+            ok = False
+        self.samples.setdefault(route, []).append(((time.perf_counter() - started) * 1000, ok))
+
+    def day(self):
+        return self.refs["start"] + timedelta(days=self.rng.randrange(self.refs["days"]))
+
+    async def browse_menu(self):
+        dish_id = self.rng.choice(self.refs["dish"])
+        await self.call("GET /menu", "GET", "/menu")
+        await self.call("GET /reviews/dish/{id}", "GET", f"/reviews/dish/{dish_id}", params={"limit": 20})
+        await self.call("GET /rating/dish/{id}", "GET", f"/rating/dish/{dish_id}")
+
+    async def find_table(self):
+        when = f"{self.day().isoformat()}T{self.rng.choice(BOOKING_SLOTS)}"
+        await self.call("GET /tables/free", "GET", "/tables/free",
+                        params={"datetime": when, "min_seats": self.rng.choice((1, 2, 4))})
+
+    async def add_to_cart(self):
+        await self.call("POST /cart/add", "POST", "/cart/add", json={
+            "user_id": self.rng.choice(self.refs["user"]),
+            "dish_id": self.rng.choice(self.refs["dish"]),
+            "quantity": self.rng.randint(1, 3),
+        })
+
+    async def checkout(self):
+        user_id = self.rng.choice(self.refs["user"])
+        for dish_id in self.rng.sample(self.refs["dish"], min(3, len(self.refs["dish"]))):
+            await self.call("POST /cart/add", "POST", "/cart/add",
+                            json={"user_id": user_id, "dish_id": dish_id, "quantity": 1})
+        await self.call("GET /cart/{user_id}", "GET", f"/cart/{user_id}")
+        await self.call("POST /order", "POST", "/order", json={"user_id": user_id, "address_id": 1})
+
+    async def book(self):
+        when = f"{self.day().isoformat()}T{self.rng.choice(BOOKING_SLOTS)}"
+        await self.call("POST /booking", "POST", "/booking", json={
+            "user_id": self.rng.choice(self.refs["user"]),
+            "datetime": when,
+            "table_id": self.rng.choice(self.refs["table"]),
+            "guests": 2,
+        })
+
+    async def dashboard(self):
+        for url in ANALYTICS:
+            await self.call(f"GET {url}", "GET", url)
+
+
+MIX = (
+    (40, Session.browse_menu),
+    (15, Session.find_table),
+    (15, Session.add_to_cart),
+    (10, Session.checkout),
+    (10, Session.book),
+    (10, Session.dashboard),
+)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[index], 3)
+
+
+def summarize(samples):
+    routes = {}
+    for route, values in sorted(samples.items()):
+        timings = sorted(ms for ms, _ in values)
+        routes[route] = {
+            "count": len(values),
+            "errors": sum(1 for _, ok in values if not ok),
+            "p50": percentile(timings, 50),
+            "p95": percentile(timings, 95),
+            "p99": percentile(timings, 99),
+            "mean": round(sum(timings) / len(timings), 3),
+            "max": round(timings[-1], 3),
+        }
+    return routes
+
+
+def references(path):
+    conn = sqlite3.connect(path)
+    try:
+        refs = {}
+        for ent_name in ("user", "dish", "table"):
+            rows = conn.execute(
+                "SELECT DISTINCT ent_instance_id FROM t_sys_attr_values WHERE ent_name = ?", (ent_name,)
+            ).fetchall()
+            refs[ent_name] = [row[0] for row in rows]
+    finally:
+        conn.close()
+    return refs
+
+
+# Засеянные базы кешируются по размеру и зерну: сидер работает один раз на набор параметров
+async def prepared_db(orders, args):
+    os.makedirs(args.cache, exist_ok=True)
+    path = os.path.join(args.cache, f"seed_{orders}_{args.seed}.db")
+    if not os.path.exists(path):
+        print(f"Засеваем базу на {orders} заказов -> {path}")
+        shutil.copy(args.template, path + ".tmp")
+        conn = await database.connect(path + ".tmp")
+        try:
+            await migrate(conn)
+            seeder = Seeder(users=max(100, orders // 15), orders=orders, bookings=max(100, orders // 8),
+                            reviews=max(100, orders // 10), days=args.days, start=args.start, seed=args.seed)
+            await seed(conn, seeder, wipe=True, log=lambda line: None)
+        finally:
+            await conn.close()
+        os.replace(path + ".tmp", path)
+    return path
+
+
+async def drive(client, refs, concurrency, duration, seed_value):
+    samples = {}
+    actions = [action for _, action in MIX]
+    weights = [weight for weight, _ in MIX]
+    deadline = time.perf_counter() + duration
+
+    async def worker(n):
+        rng = random.Random(seed_value * 1000 + n)
+        session = Session(client, refs, rng, samples)
+        while time.perf_counter() < deadline:
+            await rng.choices(actions, weights=weights)[0](session)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_uvicorn(path, refs, concurrency, args):
+    port = _free_port()
+    env = dict(os.environ, DB_PATH=path)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/ping")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            return await drive(client, refs, concurrency, args.duration, args.seed)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run_in_process(path, refs, concurrency, args):
+    from main import app
+    database.DB_PATH = path
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            return await drive(client, refs, concurrency, args.duration, args.seed)
+
+
+async def benchmark(args):
+    runs = []
+    workdir = tempfile.mkdtemp()
+    try:
+        for orders in args.sizes:
+            seeded = await prepared_db(orders, args)
+            refs = references(seeded)
+            refs.update(start=args.start, days=args.days)
+            for concurrency in args.concurrency:
+                # Каждый прогон на свежей копии: записи прошлого прогона не влияют на следующий
+                path = os.path.join(workdir, f"run_{orders}_{concurrency}.db")
+                shutil.copy(seeded, path)
+                run = run_uvicorn if args.uvicorn else run_in_process
+                samples, elapsed = await run(path, refs, concurrency, args)
+                routes = summarize(samples)
+                requests = sum(r["count"] for r in routes.values())
+                runs.append({
+                    "orders": orders,
+                    "concurrency": concurrency,
+                    "duration_s": round(elapsed, 3),
+                    "requests": requests,
+                    "errors": sum(r["errors"] for r in routes.values()),
+                    "rps": round(requests / elapsed, 2),
+                    "routes": routes,
+                })
+                print_run(runs[-1])
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+    finally:
+        shutil.rmtree(workdir)
+    return runs
+
+
+def print_run(run):
+    print(f"\n{run['orders']} заказов, клиентов: {run['concurrency']}: "
+          f"{run['requests']} запросов, {run['rps']} rps, ошибок {run['errors']}")
+    print(f"  {'маршрут':<34} {'N':>7} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for route, r in run["routes"].items():
+        print(f"  {route:<34} {r['count']:>7} {r['p50']:>9.2f} {r['p95']:>9.2f} {r['p99']:>9.2f}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Замедление — рост перцентиля больше чем на threshold и больше чем на min_ms по абсолютной величине
+def compare(before, after, threshold, min_ms, metric):
+    old = {(r["orders"], r["concurrency"]): r for r in before["runs"]}
+    regressions = []
+    print(f"{'заказов':>8} {'клиентов':>8} {'маршрут':<34} {metric + ' до':>10} {metric + ' после':>12} {'изм.':>8}")
+    for run in after["runs"]:
+        base = old.get((run["orders"], run["concurrency"]))
+        if base is None:
+            continue
+        for route, r in run["routes"].items():
+            b = base["routes"].get(route)
+            if not b or b[metric] is None or r[metric] is None:
+                continue
+            change = (r[metric] - b[metric]) / b[metric] if b[metric] else 0.0
+            slower = change > threshold and r[metric] - b[metric] > min_ms
+            mark = "  МЕДЛЕННЕЕ" if slower else ""
+            print(f"{run['orders']:>8} {run['concurrency']:>8} {route:<34} {b[metric]:>10.2f} "
+                  f"{r[metric]:>12.2f} {change:>+8.0%}{mark}")
+            if slower:
+                regressions.append({"orders": run["orders"], "concurrency": run["concurrency"], "route": route,
+                                    "before": b[metric], "after": r[metric], "change": round(change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон API RestoFlow")
+    commands = parser.add_subparsers(dest="command")
+
+    cmd = commands.add_parser("compare", help="сравнить два отчёта и показать замедления")
+    cmd.add_argument("before")
+    cmd.add_argument("after")
+    cmd.add_argument("--metric", default="p95", choices=("p50", "p95", "p99", "mean"))
+    cmd.add_argument("--threshold", type=float, default=0.2, help="допустимый относительный рост (0.2 = 20%%)")
+    cmd.add_argument("--min-ms", type=float, default=1.0, help="игнорировать рост меньше стольких мс")
+
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000], help="размеры баз, в заказах")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--duration", type=float, default=15, help="секунд на один прогон")
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2025, 1, 1))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--template", default=database.DB_PATH, help="база со схемой, на основе которой сеять")
+    parser.add_argument("--cache", default=os.path.join(tempfile.gettempdir(), "restoflow-bench"))
+    parser.add_argument("--uvicorn", action="store_true", help="гонять через uvicorn в отдельном процессе")
+    parser.add_argument("--out", help="куда записать JSON с результатами")
+    parser.add_argument("--baseline", help="JSON прошлого прогона: сразу сравнить и вернуть код 1 при замедлении")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        regressions = compare(before, after, args.threshold, args.min_ms, args.metric)
+        print(f"\nЗамедлений: {len(regressions)}")
+        sys.exit(1 if regressions else 0)
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "mode": "uvicorn" if args.uvicorn else "in-process",
+        "sqlite": sqlite3.sqlite_version,
+        "python": sys.version.split()[0],
+        "duration_s": args.duration,
+        "runs": asyncio.run(benchmark(args)),
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны в {args.out}")
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.baseline:
+        with open(args.baseline) as f:
+            before = json.load(f)
+        print()
+        regressions = compare(before, report, args.threshold, 1.0, "p95")
+        print(f"\nЗамедлений: {len(regressions)}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
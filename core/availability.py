@@ -0,0 +1,240 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timedelta
+
+from core import refdata, typed, versions
+
+# Занятость столов в памяти: по каждому столу отсортированные интервалы броней [start, end)
+# в минутах от EPOCH. Загружается одним запросом при первом обращении, пополняется
+# из create_booking и сбрасывается при правках броней и столов через админку.
+# Брони, вставленные другими воркерами, дочитываются по val_id (см. core/versions.py).
+# Проверка «стол свободен в [start, end)» — бинарный поиск по началам броней.
+
+# Бронь в базе хранит только начало; длительность у всех одинаковая
+BOOKING_MINUTES = 120
+
+EPOCH = datetime(2000, 1, 1)
+
+# Сущности, правка которых меняет занятость
+ENTS = ("booking", "table")
+
+
+# Время броней — местное без пояса (так его хранят и считают value_ts); ISO-строка со
+# смещением (+03:00, Z) отклоняется ValueError, и эндпоинты отвечают 400, а не 500
+def to_minutes(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        raise ValueError(f"Время с часовым поясом не поддерживается: {value.isoformat()}")
+    return (value - EPOCH) // timedelta(minutes=1)
+
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=minutes)
+
+
+class TableSchedule:
+    __slots__ = ("table_id", "number", "seats", "location", "starts", "ends", "ids", "longest")
+
+    def __init__(self, table_id, number, seats, location):
+        self.table_id = table_id
+        self.number = number
+        self.seats = seats
+        self.location = location
+        self.starts = []
+        self.ends = []
+        self.ids = []
+        # Самая длинная бронь стола: дальше неё назад по началам искать пересечения не нужно
+        self.longest = 0
+
+    def add(self, start, end, booking_id):
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, booking_id)
+        self.longest = max(self.longest, end - start)
+
+    # Брони, пересекающиеся с [start, end): только те, что начались позже start - longest
+    def overlapping(self, start, end):
+        lo = bisect_right(self.starts, start - self.longest)
+        hi = bisect_left(self.starts, end)
+        return [self.ids[i] for i in range(lo, hi) if self.ends[i] > start]
+
+    def is_free(self, start, end):
+        lo = bisect_right(self.starts, start - self.longest)
+        hi = bisect_left(self.starts, end)
+        return all(self.ends[i] <= start for i in range(lo, hi))
+
+    def busy_between(self, start, end):
+        lo = bisect_right(self.starts, start - self.longest)
+        hi = bisect_left(self.starts, end)
+        return [(self.starts[i], self.ends[i]) for i in range(lo, hi) if self.ends[i] > start]
+
+
+class Availability:
+    def __init__(self):
+        self.tables = {}
+        # (seats, table_id) по возрастанию мест: отбор по min_seats — один bisect
+        self._by_seats = []
+        # уже учтённые брони: своя вставка и её дочитывание не дают двойной занятости
+        self.booking_ids = set()
+        # последний val_id, который видела загрузка или дочитывание
+        self.last_val_id = 0
+
+    def add_table(self, table_id, number, seats, location):
+        self.tables[table_id] = TableSchedule(table_id, number, seats, location)
+        insort(self._by_seats, (seats, table_id))
+
+    def add_booking(self, table_id, start, booking_id, minutes=BOOKING_MINUTES):
+        if booking_id is not None:
+            if booking_id in self.booking_ids:
+                return
+            self.booking_ids.add(booking_id)
+        schedule = self.tables.get(table_id)
+        if schedule is not None:
+            schedule.add(start, start + minutes, booking_id)
+
+    def candidates(self, min_seats=1, location=None):
+        i = bisect_left(self._by_seats, (min_seats, -1))
+        for _, table_id in self._by_seats[i:]:
+            schedule = self.tables[table_id]
+            if location is None or schedule.location == location:
+                yield schedule
+
+    # Свободные в [start, end) столы с местами >= min_seats, от меньших к большим
+    def free_tables(self, start, end, min_seats=1, location=None):
+        return [s for s in self.candidates(min_seats, location) if s.is_free(start, end)]
+
+
+_engine = None
+
+
+def _add_tables(engine, tables):
+    for table in tables:
+        if table.seats:
+            engine.add_table(table.table_id, table.number, table.seats, table.location)
+
+
+# Для кэша занятости столы берутся из справочника в памяти (core/refdata.py), без запроса
+async def _load_tables(db, engine):
+    ref = await refdata.get(db)
+    _add_tables(engine, ref.tables.values())
+
+
+# Для проверки на запись — из базы в текущей транзакции: справочник не видит правок
+# столов, закоммиченных этим же писателем или идущих в той же пачке
+async def _read_tables(db, engine):
+    rows = await db.execute_fetchall(
+        "SELECT ent_instance_id, attr_name, value FROM t_sys_attr_values "
+        "WHERE ent_name = 'table' AND attr_name IN ('number', 'seats', 'location')"
+    )
+    attrs = {}
+    for row in rows:
+        attrs.setdefault(row[0], {})[row[1]] = row[2]
+    _add_tables(engine, (refdata.Table(table_id, a) for table_id, a in sorted(attrs.items())))
+
+
+def _add_bookings(engine, rows):
+    for row in rows:
+        try:
+            engine.add_booking(int(row["table_id"]), to_minutes(row["datetime"]), row["ent_instance_id"])
+        except (TypeError, ValueError):
+            # битые даты и брони без стола в занятость не попадают, как и раньше
+            continue
+
+
+async def _last_val_id(db):
+    return (await db.execute_fetchall("SELECT IFNULL(MAX(val_id), 0) FROM t_sys_attr_values"))[0][0]
+
+
+async def load(db):
+    global _engine
+    engine = Availability()
+    await _load_tables(db, engine)
+    # граница берётся до чтения броней: вставленное между запросами дочитается ещё раз и отсеется по id
+    engine.last_val_id = await _last_val_id(db)
+    rows = await db.execute_fetchall(
+        """
+        SELECT ent_instance_id,
+               MAX(CASE WHEN attr_name = 'table_id' THEN value END) AS table_id,
+               MAX(CASE WHEN attr_name = 'datetime' THEN value END) AS datetime
+        FROM t_sys_attr_values
+        WHERE ent_name = 'booking' AND attr_name IN ('table_id', 'datetime')
+        GROUP BY ent_instance_id
+        """
+    )
+    _add_bookings(engine, rows)
+    _engine = engine
+    return engine
+
+
+# Занятость только вокруг [start, end), прочитанная из базы в текущей транзакции.
+# Брони выбираются диапазоном по value_ts (индекс idx_rng_booking__datetime),
+# а точное пересечение потом проверяет TableSchedule.
+async def window(db, start, end):
+    engine = Availability()
+    await _read_tables(db, engine)
+    rows = await db.execute_fetchall(
+        """
+        SELECT d.ent_instance_id, d.value AS datetime, t.value AS table_id
+        FROM t_sys_attr_values d
+        JOIN t_sys_attr_values t
+          ON t.ent_name = 'booking' AND t.attr_name = 'table_id' AND t.ent_instance_id = d.ent_instance_id
+        WHERE d.ent_name = 'booking' AND d.attr_name = 'datetime' AND d.value_ts >= ? AND d.value_ts < ?
+        """,
+        (typed.epoch(from_minutes(start - BOOKING_MINUTES)), typed.epoch(from_minutes(end)))
+    )
+    _add_bookings(engine, rows)
+    return engine
+
+
+# Брони, появившиеся после last_val_id: строки одной брони вставляются одной транзакцией,
+# так что к моменту чтения все её атрибуты уже на месте. +ent_name — чтобы читался
+# диапазон val_id, а не все строки броней по индексу ent_name
+async def _catch_up(db, engine):
+    last = await _last_val_id(db)
+    rows = await db.execute_fetchall(
+        """
+        SELECT ent_instance_id,
+               MAX(CASE WHEN attr_name = 'table_id' THEN value END) AS table_id,
+               MAX(CASE WHEN attr_name = 'datetime' THEN value END) AS datetime
+        FROM t_sys_attr_values
+        WHERE val_id > ? AND val_id <= ? AND +ent_name = 'booking'
+        GROUP BY ent_instance_id
+        """,
+        (engine.last_val_id, last)
+    )
+    _add_bookings(engine, rows)
+    engine.last_val_id = last
+
+
+# Сущность изменилась в другом воркере (или в этом — через любое соединение)
+async def _changed(db, ent_name, appended_only):
+    if _engine is None:
+        return
+    if ent_name == "booking" and appended_only:
+        await _catch_up(db, _engine)
+    else:
+        invalidate()
+
+
+versions.subscribe(ENTS, _changed)
+
+
+async def get(db):
+    await versions.sync(db)
+    return _engine if _engine is not None else await load(db)
+
+
+def booking_added(table_id, start, booking_id):
+    if _engine is None:
+        return
+    try:
+        _engine.add_booking(table_id, to_minutes(start), booking_id)
+    except ValueError:
+        pass
+
+
+# Брони или столы изменены в обход create_booking — индекс перечитывается при следующем запросе
+def invalidate():
+    global _engine
+    _engine = None
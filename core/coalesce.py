@@ -0,0 +1,46 @@
+import asyncio
+
+from fastapi.routing import APIRoute
+from starlette.responses import Response
+
+from core import metrics
+from core.paging import wants_ndjson
+
+# Single-flight для тяжёлых GET: одинаковые запросы (путь, query, Accept), пришедшие, пока
+# первый ещё считается, не идут в базу, а ждут его ответ и получают копию.
+# Подключается к роутеру целиком: APIRouter(route_class=SingleFlightRoute).
+# Ответ «догнавшего» запроса не старше того, что он получил бы, придя чуть раньше.
+# NDJSON-потоки не объединяются: их тело нельзя отдать дважды.
+
+
+# Каждому запросу — своя копия: middleware дописывают заголовки прямо в список raw_headers
+def _copy(response):
+    clone = Response(response.body, status_code=response.status_code)
+    clone.raw_headers = list(response.raw_headers)
+    return clone
+
+
+class SingleFlightRoute(APIRoute):
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        # ключ запроса -> задача, которая считает ответ
+        in_flight = {}
+
+        async def coalesced(request):
+            if request.method != "GET" or wants_ndjson(request):
+                return await handler(request)
+            key = (request.url.path, request.url.query, request.headers.get("accept", ""))
+            task = in_flight.get(key)
+            if task is None:
+                # Отдельная задача: обрыв соединения первого клиента не отменяет расчёт для остальных
+                task = in_flight[key] = asyncio.ensure_future(handler(request))
+                task.add_done_callback(lambda _: in_flight.pop(key, None))
+            else:
+                stats = metrics.current()
+                if stats is not None:
+                    stats.route = self.path
+                metrics.COALESCED.inc((self.path,))
+            response = await asyncio.shield(task)
+            return _copy(response) if hasattr(response, "body") else response
+
+        return coalesced
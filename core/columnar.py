@@ -0,0 +1,485 @@
+import asyncio
+import logging
+import os
+import time
+
+import numpy as np
+
+from core import typed, versions
+from core.availability import BOOKING_MINUTES
+from db import connect
+
+# Колоночный снимок для аналитики (ANALYTICS_BACKEND=numpy или ?backend=numpy).
+# Заказы, позиции, брони и смены читаются из t_sys_attr_values в плотные массивы NumPy:
+# id — int64, время — секунды эпохи из value_ts, цены и суммы — float64 из value_num.
+# Каждый атрибут — один запрос (ent_name, attr_name) по индексу; строки сущности
+# сводятся по id через searchsorted. Группировки по дню и официанту, корзины времени
+# и top-k считаются векторно, без разбора строк и без SQL-пивотов. Брони — отдельный
+# маленький снимок Bookings со своими сущностями.
+#
+# Снимок помнит последний прочитанный val_id (AUTOINCREMENT, не переиспользуется).
+# Если в его сущности с прошлой сверки были только вставки (новые заказы, позиции, брони),
+# запрос дочитывает строки с val_id больше запомненного и вливает их в колонки.
+# После правок и удалений, а также раз в SNAPSHOT_MAX_AGE секунд снимок пересобирается
+# целиком в фоне, а запросы до конца сборки получают прежний. Ждать сборки приходится
+# только самому первому запросу. Разбор строк в массивы и вся арифметика над колонками
+# идут в asyncio.to_thread, а не в цикле событий.
+
+SNAPSHOT_MAX_AGE = float(os.environ.get("ANALYTICS_SNAPSHOT_MAX_AGE", "300"))
+
+ENTS = ("order", "order_item", "staff_shift")
+BOOKING_ENTS = ("booking", "table")
+
+log = logging.getLogger("restoflow.columnar")
+
+DAY = 86400
+# До какого id плотные номера строятся через bincount (массив такого размера)
+DENSE_LIMIT = 1 << 20
+# Границы периода без даты: раньше и позже любых данных
+FIRST_DAY, LAST_DAY = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+
+
+# Атрибут как пара отсортированных по id массивов (ids, values) из строк (id, значение)
+def _column(rows, dtype):
+    ids = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+    values = np.fromiter((row[1] for row in rows), dtype, len(rows))
+    order = np.argsort(ids, kind="stable")
+    return ids[order], values[order]
+
+
+# Колонка с дочитанными строками: новые id обычно больше старых, и тогда массивы
+# достаточно склеить; иначе (атрибут добавили старому экземпляру) — пересортировать
+def _extend(column, rows, dtype):
+    if not rows:
+        return column
+    ids, values = _column(rows, dtype)
+    appended = not len(column[0]) or ids[0] >= column[0][-1]
+    ids = np.concatenate([column[0], ids])
+    values = np.concatenate([column[1], values])
+    if appended:
+        return ids, values
+    order = np.argsort(ids, kind="stable")
+    return ids[order], values[order]
+
+
+# Значения column для каждого id из ids (fill, если у экземпляра атрибута нет)
+def _align(ids, column, fill):
+    col_ids, values = column
+    # обычно атрибут есть у каждого экземпляра: id совпадают, поиск не нужен
+    if len(col_ids) == len(ids) and np.array_equal(col_ids, ids):
+        return values.copy()
+    out = np.full(len(ids), fill, dtype=values.dtype)
+    if len(col_ids):
+        pos = np.minimum(np.searchsorted(col_ids, ids), len(col_ids) - 1)
+        hit = col_ids[pos] == ids
+        out[hit] = values[pos[hit]]
+    return out
+
+
+# Плотные номера 0..N-1 для неотрицательных id: (id по возрастанию, номер каждого значения).
+# Небольшие id (блюда) нумеруются через bincount за линейное время, без сортировки
+def _dense(values):
+    if len(values) and values.min() >= 0 and values.max() < DENSE_LIMIT:
+        seen = np.bincount(values) > 0
+        return np.flatnonzero(seen), (np.cumsum(seen) - 1)[values]
+    uniques, inverse = np.unique(values, return_inverse=True)
+    return uniques, inverse.reshape(-1)
+
+
+def day_number(value):
+    return typed.epoch(value) // DAY
+
+
+def day_string(days):
+    return np.datetime_as_string(days.astype("datetime64[D]"), unit="D")
+
+
+class Snapshot:
+    ENTS = ENTS
+    # (сущность, атрибут, колонка t_sys_attr_values, тип массива)
+    COLUMNS = (
+        ("order", "created_at", "value_ts", np.int64),
+        ("order", "total_price", "value_num", np.float64),
+        ("order", "waiter_id", "value_num", np.float64),
+        ("order_item", "order_id", "value_num", np.float64),
+        ("order_item", "dish_id", "value_num", np.float64),
+        ("order_item", "quantity", "value_num", np.float64),
+        ("order_item", "price", "value_num", np.float64),
+        ("staff_shift", "start_time", "value_ts", np.int64),
+        ("staff_shift", "user_id", "value_num", np.float64),
+        ("staff_shift", "end_time", "value_ts", np.int64),
+    )
+
+    __slots__ = ("built_at", "columns", "last_val_id",
+                 "day0", "n_days", "order_day", "order_total", "order_waiter",
+                 "dishes", "item_day", "item_dish", "item_qty", "item_revenue",
+                 "waiters", "shift_day", "shift_waiter", "shift_hours")
+
+    # Производные массивы из колонок {(сущность, атрибут): (ids, values)}; без запросов
+    @classmethod
+    def derive(cls, columns):
+        s = cls()
+        c = columns
+
+        # Заказы: основа — created_at; без суммы — 0, без официанта — -1
+        order_id, created = c["order", "created_at"]
+        s.order_day = created // DAY
+        s.order_total = _align(order_id, c["order", "total_price"], 0.0)
+        waiter = _align(order_id, c["order", "waiter_id"], -1.0)
+        waiter = waiter.astype(np.int64)
+
+        # Позиции: день берётся у заказа; позиции без заказа с датой в снимок не попадают
+        item_id, order_ref = c["order_item", "order_id"]
+        order_ref = order_ref.astype(np.int64)
+        pos = np.minimum(np.searchsorted(order_id, order_ref), max(len(order_id) - 1, 0))
+        known = order_id[pos] == order_ref if len(order_id) else np.zeros(len(item_id), bool)
+        dish = _align(item_id, c["order_item", "dish_id"], np.nan)
+        qty = _align(item_id, c["order_item", "quantity"], np.nan)
+        price = _align(item_id, c["order_item", "price"], 0.0)
+        keep = known & ~np.isnan(dish) & ~np.isnan(qty)
+        s.item_day = s.order_day[pos[keep]]
+        # блюда — плотные номера 0..N-1 в s.dishes, чтобы группировать через bincount
+        s.dishes, s.item_dish = _dense(dish[keep].astype(np.int64))
+        s.item_qty = qty[keep]
+        s.item_revenue = qty[keep] * price[keep]
+
+        # Смены: день начала, часы — до end_time (смена без конца даёт 0), как в rollups
+        shift_id, start = c["staff_shift", "start_time"]
+        user = _align(shift_id, c["staff_shift", "user_id"], np.nan)
+        end = _align(shift_id, c["staff_shift", "end_time"], -1)
+        keep = ~np.isnan(user)
+        shift_user = user[keep].astype(np.int64)
+        s.shift_day = start[keep] // DAY
+        s.shift_hours = np.where(end[keep] >= 0, (end[keep] - start[keep]) / 3600.0, 0.0)
+
+        # официанты — тоже плотные номера; у заказа без официанта -1
+        s.waiters = np.unique(np.concatenate([waiter[waiter >= 0], shift_user]))
+        s.order_waiter = np.where(waiter >= 0, np.searchsorted(s.waiters, waiter), -1)
+        s.shift_waiter = np.searchsorted(s.waiters, shift_user)
+
+        # дни заказов и смен — смещения от day0: ключ группировки (день, x) = день * N + x
+        days = np.concatenate([s.order_day, s.shift_day])
+        s.day0 = int(days.min()) if len(days) else 0
+        s.n_days = int(days.max()) - s.day0 + 1 if len(days) else 0
+        return s
+
+    # Номера дней в [first, last] внутри снимка
+    def _clip(self, first, last):
+        return max(first, self.day0), min(last, self.day0 + self.n_days - 1)
+
+    # --- заказы и блюда ---
+
+    def _orders_by_day(self, first, last):
+        first, last = self._clip(first, last)
+        mask = (self.order_day >= first) & (self.order_day <= last)
+        offset = self.order_day[mask] - self.day0
+        counts = np.bincount(offset, minlength=self.n_days)
+        revenue = np.bincount(offset, weights=self.order_total[mask], minlength=self.n_days)
+        # только дни с заказами, новые первыми, как ORDER BY day DESC
+        present = np.flatnonzero(counts)[::-1]
+        return present + self.day0, counts[present], revenue[present]
+
+    def daily_orders(self, first, last):
+        days, counts, _ = self._orders_by_day(first, last)
+        return [{"day": d, "order_count": int(c)} for d, c in zip(day_string(days), counts)]
+
+    def revenue_by_day(self, first, last):
+        days, _, revenue = self._orders_by_day(first, last)
+        return [{"day": d, "total_revenue": float(r)} for d, r in zip(day_string(days), revenue)]
+
+    def popular_dishes(self, first, last, limit):
+        mask = (self.item_day >= first) & (self.item_day <= last)
+        n = len(self.dishes)
+        lines = np.bincount(self.item_dish[mask], minlength=n)
+        qty = np.bincount(self.item_dish[mask], weights=self.item_qty[mask], minlength=n)
+        revenue = np.bincount(self.item_dish[mask], weights=self.item_revenue[mask], minlength=n)
+        present = np.flatnonzero(lines)
+        # top-k: по убыванию количества, при равенстве — по dish_id, как в SQL
+        top = present[np.lexsort((self.dishes[present], -qty[present]))][:limit]
+        return [
+            {"dish_id": int(self.dishes[i]), "total_quantity": int(qty[i]),
+             "total_revenue": round(float(revenue[i]), 2)}
+            for i in top
+        ]
+
+    # --- официанты ---
+
+    # Заказы и смены за период: (номера официантов, дни, выручка) заказов и (номера, дни, часы) смен
+    def _staff_rows(self, first, last, waiter_id):
+        o_mask = (self.order_day >= first) & (self.order_day <= last) & (self.order_waiter >= 0)
+        s_mask = (self.shift_day >= first) & (self.shift_day <= last)
+        if waiter_id is not None:
+            i = np.searchsorted(self.waiters, waiter_id)
+            i = i if i < len(self.waiters) and self.waiters[i] == waiter_id else -2
+            o_mask &= self.order_waiter == i
+            s_mask &= self.shift_waiter == i
+        return ((self.order_waiter[o_mask], self.order_day[o_mask], self.order_total[o_mask]),
+                (self.shift_waiter[s_mask], self.shift_day[s_mask], self.shift_hours[s_mask]))
+
+    def staff_totals(self, first, last, waiter_id=None):
+        (o_w, _, o_rev), (s_w, _, s_hours) = self._staff_rows(first, last, waiter_id)
+        n = len(self.waiters)
+        orders = np.bincount(o_w, minlength=n)
+        revenue = np.bincount(o_w, weights=o_rev, minlength=n)
+        hours = np.bincount(s_w, weights=s_hours, minlength=n)
+        shifts = np.bincount(s_w, minlength=n)
+        present = np.flatnonzero(orders + shifts)
+        # ORDER BY total_revenue DESC
+        present = present[np.argsort(-np.round(revenue[present], 2), kind="stable")]
+        return [
+            {
+                "waiter_id": int(self.waiters[i]),
+                "order_count": int(orders[i]),
+                "total_revenue": round(float(revenue[i]), 2),
+                "total_hours": round(float(hours[i]), 2),
+                "shift_count": int(shifts[i]),
+                "revenue_per_hour": round(float(revenue[i] / hours[i]), 2) if hours[i] else None,
+            }
+            for i in present
+        ]
+
+    # Строки (день, официант), как в agg_staff_daily
+    def staff_daily(self, first, last, waiter_id=None):
+        first, last = self._clip(first, last)
+        (o_w, o_day, o_rev), (s_w, s_day, s_hours) = self._staff_rows(first, last, waiter_id)
+        w = len(self.waiters)
+        n = self.n_days * w
+        o_key = (o_day - self.day0) * w + o_w
+        s_key = (s_day - self.day0) * w + s_w
+        orders = np.bincount(o_key, minlength=n)
+        revenue = np.bincount(o_key, weights=o_rev, minlength=n)
+        hours = np.bincount(s_key, weights=s_hours, minlength=n)
+        shifts = np.bincount(s_key, minlength=n)
+        present = np.flatnonzero(orders + shifts)
+        days, waiters = present // w + self.day0, present % w
+        # ORDER BY day DESC, waiter_id: номера официантов идут в порядке их id
+        order = np.lexsort((waiters, -days))
+        labels = day_string(days[order])
+        return [
+            {
+                "day": labels[row],
+                "waiter_id": int(self.waiters[waiters[i]]),
+                "order_count": int(orders[k]),
+                "revenue": round(float(revenue[k]), 2),
+                "hours": round(float(hours[k]), 2),
+                "shift_count": int(shifts[k]),
+                "revenue_per_hour": round(float(revenue[k] / hours[k]), 2) if hours[k] else None,
+            }
+            for row, (i, k) in enumerate(zip(order, present[order]))
+        ]
+
+
+# Период [from, to] в номерах дней; без границ — вся история
+def days(date_from, date_to):
+    return (day_number(date_from) if date_from else FIRST_DAY,
+            day_number(date_to) if date_to else LAST_DAY)
+
+
+class Bookings:
+    ENTS = BOOKING_ENTS
+    COLUMNS = (
+        ("booking", "datetime", "value_ts", np.int64),
+        ("booking", "guests", "value_num", np.float64),
+        ("booking", "table_id", "value_num", np.float64),
+        ("table", "seats", "value_num", np.float64),
+    )
+
+    __slots__ = ("built_at", "columns", "last_val_id", "ts", "guests", "seats", "capacity")
+
+    @classmethod
+    def derive(cls, columns):
+        b = cls()
+        c = columns
+        booking_id, b.ts = c["booking", "datetime"]
+        b.guests = _align(booking_id, c["booking", "guests"], 0.0)
+        table_id = _align(booking_id, c["booking", "table_id"], -1.0)
+        tables = c["table", "seats"]
+        # места стола брони: занятость зала в местах, а не в гостях
+        b.seats = _align(table_id.astype(np.int64), tables, 0.0)
+        b.capacity = int(tables[1].sum())
+        return b
+
+    # Плотная матрица строк × корзин суток по bucket минут за дни [first, last].
+    # group: date — строка на каждый день периода, weekday — 7 строк (пн..вс).
+    # weight: count — брони, guests — гости, seats — места их столов.
+    # occupancy: бронь идёт во все корзины, которые занимает (BOOKING_MINUTES),
+    # а не только в корзину начала. Корзина — номер от эпохи, поэтому ночные
+    # брони переходят в следующий день правильно.
+    def heatmap(self, first, last, bucket, group, weight, occupancy=False):
+        per_day = 1440 // bucket
+        rows = 7 if group == "weekday" else last - first + 1
+        minute = self.ts // 60
+        # с запасом на длительность: бронь вечером накануне занимает утро first
+        lead = BOOKING_MINUTES if occupancy else 0
+        near = (minute >= first * 1440 - lead) & (minute < (last + 1) * 1440)
+        minute = minute[near]
+        weights = None if weight == "count" else (self.guests if weight == "guests" else self.seats)[near]
+        start = minute // bucket
+        spans = (minute + BOOKING_MINUTES - 1) // bucket - start + 1 if occupancy else np.ones(len(start), np.int64)
+        keys, picked = [], []
+        for k in range(int(spans.max()) if len(spans) else 0):
+            cell = start + k
+            day = cell // per_day
+            inside = (spans > k) & (day >= first) & (day <= last)
+            # 1970-01-01 — четверг: (день + 3) % 7 даёт 0 для понедельника
+            row = (day + 3) % 7 if group == "weekday" else day - first
+            keys.append((row * per_day + cell % per_day)[inside])
+            if weights is not None:
+                picked.append(weights[inside])
+        keys = np.concatenate(keys) if keys else np.array([], np.int64)
+        values = np.bincount(keys, weights=np.concatenate(picked) if picked else None, minlength=rows * per_day)
+        return values.reshape(rows, per_day)
+
+
+# Полная сборка: все колонки читаются в одной транзакции вместе с границей val_id
+async def _read(db, kind):
+    await db.execute("BEGIN")
+    try:
+        last = (await db.execute_fetchall("SELECT IFNULL(MAX(val_id), 0) FROM t_sys_attr_values"))[0][0]
+        rows = []
+        for ent_name, attr_name, column, _ in kind.COLUMNS:
+            rows.append(await db.execute_fetchall(
+                f"SELECT ent_instance_id, {column} FROM t_sys_attr_values "
+                f"WHERE ent_name = ? AND attr_name = ? AND {column} IS NOT NULL",
+                (ent_name, attr_name)
+            ))
+    finally:
+        await db.rollback()
+    return last, rows
+
+
+def _assemble(kind, built_at, last, rows):
+    columns = {(e, a): _column(r, dtype) for (e, a, _, dtype), r in zip(kind.COLUMNS, rows)}
+    value = kind.derive(columns)
+    value.built_at, value.columns, value.last_val_id = built_at, columns, last
+    return value
+
+
+# Строки сущностей снимка, вставленные после его last_val_id. Граница читается первой:
+# val_id выдаются писателем по порядку, так что всё до неё уже закоммичено и видно
+async def _appended(db, kind, after):
+    last = (await db.execute_fetchall("SELECT IFNULL(MAX(val_id), 0) FROM t_sys_attr_values"))[0][0]
+    marks = ",".join("?" * len(kind.ENTS))
+    # +ent_name: иначе планировщик берёт индекс по ent_name и обходит все строки сущности
+    rows = await db.execute_fetchall(
+        f"SELECT ent_name, attr_name, ent_instance_id, value_num, value_ts FROM t_sys_attr_values "
+        f"WHERE val_id > ? AND val_id <= ? AND +ent_name IN ({marks})",
+        (after, last, *kind.ENTS)
+    )
+    return last, rows
+
+
+def _merge(value, last, rows):
+    kind = type(value)
+    found = {}
+    for row in rows:
+        found.setdefault((row[0], row[1]), []).append(row)
+    columns = {}
+    for ent_name, attr_name, column, dtype in kind.COLUMNS:
+        i = 3 if column == "value_num" else 4
+        new = [(row[2], row[i]) for row in found.get((ent_name, attr_name), ()) if row[i] is not None]
+        columns[ent_name, attr_name] = _extend(value.columns[ent_name, attr_name], new, dtype)
+    merged = kind.derive(columns)
+    merged.built_at, merged.columns, merged.last_val_id = value.built_at, columns, last
+    return merged
+
+
+# Снимок одного вида: вставки в его сущности дочитываются по val_id, правки и возраст
+# запускают фоновую пересборку, а до её конца отдаётся прежний снимок
+class _Holder:
+    def __init__(self, kind):
+        self.kind = kind
+        self.value = None
+        self.appended = False
+        self.stale = False
+        self.lock = asyncio.Lock()
+        self.task = None
+        versions.subscribe(kind.ENTS, self._changed)
+
+    async def _changed(self, db, ent_name, appended_only):
+        if appended_only:
+            self.appended = True
+        else:
+            self.stale = True
+
+    async def get(self, db):
+        await versions.sync(db)
+        # сборку и дочитывание делит один запрос, остальные ждут его
+        async with self.lock:
+            if self.value is None:
+                self.appended = self.stale = False
+                self.value = await build(self.kind)
+                return self.value
+            if self.stale or time.monotonic() - self.value.built_at >= SNAPSHOT_MAX_AGE:
+                self._rebuild()
+            if self.appended:
+                self.appended = False
+                last, rows = await _appended(db, self.kind, self.value.last_val_id)
+                if rows:
+                    self.value = await asyncio.to_thread(_merge, self.value, last, rows)
+                else:
+                    self.value.last_val_id = last
+        return self.value
+
+    def _rebuild(self):
+        if self.task is not None and not self.task.done():
+            return
+        # флаг снимается до сборки: правка во время сборки запустит следующую
+        self.stale = False
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        try:
+            value = await build(self.kind)
+        except Exception:
+            # прежний снимок остаётся; следующая попытка — по возрасту или после правки
+            log.exception("Пересборка снимка %s не удалась", self.kind.__name__)
+            return
+        async with self.lock:
+            self.value = value
+            # вставки, пришедшие во время сборки, дочитает следующий запрос
+            self.appended = True
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+
+_snapshot = _Holder(Snapshot)
+_bookings = _Holder(Bookings)
+
+
+# Сборка на собственном соединении: читателя пула она не держит, а строки без
+# aiosqlite.Row (кортежи) заметно быстрее на миллионах значений
+async def build(kind=Snapshot):
+    built_at = time.monotonic()
+    db = await connect(readonly=True)
+    db.row_factory = None
+    try:
+        last, rows = await _read(db, kind)
+    finally:
+        await db.close()
+    return await asyncio.to_thread(_assemble, kind, built_at, last, rows)
+
+
+async def get(db):
+    return await _snapshot.get(db)
+
+
+async def bookings(db):
+    return await _bookings.get(db)
+
+
+def invalidate():
+    _snapshot.value = None
+    _bookings.value = None
+
+
+async def stop():
+    await _snapshot.stop()
+    await _bookings.stop()
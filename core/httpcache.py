@@ -0,0 +1,77 @@
+import hashlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from core import metrics, versions
+from db import reader
+
+# Условные GET для справочных эндпоинтов, которые клиенты опрашивают постоянно.
+# ETag ответа — хеш версий сущностей, из которых он собран (core/versions.py), пути и query.
+# Совпал If-None-Match — 304 отдаётся сразу, до роутера: обработчик, его запросы и
+# сериализация не выполняются. Cache-Control позволяет браузеру и CDN не спрашивать вовсе.
+
+# (путь, совпадение по префиксу, сущности ответа, max-age в секундах)
+RULES = (
+    ("/menu", False, ("dish",), 60),
+    ("/news", True, ("news",), 60),
+    ("/tables", False, ("table",), 300),
+    ("/contact_info", False, ("contact_info",), 3600),
+    ("/reviews/restaurant", False, ("review",), 30),
+    ("/rating/", True, ("review",), 60),
+)
+
+
+def _rule(path):
+    for prefix, nested, ent_names, max_age in RULES:
+        if path == prefix or (nested and path.startswith(prefix.rstrip("/") + "/")):
+            return prefix, ent_names, max_age
+    return None
+
+
+def _etag(scope, headers, ent_names):
+    key = repr((scope["path"], scope["query_string"], headers.get("accept", ""), versions.current(ent_names)))
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+# If-None-Match сравнивается слабо (RFC 9110): W/"x" совпадает с "x"
+def _matches(if_none_match, etag):
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class ConditionalMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        rule = _rule(scope["path"]) if scope["type"] == "http" and scope["method"] in ("GET", "HEAD") else None
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+        route, ent_names, max_age = rule
+        async with reader() as db:
+            await versions.sync(db)
+        request_headers = Headers(scope=scope)
+        etag = _etag(scope, request_headers, ent_names)
+        cache_headers = [
+            (b"etag", etag.encode()),
+            (b"cache-control", f"public, max-age={max_age}".encode()),
+            (b"vary", b"Accept"),
+        ]
+
+        if _matches(request_headers.get("if-none-match", ""), etag):
+            stats = metrics.current()
+            if stats is not None:
+                stats.route = route
+            await send({"type": "http.response.start", "status": 304, "headers": cache_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_tagged(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                for name, value in cache_headers:
+                    headers.append(name.decode(), value.decode())
+            await send(message)
+
+        await self.app(scope, receive, send_tagged)
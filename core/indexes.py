@@ -0,0 +1,128 @@
+from core import typed
+from core.schema import check_name
+
+# Индексы по значению для атрибутов с t_sys_attr.is_indexed = 1.
+# Частичный индекс на каждую пару (ent_name, attr_name): выборки вида
+#   WHERE ent_name = 'user' AND attr_name = 'phone' AND value = ?
+# идут по нему без чтения таблицы, даже когда сущностей миллионы.
+# Для t_sys_attr.is_range_indexed = 1 такой же индекс строится по типизированной
+# колонке (value_num или value_ts, см. core/typed.py) — для диапазонов и сортировки.
+
+PREFIX = "idx_val_"
+RANGE_PREFIX = "idx_rng_"
+
+
+def index_name(ent_name, attr_name):
+    return f"{PREFIX}{check_name(ent_name)}__{check_name(attr_name)}"
+
+
+async def create_index(db, ent_name, attr_name):
+    name = index_name(ent_name, attr_name)
+    await db.execute(
+        f"CREATE INDEX IF NOT EXISTS {name} "
+        f"ON t_sys_attr_values (ent_name, attr_name, value, ent_instance_id) "
+        f"WHERE ent_name = '{ent_name}' AND attr_name = '{attr_name}'"
+    )
+    return name
+
+
+def range_index_name(ent_name, attr_name):
+    return f"{RANGE_PREFIX}{check_name(ent_name)}__{check_name(attr_name)}"
+
+
+async def create_range_index(db, ent_name, attr_name, attr_type):
+    column = typed.column_for(attr_type)
+    if column is None:
+        raise ValueError(f"У атрибута {ent_name}.{attr_name} тип {attr_type}: диапазонный индекс только для чисел и дат")
+    name = range_index_name(ent_name, attr_name)
+    await db.execute(
+        f"CREATE INDEX IF NOT EXISTS {name} "
+        f"ON t_sys_attr_values (ent_name, attr_name, {column}, ent_instance_id) "
+        f"WHERE ent_name = '{ent_name}' AND attr_name = '{attr_name}'"
+    )
+    return name
+
+
+async def drop_index(db, ent_name, attr_name):
+    name = index_name(ent_name, attr_name)
+    await db.execute(f"DROP INDEX IF EXISTS {name}")
+    return name
+
+
+async def declared(db):
+    rows = await db.execute_fetchall(
+        "SELECT ent_name, attr_name FROM t_sys_attr WHERE is_indexed = 1 ORDER BY ent_name, attr_name"
+    )
+    return [(row["ent_name"], row["attr_name"]) for row in rows]
+
+
+async def declared_ranges(db):
+    rows = await db.execute_fetchall(
+        "SELECT ent_name, attr_name, attr_type FROM t_sys_attr WHERE is_range_indexed = 1 ORDER BY ent_name, attr_name"
+    )
+    return [(row["ent_name"], row["attr_name"], row["attr_type"]) for row in rows]
+
+
+async def existing(db):
+    rows = await db.execute_fetchall(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND (name GLOB ? OR name GLOB ?)",
+        (PREFIX + "*", RANGE_PREFIX + "*")
+    )
+    return {row["name"] for row in rows}
+
+
+# Приводит набор индексов в соответствие с t_sys_attr
+async def sync_indexes(db):
+    present = await existing(db)
+    wanted = set()
+    for ent_name, attr_name in await declared(db):
+        wanted.add(await create_index(db, ent_name, attr_name))
+    for ent_name, attr_name, attr_type in await declared_ranges(db):
+        if typed.column_for(attr_type) is not None:
+            wanted.add(await create_range_index(db, ent_name, attr_name, attr_type))
+    for name in present - wanted:
+        await db.execute(f"DROP INDEX IF EXISTS {name}")
+    await db.commit()
+    return sorted(wanted)
+
+
+async def set_indexed(db, ent_name, attr_name, enabled):
+    check_name(ent_name)
+    check_name(attr_name)
+    if enabled:
+        await db.execute(
+            "INSERT INTO t_sys_attr (ent_name, attr_name, attr_type) SELECT ?, ?, 'TEXT' "
+            "WHERE NOT EXISTS (SELECT 1 FROM t_sys_attr WHERE ent_name = ? AND attr_name = ?)",
+            (ent_name, attr_name, ent_name, attr_name)
+        )
+    await db.execute(
+        "UPDATE t_sys_attr SET is_indexed = ? WHERE ent_name = ? AND attr_name = ?",
+        (1 if enabled else 0, ent_name, attr_name)
+    )
+    if enabled:
+        name = await create_index(db, ent_name, attr_name)
+    else:
+        name = await drop_index(db, ent_name, attr_name)
+    await db.commit()
+    return name
+
+
+async def set_range_indexed(db, ent_name, attr_name, enabled):
+    check_name(ent_name)
+    check_name(attr_name)
+    rows = await db.execute_fetchall(
+        "SELECT attr_type FROM t_sys_attr WHERE ent_name = ? AND attr_name = ?", (ent_name, attr_name)
+    )
+    if not rows:
+        raise ValueError(f"Атрибут {ent_name}.{attr_name} не объявлен в t_sys_attr")
+    if enabled:
+        name = await create_range_index(db, ent_name, attr_name, rows[0]["attr_type"])
+    else:
+        name = range_index_name(ent_name, attr_name)
+        await db.execute(f"DROP INDEX IF EXISTS {name}")
+    await db.execute(
+        "UPDATE t_sys_attr SET is_range_indexed = ? WHERE ent_name = ? AND attr_name = ?",
+        (1 if enabled else 0, ent_name, attr_name)
+    )
+    await db.commit()
+    return name
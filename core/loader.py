@@ -0,0 +1,82 @@
+from collections import defaultdict
+
+from core.schema import check_name
+
+# Пакетная загрузка атрибутов сущностей (в духе DataLoader): вместо запроса на каждый
+# экземпляр id собираются по ent_name и читаются одним IN (...) на пачку.
+# Загрузчик живёт один запрос, повторные ссылки (тот же стол у сотни броней) читаются один раз.
+
+# Держимся ниже SQLITE_MAX_VARIABLE_NUMBER старых сборок (999) с запасом под прочие параметры
+CHUNK = 500
+
+
+def _chunks(items, size=CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EntityLoader:
+    def __init__(self, db):
+        self.db = db
+        self._loaded = defaultdict(dict)   # ent_name -> {id: {attr: value}}
+        self._queued = defaultdict(set)    # ent_name -> ids, ожидающие загрузки
+
+    # Запомнить id, которые понадобятся позже; читаются все разом в load()
+    def want(self, ent_name, ids):
+        known = self._loaded[ent_name]
+        for i in ids:
+            i = _as_id(i)
+            if i is not None and i not in known:
+                self._queued[ent_name].add(i)
+
+    async def load(self):
+        queued, self._queued = self._queued, defaultdict(set)
+        for ent_name, ids in queued.items():
+            known = self._loaded[ent_name]
+            ids = sorted(ids)
+            for chunk in _chunks(ids):
+                marks = ",".join("?" * len(chunk))
+                cursor = await self.db.execute(
+                    f"SELECT ent_instance_id, attr_name, value FROM t_sys_attr_values "
+                    f"WHERE ent_name = ? AND ent_instance_id IN ({marks})",
+                    (ent_name, *chunk)
+                )
+                for row in await cursor.fetchall():
+                    known.setdefault(row[0], {})[row[1]] = row[2]
+            for i in ids:
+                known.setdefault(i, {})
+
+    def get(self, ent_name, ent_id):
+        return self._loaded[ent_name].get(_as_id(ent_id), {})
+
+    async def load_many(self, ent_name, ids):
+        self.want(ent_name, ids)
+        await self.load()
+        return {_as_id(i): self.get(ent_name, i) for i in ids}
+
+    # Обратная ссылка: id экземпляров ent_name, у которых attr_name принимает одно из values.
+    # Возвращает {value: [ids]} в порядке возрастания id.
+    async def find(self, ent_name, attr_name, values):
+        # имена подставляются литералами: иначе планировщик не возьмёт частичный индекс idx_val_*
+        check_name(ent_name)
+        check_name(attr_name)
+        values = sorted({str(v) for v in values})
+        found = defaultdict(list)
+        for chunk in _chunks(values):
+            marks = ",".join("?" * len(chunk))
+            cursor = await self.db.execute(
+                f"SELECT value, ent_instance_id FROM t_sys_attr_values "
+                f"WHERE ent_name = '{ent_name}' AND attr_name = '{attr_name}' AND value IN ({marks}) "
+                f"ORDER BY ent_instance_id",
+                chunk
+            )
+            for row in await cursor.fetchall():
+                found[row[0]].append(row[1])
+        return found
@@ -0,0 +1,295 @@
+import asyncio
+import functools
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+from starlette.datastructures import MutableHeaders
+
+from core import slowlog
+
+# Метрики запросов для Prometheus (GET /metrics).
+# Middleware заводит на запрос RequestStats, get_db отдаёт соединение в обёртке TracedConnection,
+# которая считает запросы, время SQL и прочитанные строки. Обёртка эндпоинта отмечает момент,
+# когда обработчик вернул результат: всё от него до начала ответа — сериализация.
+# На запрос это несколько perf_counter() и сложений, поэтому метрики включены всегда.
+
+# Заголовок Server-Timing с разбивкой запроса (виден в devtools браузера)
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class RequestStats:
+    __slots__ = ("route", "started", "handled", "serialize", "queries", "sql", "rows")
+
+    def __init__(self):
+        self.route = None
+        self.started = time.perf_counter()
+        self.handled = None
+        self.serialize = 0.0
+        self.queries = 0
+        self.sql = 0.0
+        self.rows = 0
+
+    def server_timing(self, now):
+        return (
+            f'sql;dur={self.sql * 1000:.2f};desc="{self.queries} queries, {self.rows} rows", '
+            f"serialize;dur={self.serialize * 1000:.2f}, "
+            f"total;dur={(now - self.started) * 1000:.2f}"
+        )
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+def current():
+    return _current.get()
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+
+
+class Counter:
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+
+    def inc(self, labels, value=1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{{{_labels(self.labels, labels)}}} {value}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам..., +Inf, сумма]
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self._series.items()):
+            base = _labels(self.labels, labels)
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                total += count
+                yield f'{self.name}_bucket{{{base},le="{bound}"}} {total}'
+            yield f"{self.name}_sum{{{base}}} {series[-1]:.6f}"
+            yield f"{self.name}_count{{{base}}} {total}"
+
+
+REQUESTS = Counter("restoflow_http_requests_total", "Обработанные HTTP-запросы", ("method", "route", "status"))
+LATENCY = Histogram("restoflow_http_request_duration_seconds", "Полное время запроса",
+                    ("method", "route"), LATENCY_BUCKETS)
+SERIALIZE = Histogram("restoflow_serialize_duration_seconds", "От возврата обработчика до начала ответа",
+                      ("route",), LATENCY_BUCKETS)
+QUERIES = Histogram("restoflow_db_queries_per_request", "SQL-запросов на HTTP-запрос", ("route",), QUERY_BUCKETS)
+SQL_TIME = Counter("restoflow_db_query_seconds_total", "Суммарное время SQL", ("route",))
+ROWS = Counter("restoflow_db_rows_fetched_total", "Прочитано строк из курсоров", ("route",))
+COALESCED = Counter("restoflow_coalesced_requests_total",
+                    "Запросы, получившие ответ уже выполнявшегося одинакового запроса", ("route",))
+
+METRICS = (REQUESTS, LATENCY, SERIALIZE, QUERIES, SQL_TIME, ROWS, COALESCED)
+
+
+def record(method, stats, status, elapsed):
+    route = stats.route or "other"
+    REQUESTS.inc((method, route, status))
+    LATENCY.observe((method, route), elapsed)
+    SERIALIZE.observe((route,), stats.serialize)
+    QUERIES.observe((route,), stats.queries)
+    SQL_TIME.inc((route,), stats.sql)
+    ROWS.inc((route,), stats.rows)
+
+
+# Фоновая работа вне HTTP-запроса (пересчёт кэшей): только SQL-метрики под своим route
+def record_task(stats):
+    route = stats.route or "other"
+    QUERIES.observe((route,), stats.queries)
+    SQL_TIME.inc((route,), stats.sql)
+    ROWS.inc((route,), stats.rows)
+
+
+def task_stats(route):
+    stats = RequestStats()
+    stats.route = route
+    return stats
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# Курсор запроса; время чтения строк добавляется к запросу, и при первом чтении
+# запрос целиком (выполнение + выборка) проверяется на медленность
+class TracedCursor:
+    __slots__ = ("_cursor", "_stats", "_sql", "_parameters", "_elapsed")
+
+    def __init__(self, cursor, stats, sql, parameters, elapsed):
+        self._cursor = cursor
+        self._stats = stats
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = elapsed
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _fetched(self, elapsed, rows):
+        self._stats.sql += elapsed
+        self._stats.rows += rows
+        if self._sql is not None:
+            slowlog.check(self._sql, self._parameters, self._elapsed + elapsed, self._stats.route)
+            self._sql = None
+
+    async def fetchone(self):
+        started = time.perf_counter()
+        row = await self._cursor.fetchone()
+        self._fetched(time.perf_counter() - started, 0 if row is None else 1)
+        return row
+
+    async def fetchall(self):
+        started = time.perf_counter()
+        rows = await self._cursor.fetchall()
+        self._fetched(time.perf_counter() - started, len(rows))
+        return rows
+
+
+# Соединение из get_db: всё, кроме выполнения запросов, уходит в исходный aiosqlite.Connection
+class TracedConnection:
+    __slots__ = ("_conn", "_stats")
+
+    def __init__(self, conn, stats):
+        self._conn = conn
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def execute(self, sql, parameters=None):
+        started = time.perf_counter()
+        cursor = await self._conn.execute(sql, parameters)
+        elapsed = time.perf_counter() - started
+        self._stats.sql += elapsed
+        self._stats.queries += 1
+        await slowlog.seen(self._conn, sql, parameters)
+        if cursor.description is None:
+            # Строк не вернёт (UPDATE, DELETE, BEGIN): запрос уже выполнен целиком
+            slowlog.check(sql, parameters, elapsed, self._stats.route)
+            return TracedCursor(cursor, self._stats, None, None, elapsed)
+        return TracedCursor(cursor, self._stats, sql, parameters, elapsed)
+
+    async def executemany(self, sql, parameters):
+        started = time.perf_counter()
+        cursor = await self._conn.executemany(sql, parameters)
+        elapsed = time.perf_counter() - started
+        self._stats.sql += elapsed
+        self._stats.queries += 1
+        await slowlog.seen(self._conn, sql, None, many=True)
+        slowlog.check(sql, None, elapsed, self._stats.route, many=True)
+        return cursor
+
+    async def execute_fetchall(self, sql, parameters=None):
+        started = time.perf_counter()
+        rows = await self._conn.execute_fetchall(sql, parameters)
+        elapsed = time.perf_counter() - started
+        self._stats.sql += elapsed
+        self._stats.queries += 1
+        self._stats.rows += len(rows)
+        await slowlog.seen(self._conn, sql, parameters)
+        slowlog.check(sql, parameters, elapsed, self._stats.route)
+        return rows
+
+    async def commit(self):
+        started = time.perf_counter()
+        await self._conn.commit()
+        self._stats.sql += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                if stats.handled is not None:
+                    stats.serialize = now - stats.handled
+                if SERVER_TIMING:
+                    MutableHeaders(scope=message).append("Server-Timing", stats.server_timing(now))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            _current.reset(token)
+            record(scope["method"], stats, status, time.perf_counter() - stats.started)
+
+
+def _timed(call, path):
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(*args, **kwargs):
+            stats = _current.get()
+            if stats is not None:
+                stats.route = path
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                if stats is not None:
+                    stats.handled = time.perf_counter()
+    else:
+        @functools.wraps(call)
+        def endpoint(*args, **kwargs):
+            stats = _current.get()
+            if stats is not None:
+                stats.route = path
+            try:
+                return call(*args, **kwargs)
+            finally:
+                if stats is not None:
+                    stats.handled = time.perf_counter()
+    endpoint.timed = True
+    return endpoint
+
+
+# Оборачивает эндпоинты всех маршрутов приложения; вызывать после подключения роутеров
+def instrument(app):
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not getattr(route.dependant.call, "timed", False):
+            route.dependant.call = _timed(route.dependant.call, route.path)
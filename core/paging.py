@@ -0,0 +1,112 @@
+import json
+
+from fastapi import Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from core import projections
+from core.loader import EntityLoader
+from core.schema import check_name
+from db import reader
+
+# Keyset-пагинация по ent_instance_id (?after=&limit=) и потоковая выдача NDJSON.
+# Курсор — последний отданный id; следующая страница начинается строго после него,
+# поэтому глубина страницы не влияет на стоимость запроса.
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+NDJSON = "application/x-ndjson"
+# Размер пачки при потоковой выдаче: столько строк живёт в памяти одновременно
+STREAM_BATCH = 500
+
+
+class Page:
+    def __init__(
+        self,
+        after: int = Query(None, description="курсор из next_cursor предыдущей страницы"),
+        limit: int = Query(DEFAULT_LIMIT, ge=1, le=MAX_LIMIT),
+    ):
+        self.after = after
+        self.limit = limit
+
+
+def wants_ndjson(request: Request):
+    return NDJSON in request.headers.get("accept", "")
+
+
+# id очередной страницы сущности; при where_attr — только экземпляры с attr = value
+# (выборка идёт по частичному индексу idx_val_*)
+async def page_ids(db, ent_name, after, limit, desc=False, where_attr=None, where_value=None):
+    check_name(ent_name)
+    params = []
+    if where_attr:
+        query = (
+            f"SELECT ent_instance_id FROM t_sys_attr_values "
+            f"WHERE ent_name = '{ent_name}' AND attr_name = '{check_name(where_attr)}' AND value = ?"
+        )
+        params.append(str(where_value))
+    else:
+        query = f"SELECT DISTINCT ent_instance_id FROM t_sys_attr_values WHERE ent_name = '{ent_name}'"
+    if after is not None:
+        query += f" AND ent_instance_id {'<' if desc else '>'} ?"
+        params.append(after)
+    query += f" ORDER BY ent_instance_id {'DESC' if desc else 'ASC'} LIMIT ?"
+    params.append(limit)
+    cursor = await db.execute(query, params)
+    ids = [row[0] for row in await cursor.fetchall()]
+    return ids, (ids[-1] if len(ids) == limit else None)
+
+
+# Страница строк сущности: [{"ent_instance_id": id, поле: значение, ...}].
+# Без фильтра и при включённой проекции читается proj_<ent_name> по первичному ключу,
+# иначе id берутся по индексу, а поля — пакетно через EntityLoader.
+async def page_rows(db, ent_name, fields, after, limit, desc=False, where_attr=None, where_value=None):
+    if where_attr is None and projections.entity_table(ent_name, fields) == projections.table_name(ent_name):
+        columns = ", ".join(f'"{check_name(f)}"' for f in fields)
+        query = f"SELECT ent_instance_id, {columns} FROM {projections.table_name(ent_name)}"
+        params = []
+        if after is not None:
+            query += f" WHERE ent_instance_id {'<' if desc else '>'} ?"
+            params.append(after)
+        query += f" ORDER BY ent_instance_id {'DESC' if desc else 'ASC'} LIMIT ?"
+        params.append(limit)
+        cursor = await db.execute(query, params)
+        rows = [dict(row) for row in await cursor.fetchall()]
+        return rows, (rows[-1]["ent_instance_id"] if len(rows) == limit else None)
+
+    ids, next_cursor = await page_ids(db, ent_name, after, limit, desc, where_attr, where_value)
+    loaded = await EntityLoader(db).load_many(ent_name, ids)
+    rows = [{"ent_instance_id": i, **{f: attrs.get(f) for f in fields}} for i, attrs in loaded.items()]
+    return rows, next_cursor
+
+
+# Ответ страницы: курсор в заголовке X-Next-Cursor, а у ответов-словарей ещё и в поле next_cursor
+def paged(body, next_cursor):
+    if isinstance(body, dict):
+        body["next_cursor"] = next_cursor
+    headers = {"X-Next-Cursor": str(next_cursor)} if next_cursor is not None else {}
+    return JSONResponse(jsonable_encoder(body), headers=headers)
+
+
+# Потоковая выгрузка всех страниц начиная с after. fetch_page(db, after, limit) -> (items, next_cursor).
+# Соединение берётся из пула на каждую пачку, так что долгая выгрузка не держит читателя.
+def stream_ndjson(fetch_page, after=None):
+    async def lines():
+        cursor = after
+        while True:
+            async with reader() as db:
+                items, cursor = await fetch_page(db, cursor, STREAM_BATCH)
+            for item in items:
+                yield json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+            if cursor is None:
+                break
+
+    return StreamingResponse(lines(), media_type=NDJSON)
+
+
+# Общая развилка для списочных эндпоинтов: NDJSON-поток или одна JSON-страница
+async def respond(request, db, page, fetch_page, wrap=None):
+    if wants_ndjson(request):
+        return stream_ndjson(fetch_page, page.after)
+    items, next_cursor = await fetch_page(db, page.after, page.limit)
+    return paged({wrap: items} if wrap else items, next_cursor)
@@ -0,0 +1,109 @@
+import json
+from datetime import datetime
+
+from core.loader import CHUNK
+
+# Правка экземпляров по разнице, а не «DELETE всех строк + INSERT заново».
+# Текущие атрибуты читаются одним запросом на пачку id, дальше меняются только
+# отличающиеся строки: UPDATE value по val_id, INSERT новых атрибутов, DELETE снятых.
+# Неизменённые строки не трогаются: val_id, записи индексов и WAL остаются как были,
+# а триггеры (типизация, проекции, версии) срабатывают только на реально изменённое.
+#
+# PATCH: в fields только меняемые атрибуты, null снимает атрибут.
+# PUT (replace=True): fields — полный набор, остальные атрибуты снимаются, кроме KEEP.
+# Ни PATCH, ни PUT экземпляров не создают: id выдаёт только t_sys_seq (core/sequences.py),
+# а id, занятый в обход счётчика, потом выдали бы POST (блоки других воркеров не сдвинуть).
+
+KEEP = ("created_at",)
+
+
+# Значение так, как его хранит TEXT-колонка value
+def _text(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+# ent_id -> {attr_name: [(val_id, value)]}; у экземпляра без строк — пустой словарь
+async def current(db, ent_name, ent_ids):
+    found = {ent_id: {} for ent_id in ent_ids}
+    ids = sorted(found)
+    for i in range(0, len(ids), CHUNK):
+        chunk = ids[i:i + CHUNK]
+        marks = ",".join("?" * len(chunk))
+        rows = await db.execute_fetchall(
+            f"SELECT ent_instance_id, attr_name, val_id, value FROM t_sys_attr_values "
+            f"WHERE ent_name = ? AND ent_instance_id IN ({marks}) ORDER BY val_id",
+            (ent_name, *chunk)
+        )
+        for row in rows:
+            found[row[0]].setdefault(row[1], []).append((row[2], row[3]))
+    return found
+
+
+# Разница для одного экземпляра: (updates, inserts, deletes, изменённые атрибуты)
+def diff(rows, fields, replace=False):
+    updates, inserts, deletes, changed = [], [], [], []
+    for attr, value in fields.items():
+        present = rows.get(attr, ())
+        if value is None:
+            if present:
+                deletes += [val_id for val_id, _ in present]
+                changed.append(attr)
+            continue
+        value = _text(value)
+        if not present:
+            inserts.append((attr, value))
+            changed.append(attr)
+            continue
+        # дубли атрибута (остались от старых правок) схлопываются в первую строку
+        (val_id, old), extra = present[0], present[1:]
+        if old != value:
+            updates.append((value, val_id))
+        deletes += [v for v, _ in extra]
+        if old != value or extra:
+            changed.append(attr)
+    if replace:
+        for attr, present in rows.items():
+            if attr not in fields and attr not in KEEP and attr != "updated_at":
+                deletes += [val_id for val_id, _ in present]
+                changed.append(attr)
+    return updates, inserts, deletes, changed
+
+
+# changes: {ent_id: fields}. Всё в транзакции вызывающего (единица core/writes.py).
+# Возвращает {ent_id: [изменённые атрибуты]}; updated_at ставится только изменённым.
+# Несуществующий экземпляр не создаётся и даёт None.
+async def apply(db, ent_name, changes, replace=False):
+    found = await current(db, ent_name, changes)
+    now = datetime.now().isoformat()
+    updates, inserts, deletes, result = [], [], [], {}
+    for ent_id, fields in changes.items():
+        rows = found[ent_id]
+        if not rows:
+            result[ent_id] = None
+            continue
+        upd, ins, dels, changed = diff(rows, fields, replace)
+        if changed and "updated_at" not in fields:
+            stamp = diff(rows, {"updated_at": now})
+            upd, ins, dels = upd + stamp[0], ins + stamp[1], dels + stamp[2]
+        updates += upd
+        inserts += [(ent_name, attr, ent_id, value) for attr, value in ins]
+        deletes += dels
+        result[ent_id] = changed
+    if deletes:
+        for i in range(0, len(deletes), CHUNK):
+            chunk = deletes[i:i + CHUNK]
+            await db.execute(
+                f"DELETE FROM t_sys_attr_values WHERE val_id IN ({','.join('?' * len(chunk))})", chunk
+            )
+    if updates:
+        await db.executemany("UPDATE t_sys_attr_values SET value = ? WHERE val_id = ?", updates)
+    if inserts:
+        await db.executemany(
+            "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES (?, ?, ?, ?)",
+            inserts
+        )
+    return result
@@ -0,0 +1,186 @@
+from core import versions
+from core.schema import check_name
+
+# Широкие таблицы proj_<ent_name>: одна строка на экземпляр, одна колонка на атрибут из t_sys_attr.
+# Включаются по t_sys_ent.is_projected и поддерживаются триггерами на t_sys_attr_values,
+# поэтому любые записи (роутеры, админка, ручной SQL) сразу видны в проекции.
+# Включение, отключение и перестройка увеличивают версию VERSION_KEY в t_sys_version:
+# остальные воркеры перечитывают набор проекций при следующей сверке (core/versions.py).
+
+VERSION_KEY = "t_sys_ent"
+
+# ent_name -> набор колонок включённых проекций этого процесса
+_enabled = {}
+
+
+def table_name(ent_name):
+    return f"proj_{check_name(ent_name)}"
+
+
+def is_enabled(ent_name):
+    return ent_name in _enabled
+
+
+# Источник строк сущности для FROM: проекция, если она включена и содержит все поля,
+# иначе привычный разворот MAX(CASE ...) по t_sys_attr_values
+def entity_table(ent_name, fields):
+    columns = _enabled.get(ent_name)
+    if columns is not None and all(f in columns for f in fields):
+        return table_name(ent_name)
+    pivot = ",\n           ".join(
+        f"MAX(CASE WHEN attr_name = '{check_name(f)}' THEN value END) AS \"{f}\"" for f in fields
+    )
+    return f"""(
+    SELECT ent_instance_id,
+           {pivot}
+    FROM t_sys_attr_values
+    WHERE ent_name = '{check_name(ent_name)}'
+    GROUP BY ent_instance_id
+    )"""
+
+
+async def load(db):
+    _enabled.clear()
+    rows = await db.execute_fetchall("SELECT ent_name FROM t_sys_ent WHERE is_projected = 1")
+    for row in rows:
+        ent_name = row[0]
+        info = await db.execute_fetchall(f"PRAGMA table_info({table_name(ent_name)})")
+        if info:
+            _enabled[ent_name] = {r[1] for r in info} - {"ent_instance_id"}
+    return sorted(_enabled)
+
+
+# До миграции 7 таблицы t_sys_version ещё нет — тогда и сверять некому
+async def _bump(db):
+    if await db.execute_fetchall("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 't_sys_version'"):
+        await versions.bump(db, (VERSION_KEY,))
+
+
+async def _changed(db, ent_name, appended_only):
+    await load(db)
+
+
+versions.subscribe((VERSION_KEY,), _changed)
+
+
+async def attributes(db, ent_name):
+    rows = await db.execute_fetchall(
+        "SELECT attr_name FROM t_sys_attr WHERE ent_name = ? ORDER BY attr_id", (ent_name,)
+    )
+    return [check_name(row["attr_name"]) for row in rows]
+
+
+def _refresh_column(table, ent_name, attrs, ref):
+    # Значение колонки пересчитывается тем же MAX(value), что и в развороте,
+    # поэтому дубли атрибутов и удаления дают тот же результат, что и pivot-запрос
+    sets = ",\n            ".join(
+        f"\"{a}\" = CASE WHEN {ref}.attr_name = '{a}' THEN (SELECT MAX(value) FROM t_sys_attr_values "
+        f"WHERE ent_name = '{ent_name}' AND attr_name = '{a}' AND ent_instance_id = {ref}.ent_instance_id) "
+        f"ELSE \"{a}\" END"
+        for a in attrs
+    )
+    return f"UPDATE {table} SET\n            {sets}\n        WHERE ent_instance_id = {ref}.ent_instance_id"
+
+
+def _drop_row(table, ent_name, ref):
+    return (
+        f"DELETE FROM {table} WHERE ent_instance_id = {ref}.ent_instance_id AND NOT EXISTS ("
+        f"SELECT 1 FROM t_sys_attr_values WHERE ent_name = '{ent_name}' "
+        f"AND ent_instance_id = {ref}.ent_instance_id)"
+    )
+
+
+def _trigger_sql(ent_name, attrs):
+    table = table_name(ent_name)
+    add_row = f"INSERT OR IGNORE INTO {table} (ent_instance_id) VALUES (NEW.ent_instance_id)"
+    return [
+        f"""CREATE TRIGGER trg_{table}_ins AFTER INSERT ON t_sys_attr_values
+        WHEN NEW.ent_name = '{ent_name}'
+        BEGIN
+            {add_row};
+            {_refresh_column(table, ent_name, attrs, "NEW")};
+        END""",
+        f"""CREATE TRIGGER trg_{table}_upd AFTER UPDATE OF ent_name, attr_name, ent_instance_id, value ON t_sys_attr_values
+        WHEN OLD.ent_name = '{ent_name}' OR NEW.ent_name = '{ent_name}'
+        BEGIN
+            {_refresh_column(table, ent_name, attrs, "OLD")};
+            {_drop_row(table, ent_name, "OLD")};
+            INSERT OR IGNORE INTO {table} (ent_instance_id) SELECT NEW.ent_instance_id WHERE NEW.ent_name = '{ent_name}';
+            {_refresh_column(table, ent_name, attrs, "NEW")};
+        END""",
+        f"""CREATE TRIGGER trg_{table}_del AFTER DELETE ON t_sys_attr_values
+        WHEN OLD.ent_name = '{ent_name}'
+        BEGIN
+            {_refresh_column(table, ent_name, attrs, "OLD")};
+            {_drop_row(table, ent_name, "OLD")};
+        END""",
+    ]
+
+
+async def _drop(db, ent_name):
+    table = table_name(ent_name)
+    for suffix in ("ins", "upd", "del"):
+        await db.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{suffix}")
+    await db.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+# Пересоздаёт таблицу и триггеры по текущему набору атрибутов и заполняет её из EAV
+async def build(db, ent_name):
+    table = table_name(ent_name)
+    attrs = await attributes(db, ent_name)
+    if not attrs:
+        raise ValueError(f"У сущности {ent_name} нет атрибутов в t_sys_attr")
+    await _drop(db, ent_name)
+    columns = ", ".join(f"\"{a}\" TEXT" for a in attrs)
+    await db.execute(f"CREATE TABLE {table} (ent_instance_id INTEGER PRIMARY KEY, {columns})")
+    for sql in _trigger_sql(ent_name, attrs):
+        await db.execute(sql)
+    names = ", ".join(f"\"{a}\"" for a in attrs)
+    pivot = ", ".join(f"MAX(CASE WHEN attr_name = '{a}' THEN value END)" for a in attrs)
+    await db.execute(
+        f"INSERT INTO {table} (ent_instance_id, {names}) "
+        f"SELECT ent_instance_id, {pivot} FROM t_sys_attr_values "
+        f"WHERE ent_name = ? GROUP BY ent_instance_id",
+        (ent_name,)
+    )
+    return set(attrs)
+
+
+async def enable(db, ent_name):
+    columns = await build(db, ent_name)
+    await db.execute("UPDATE t_sys_ent SET is_projected = 1 WHERE ent_name = ?", (ent_name,))
+    await _bump(db)
+    await db.commit()
+    _enabled[ent_name] = columns
+
+
+async def disable(db, ent_name):
+    await _drop(db, ent_name)
+    await db.execute("UPDATE t_sys_ent SET is_projected = 0 WHERE ent_name = ?", (ent_name,))
+    await _bump(db)
+    await db.commit()
+    _enabled.pop(ent_name, None)
+
+
+# Снимает таблицы и триггеры включённых проекций перед массовой загрузкой (is_projected
+# остаётся как был); вернуть их — rebuild() по возвращённому списку
+async def suspend(db):
+    targets = await load(db)
+    for ent_name in targets:
+        await _drop(db, ent_name)
+    await _bump(db)
+    _enabled.clear()
+    return targets
+
+
+# Полная перестройка включённых проекций (или только перечисленных)
+async def rebuild(db, ent_names=None):
+    rows = await db.execute_fetchall("SELECT ent_name FROM t_sys_ent WHERE is_projected = 1")
+    targets = [row["ent_name"] for row in rows]
+    if ent_names:
+        targets = [e for e in targets if e in ent_names]
+    for ent_name in targets:
+        _enabled[ent_name] = await build(db, ent_name)
+    await _bump(db)
+    await db.commit()
+    return targets
@@ -0,0 +1,151 @@
+from bisect import insort
+
+from core import versions
+
+# Справочники в памяти процесса: блюда, столы и категории. Меняются несколько раз в день,
+# а читаются на каждом просмотре корзины, оформлении заказа и брони. Загружаются одним
+# запросом при старте, записи — компактные объекты со __slots__ с индексами по id,
+# категории и залу. Справочник маленький и сбрасывается целиком: правки через admin_tools
+# сбрасывают его сразу после COMMIT писателя, правки других воркеров — подписка
+# в core/versions.py. Пути записи (оформление заказа, брони) справочником не пользуются:
+# цены и столы они читают в своей транзакции, где видны и правки из той же пачки.
+
+ENTS = ("dish", "table", "category")
+
+
+def _float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class Dish:
+    __slots__ = ("dish_id", "name", "price", "category", "description", "image_url", "is_active")
+
+    def __init__(self, dish_id, attrs):
+        self.dish_id = dish_id
+        self.name = attrs.get("name")
+        self.price = _float(attrs.get("price"))
+        self.category = attrs.get("category")
+        self.description = attrs.get("description", "")
+        self.image_url = attrs.get("image_url", "")
+        self.is_active = attrs.get("is_active", "true") != "false"
+
+
+class Table:
+    __slots__ = ("table_id", "number", "seats", "location")
+
+    def __init__(self, table_id, attrs):
+        self.table_id = table_id
+        # номер как в базе: его же отдают /tables и /tables/availability
+        self.number = attrs.get("number")
+        self.seats = _int(attrs.get("seats"))
+        self.location = attrs.get("location", "")
+
+
+class RefData:
+    def __init__(self):
+        self.dishes = {}
+        self.tables = {}
+        self.categories = {}    # category_id -> имя
+        self.by_category = {}   # имя категории -> [dish_id] по возрастанию
+        self.by_location = {}   # зал -> [table_id] по возрастанию
+
+    def put(self, ent_name, ent_id, attrs):
+        self.drop(ent_name, ent_id)
+        if not attrs:
+            return
+        if ent_name == "dish":
+            dish = self.dishes[ent_id] = Dish(ent_id, attrs)
+            insort(self.by_category.setdefault(dish.category, []), ent_id)
+        elif ent_name == "table":
+            table = self.tables[ent_id] = Table(ent_id, attrs)
+            insort(self.by_location.setdefault(table.location, []), ent_id)
+        elif ent_name == "category":
+            self.categories[ent_id] = attrs.get("name")
+
+    def drop(self, ent_name, ent_id):
+        if ent_name == "dish":
+            dish = self.dishes.pop(ent_id, None)
+            if dish is not None:
+                _unlink(self.by_category, dish.category, ent_id)
+        elif ent_name == "table":
+            table = self.tables.pop(ent_id, None)
+            if table is not None:
+                _unlink(self.by_location, table.location, ent_id)
+        elif ent_name == "category":
+            self.categories.pop(ent_id, None)
+
+    def dish(self, dish_id):
+        return self.dishes.get(_int(dish_id, None))
+
+    def table(self, table_id):
+        return self.tables.get(_int(table_id, None))
+
+    def dishes_in(self, category):
+        return [self.dishes[i] for i in self.by_category.get(category, ())]
+
+    def tables_in(self, location):
+        return [self.tables[i] for i in self.by_location.get(location, ())]
+
+
+def _unlink(index, key, ent_id):
+    ids = index.get(key)
+    if ids is not None:
+        ids.remove(ent_id)
+        if not ids:
+            del index[key]
+
+
+_data = None
+# Растёт при каждом сбросе: загрузка, начатая до сброса, не кладёт в кэш старые данные
+_generation = 0
+
+
+async def _read(db, where, params):
+    rows = await db.execute_fetchall(
+        f"SELECT ent_name, ent_instance_id, attr_name, value FROM t_sys_attr_values WHERE {where}",
+        params
+    )
+    found = {}
+    for row in rows:
+        found.setdefault((row[0], row[1]), {})[row[2]] = row[3]
+    return found
+
+
+async def load(db):
+    global _data
+    generation = _generation
+    data = RefData()
+    marks = ",".join("?" * len(ENTS))
+    for (ent_name, ent_id), attrs in sorted((await _read(db, f"ent_name IN ({marks})", ENTS)).items()):
+        data.put(ent_name, ent_id, attrs)
+    if generation == _generation:
+        _data = data
+    return data
+
+
+async def _changed(db, ent_name, appended_only):
+    invalidate()
+
+
+versions.subscribe(ENTS, _changed)
+
+
+async def get(db):
+    await versions.sync(db)
+    return _data if _data is not None else await load(db)
+
+
+def invalidate():
+    global _data, _generation
+    _data = None
+    _generation += 1
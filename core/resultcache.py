@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import time
+
+from core import metrics, versions
+from db import connect, reader
+
+# Готовые ответы аналитики (stale-while-revalidate). Запрос всегда получает последний
+# посчитанный результат сразу, с заголовком Age. Результат устаревает по времени (MAX_AGE)
+# или когда меняются его сущности (подписка в core/versions.py); устаревший отдаётся как
+# есть и будит фоновый пересчёт. Фоновая задача живёт в lifespan приложения и считает на
+# собственном read-only соединении, не занимая читателей пула. Из пула берётся соединение
+# только для первого расчёта ключа, которого в кэше ещё нет.
+# Запросы расчёта идут через metrics.TracedConnection: первый — в метрики и журнал
+# медленных запросов самого эндпоинта, фоновые — под route «resultcache:<name>».
+
+MAX_AGE = float(os.environ.get("ANALYTICS_MAX_AGE", "300"))
+# Как часто фоновая задача сверяет версии сущностей
+POLL_SECONDS = float(os.environ.get("ANALYTICS_POLL", "1"))
+# Ключи, которые никто не запрашивал столько секунд, больше не пересчитываются
+IDLE_SECONDS = float(os.environ.get("ANALYTICS_IDLE", "900"))
+
+# Сущности, от которых зависят отчёты
+ENTS = ("order", "order_item", "staff_shift", "booking", "table", "user")
+
+log = logging.getLogger("restoflow.resultcache")
+
+
+class Entry:
+    __slots__ = ("name", "compute", "params", "ent_names", "value", "computed_at", "used_at", "dirty")
+
+    def __init__(self, name, compute, params, ent_names):
+        self.name = name
+        self.compute = compute
+        self.params = params
+        self.ent_names = ent_names
+        self.value = None
+        self.computed_at = None
+        self.used_at = time.monotonic()
+        self.dirty = False
+
+    def stale(self, now):
+        return self.dirty or now - self.computed_at >= MAX_AGE
+
+    async def refresh(self, db, stats):
+        # флаг снимается до расчёта: запись во время расчёта снова пометит ключ
+        self.dirty = False
+        conn = metrics.TracedConnection(db, stats) if stats is not None else db
+        self.value = await self.compute(conn, *self.params)
+        self.computed_at = time.monotonic()
+
+
+# (name, params) -> Entry
+_entries = {}
+_wake = None
+_task = None
+
+
+def _ping():
+    if _wake is not None:
+        _wake.set()
+
+
+# Результат compute(db, *params) и его возраст в секундах; name отличает эндпоинты,
+# ent_names — сущности, после правки которых результат надо пересчитать
+async def get(name, ent_names, compute, *params):
+    now = time.monotonic()
+    entry = _entries.get((name, params))
+    if entry is None:
+        entry = Entry(name, compute, params, ent_names)
+        async with reader() as db:
+            await entry.refresh(db, metrics.current())
+        _entries[(name, params)] = entry
+    elif entry.stale(now):
+        _ping()
+    entry.used_at = now
+    return entry.value, int(now - entry.computed_at)
+
+
+async def _changed(db, ent_name, appended_only):
+    for entry in _entries.values():
+        if ent_name in entry.ent_names:
+            entry.dirty = True
+    _ping()
+
+
+versions.subscribe(ENTS, _changed)
+
+
+async def _refresh_due(db):
+    now = time.monotonic()
+    for key, entry in list(_entries.items()):
+        if now - entry.used_at > IDLE_SECONDS:
+            _entries.pop(key, None)
+        elif entry.stale(now):
+            stats = metrics.task_stats(f"resultcache:{entry.name}")
+            try:
+                await entry.refresh(db, stats)
+            except Exception:
+                # старый результат остаётся, следующая попытка — на следующем проходе
+                log.exception("Пересчёт %s не удался", key[0])
+            finally:
+                metrics.record_task(stats)
+
+
+async def _run(db):
+    while True:
+        try:
+            await asyncio.wait_for(_wake.wait(), POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wake.clear()
+        try:
+            await versions.sync(db)
+        except Exception:
+            log.exception("Сверка версий не удалась")
+        await _refresh_due(db)
+
+
+async def start():
+    global _wake, _task
+    _wake = asyncio.Event()
+    db = await connect(readonly=True)
+
+    async def run():
+        try:
+            await _run(db)
+        finally:
+            await db.close()
+
+    _task = asyncio.ensure_future(run())
+
+
+async def stop():
+    global _wake, _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+    _entries.clear()
+    _wake = _task = None
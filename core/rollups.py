@@ -0,0 +1,241 @@
+from collections import defaultdict
+from datetime import date, timedelta
+
+from core import typed
+
+# Дневные агрегаты заказов для аналитики: agg_daily_orders (заказы и выручка за день),
+# agg_dish_daily (продажи блюда за день) и agg_staff_daily (заказы, выручка и часы смен
+# официанта за день). place_order дописывает их в своей транзакции, правки заказов и смен
+# через админку пересчитывают затронутые дни, rebuild() строит всё с нуля
+# (python manage.py rebuild-rollups). Дашборд читает столько строк, сколько дней показывает.
+
+# Сущности, правка которых меняет агрегаты
+ENTS = ("order", "order_item", "staff_shift")
+
+DDL = (
+    """CREATE TABLE IF NOT EXISTS agg_daily_orders (
+        day TEXT PRIMARY KEY,
+        order_count INTEGER NOT NULL,
+        revenue REAL NOT NULL
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS agg_dish_daily (
+        day TEXT NOT NULL,
+        dish_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL,
+        revenue REAL NOT NULL,
+        PRIMARY KEY (day, dish_id)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS agg_staff_daily (
+        day TEXT NOT NULL,
+        waiter_id INTEGER NOT NULL,
+        order_count INTEGER NOT NULL,
+        revenue REAL NOT NULL,
+        hours REAL NOT NULL,
+        shift_count INTEGER NOT NULL,
+        PRIMARY KEY (day, waiter_id)
+    ) WITHOUT ROWID""",
+    # Отчёт по одному официанту за период
+    "CREATE INDEX IF NOT EXISTS idx_agg_staff_waiter ON agg_staff_daily (waiter_id, day)",
+)
+
+DOCS = [
+    ("table", "agg_daily_orders", None, "Заказы по дням: число заказов и выручка (ведётся place_order)"),
+    ("column", "agg_daily_orders", "day", "День ГГГГ-ММ-ДД по order.created_at"),
+    ("column", "agg_daily_orders", "order_count", "Заказов за день"),
+    ("column", "agg_daily_orders", "revenue", "Сумма order.total_price за день"),
+    ("table", "agg_dish_daily", None, "Продажи блюд по дням (ведётся place_order)"),
+    ("column", "agg_dish_daily", "day", "День ГГГГ-ММ-ДД по order.created_at"),
+    ("column", "agg_dish_daily", "dish_id", "Блюдо"),
+    ("column", "agg_dish_daily", "qty", "Сумма order_item.quantity"),
+    ("column", "agg_dish_daily", "revenue", "Сумма quantity * price позиций"),
+]
+
+STAFF_DOCS = [
+    ("table", "agg_staff_daily", None, "Работа официантов по дням: заказы, выручка, смены (ведётся place_order)"),
+    ("column", "agg_staff_daily", "day", "День ГГГГ-ММ-ДД по order.created_at и staff_shift.start_time"),
+    ("column", "agg_staff_daily", "waiter_id", "Официант (order.waiter_id, staff_shift.user_id)"),
+    ("column", "agg_staff_daily", "order_count", "Заказов официанта за день"),
+    ("column", "agg_staff_daily", "revenue", "Сумма order.total_price его заказов"),
+    ("column", "agg_staff_daily", "hours", "Часов в сменах, начавшихся в этот день"),
+    ("column", "agg_staff_daily", "shift_count", "Смен, начавшихся в этот день"),
+]
+
+# Заказы с днём и суммой; {where} — пусто или фильтр по диапазону created_at
+_ORDERS = """
+    SELECT c.ent_instance_id AS order_id, DATE(c.value) AS day, t.value_num AS total
+    FROM t_sys_attr_values c
+    LEFT JOIN t_sys_attr_values t
+      ON t.ent_name = 'order' AND t.attr_name = 'total_price' AND t.ent_instance_id = c.ent_instance_id
+    WHERE c.ent_name = 'order' AND c.attr_name = 'created_at' {where}
+"""
+
+_FILL_ORDERS = """
+    INSERT INTO agg_daily_orders (day, order_count, revenue)
+    SELECT day, COUNT(*), IFNULL(SUM(total), 0)
+    FROM ({orders})
+    WHERE day IS NOT NULL
+    GROUP BY day
+"""
+
+# CROSS JOIN фиксирует порядок заказ → позиции → атрибуты позиции: без статистики
+# (сразу после загрузки) планировщик иначе перебирает все dish_id на каждый заказ
+_FILL_DISHES = """
+    INSERT INTO agg_dish_daily (day, dish_id, qty, revenue)
+    SELECT o.day, CAST(d.value_num AS INTEGER),
+           SUM(q.value_num),
+           IFNULL(SUM(q.value_num * p.value_num), 0)
+    FROM ({orders}) o
+    CROSS JOIN t_sys_attr_values oi
+      ON oi.ent_name = 'order_item' AND oi.attr_name = 'order_id' AND oi.value = CAST(o.order_id AS TEXT)
+    CROSS JOIN t_sys_attr_values d
+      ON d.ent_name = 'order_item' AND d.attr_name = 'dish_id' AND d.ent_instance_id = oi.ent_instance_id
+    CROSS JOIN t_sys_attr_values q
+      ON q.ent_name = 'order_item' AND q.attr_name = 'quantity' AND q.ent_instance_id = oi.ent_instance_id
+    LEFT JOIN t_sys_attr_values p
+      ON p.ent_name = 'order_item' AND p.attr_name = 'price' AND p.ent_instance_id = oi.ent_instance_id
+    WHERE o.day IS NOT NULL
+    GROUP BY o.day, CAST(d.value_num AS INTEGER)
+"""
+
+_FILL_STAFF_ORDERS = """
+    INSERT INTO agg_staff_daily (day, waiter_id, order_count, revenue, hours, shift_count)
+    SELECT o.day, CAST(w.value_num AS INTEGER), COUNT(*), IFNULL(SUM(o.total), 0), 0, 0
+    FROM ({orders}) o
+    JOIN t_sys_attr_values w
+      ON w.ent_name = 'order' AND w.attr_name = 'waiter_id' AND w.ent_instance_id = o.order_id
+    WHERE o.day IS NOT NULL AND w.value_num IS NOT NULL
+    GROUP BY o.day, CAST(w.value_num AS INTEGER)
+"""
+
+# Смена относится к дню своего начала; часы — разность value_ts, смена без конца даёт 0
+_FILL_STAFF_SHIFTS = """
+    INSERT INTO agg_staff_daily (day, waiter_id, order_count, revenue, hours, shift_count)
+    SELECT DATE(s.value), CAST(u.value_num AS INTEGER), 0, 0,
+           IFNULL(SUM((e.value_ts - s.value_ts) / 3600.0), 0), COUNT(*)
+    FROM t_sys_attr_values s
+    JOIN t_sys_attr_values u
+      ON u.ent_name = 'staff_shift' AND u.attr_name = 'user_id' AND u.ent_instance_id = s.ent_instance_id
+    LEFT JOIN t_sys_attr_values e
+      ON e.ent_name = 'staff_shift' AND e.attr_name = 'end_time' AND e.ent_instance_id = s.ent_instance_id
+    WHERE s.ent_name = 'staff_shift' AND s.attr_name = 'start_time' {where} AND DATE(s.value) IS NOT NULL
+    GROUP BY DATE(s.value), CAST(u.value_num AS INTEGER)
+    ON CONFLICT (day, waiter_id) DO UPDATE SET hours = excluded.hours, shift_count = excluded.shift_count
+"""
+
+
+async def create(db):
+    for sql in DDL:
+        await db.execute(sql)
+
+
+# Заказ оформлен: items — (dish_id, quantity, price) позиций; вызывать до commit
+async def order_placed(db, created_at, total, items, waiter_id=None):
+    day = created_at[:10]
+    await db.execute(
+        "INSERT INTO agg_daily_orders (day, order_count, revenue) VALUES (?, 1, ?) "
+        "ON CONFLICT (day) DO UPDATE SET order_count = order_count + 1, revenue = revenue + excluded.revenue",
+        (day, float(total))
+    )
+    if waiter_id is not None:
+        await db.execute(
+            "INSERT INTO agg_staff_daily (day, waiter_id, order_count, revenue, hours, shift_count) "
+            "VALUES (?, ?, 1, ?, 0, 0) ON CONFLICT (day, waiter_id) DO UPDATE SET "
+            "order_count = order_count + 1, revenue = revenue + excluded.revenue",
+            (day, int(waiter_id), float(total))
+        )
+    dishes = defaultdict(lambda: [0, 0.0])
+    for dish_id, quantity, price in items:
+        dishes[int(dish_id)][0] += int(quantity)
+        dishes[int(dish_id)][1] += int(quantity) * float(price)
+    await db.executemany(
+        "INSERT INTO agg_dish_daily (day, dish_id, qty, revenue) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (day, dish_id) DO UPDATE SET qty = qty + excluded.qty, revenue = revenue + excluded.revenue",
+        [(day, dish_id, qty, revenue) for dish_id, (qty, revenue) in dishes.items()]
+    )
+
+
+# Все агрегаты заново из t_sys_attr_values; коммитит вызывающий
+async def rebuild(db):
+    await clear(db)
+    orders = _ORDERS.format(where="")
+    await db.execute(_FILL_ORDERS.format(orders=orders))
+    await db.execute(_FILL_DISHES.format(orders=orders))
+    await rebuild_staff(db)
+
+
+async def clear(db):
+    await create(db)
+    await db.execute("DELETE FROM agg_daily_orders")
+    await db.execute("DELETE FROM agg_dish_daily")
+    await db.execute("DELETE FROM agg_staff_daily")
+
+
+# Готовые суммы по дням (массовая загрузка, core/seed.py) прибавляются к уже накопленным:
+# daily — (day, order_count, revenue), dishes — (day, dish_id, qty, revenue),
+# staff — (day, waiter_id, order_count, revenue, hours, shift_count)
+async def merge(db, daily, dishes, staff):
+    await create(db)
+    await db.executemany(
+        "INSERT INTO agg_daily_orders (day, order_count, revenue) VALUES (?, ?, ?) "
+        "ON CONFLICT (day) DO UPDATE SET order_count = order_count + excluded.order_count, "
+        "revenue = revenue + excluded.revenue",
+        daily
+    )
+    await db.executemany(
+        "INSERT INTO agg_dish_daily (day, dish_id, qty, revenue) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (day, dish_id) DO UPDATE SET qty = qty + excluded.qty, revenue = revenue + excluded.revenue",
+        dishes
+    )
+    await db.executemany(
+        "INSERT INTO agg_staff_daily (day, waiter_id, order_count, revenue, hours, shift_count) "
+        "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (day, waiter_id) DO UPDATE SET "
+        "order_count = order_count + excluded.order_count, revenue = revenue + excluded.revenue, "
+        "hours = hours + excluded.hours, shift_count = shift_count + excluded.shift_count",
+        staff
+    )
+
+
+async def rebuild_staff(db):
+    await db.execute("DELETE FROM agg_staff_daily")
+    await db.execute(_FILL_STAFF_ORDERS.format(orders=_ORDERS.format(where="")))
+    await db.execute(_FILL_STAFF_SHIFTS.format(where=""))
+
+
+# Пересчёт отдельных дней (ГГГГ-ММ-ДД) — после правок заказов в обход place_order
+async def refresh(db, days):
+    orders = _ORDERS.format(where="AND c.value_ts >= ? AND c.value_ts < ?")
+    for day in sorted(d for d in days if d):
+        first = date.fromisoformat(day)
+        bounds = (typed.epoch(first), typed.epoch(first + timedelta(days=1)))
+        await db.execute("DELETE FROM agg_daily_orders WHERE day = ?", (day,))
+        await db.execute("DELETE FROM agg_dish_daily WHERE day = ?", (day,))
+        await db.execute("DELETE FROM agg_staff_daily WHERE day = ?", (day,))
+        await db.execute(_FILL_ORDERS.format(orders=orders), bounds)
+        await db.execute(_FILL_DISHES.format(orders=orders), bounds)
+        await db.execute(_FILL_STAFF_ORDERS.format(orders=orders), bounds)
+        await db.execute(_FILL_STAFF_SHIFTS.format(where="AND s.value_ts >= ? AND s.value_ts < ?"), bounds)
+
+
+# Дни, в агрегаты которых входит экземпляр order, order_item или staff_shift
+async def days_of(db, ent_name, ent_id):
+    if ent_name == "staff_shift":
+        rows = await db.execute_fetchall(
+            "SELECT DATE(value) AS day FROM t_sys_attr_values "
+            "WHERE ent_name = 'staff_shift' AND attr_name = 'start_time' AND ent_instance_id = ?",
+            (ent_id,)
+        )
+    elif ent_name == "order_item":
+        rows = await db.execute_fetchall(
+            "SELECT DATE(c.value) AS day FROM t_sys_attr_values oi "
+            "JOIN t_sys_attr_values c ON c.ent_name = 'order' AND c.attr_name = 'created_at' "
+            "AND c.ent_instance_id = oi.value_num "
+            "WHERE oi.ent_name = 'order_item' AND oi.attr_name = 'order_id' AND oi.ent_instance_id = ?",
+            (ent_id,)
+        )
+    else:
+        rows = await db.execute_fetchall(
+            "SELECT DATE(value) AS day FROM t_sys_attr_values "
+            "WHERE ent_name = 'order' AND attr_name = 'created_at' AND ent_instance_id = ?",
+            (ent_id,)
+        )
+    return {row["day"] for row in rows if row["day"]}
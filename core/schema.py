@@ -0,0 +1,221 @@
+# Миграции схемы david.db.
+# Номер последней применённой миграции хранится в PRAGMA user_version,
+# каждая миграция выполняется один раз при старте приложения.
+
+import re
+
+from core import rollups, typed, versions
+
+# Атрибуты, которые реально пишут роутеры из api/ (в t_sys_attr их не хватало)
+ATTRS = [
+    ("dish", "name", "TEXT"), ("dish", "price", "NUMERIC"), ("dish", "description", "TEXT"),
+    ("dish", "category", "TEXT"), ("dish", "image_url", "TEXT"), ("dish", "is_active", "TEXT"),
+    ("dish", "created_at", "TEXT"), ("dish", "updated_at", "TEXT"),
+    ("category", "name", "TEXT"),
+    ("user", "name", "TEXT"), ("user", "phone", "TEXT"), ("user", "city", "TEXT"),
+    ("user", "street", "TEXT"), ("user", "house", "TEXT"), ("user", "building", "TEXT"),
+    ("user", "floor", "TEXT"), ("user", "flat", "TEXT"), ("user", "created_at", "TEXT"),
+    ("user", "loyalty_discount", "NUMERIC"), ("user", "loyalty_total", "NUMERIC"),
+    ("booking", "user_id", "INTEGER"), ("booking", "datetime", "TEXT"), ("booking", "table_id", "INTEGER"),
+    ("booking", "guests", "INTEGER"), ("booking", "comment", "TEXT"), ("booking", "created_at", "TEXT"),
+    ("review", "user_id", "INTEGER"), ("review", "rating", "INTEGER"), ("review", "comment", "TEXT"),
+    ("review", "created_at", "TEXT"), ("review", "dish_id", "INTEGER"), ("review", "restaurant", "TEXT"),
+    ("news", "title", "TEXT"), ("news", "body", "TEXT"), ("news", "type", "TEXT"),
+    ("news", "image_url", "TEXT"), ("news", "tags", "TEXT"), ("news", "created_at", "TEXT"),
+    ("order", "user_id", "INTEGER"), ("order", "address_id", "INTEGER"), ("order", "status", "TEXT"),
+    ("order", "total_price", "NUMERIC"), ("order", "created_at", "TEXT"), ("order", "waiter_id", "INTEGER"),
+    ("order_item", "order_id", "INTEGER"), ("order_item", "dish_id", "INTEGER"),
+    ("order_item", "quantity", "INTEGER"), ("order_item", "price", "NUMERIC"),
+    ("cart", "user_id", "INTEGER"),
+    ("cart_item", "cart_id", "INTEGER"), ("cart_item", "dish_id", "INTEGER"), ("cart_item", "quantity", "INTEGER"),
+    ("table", "number", "INTEGER"), ("table", "seats", "INTEGER"), ("table", "location", "TEXT"),
+    ("support_message", "name", "TEXT"), ("support_message", "phone", "TEXT"),
+    ("support_message", "message", "TEXT"), ("support_message", "created_at", "TEXT"),
+    ("staff_shift", "user_id", "INTEGER"), ("staff_shift", "start_time", "TEXT"), ("staff_shift", "end_time", "TEXT"),
+]
+
+ENTS = [("support_message", "marketing"), ("staff_shift", "restaurant")]
+
+# Атрибуты, по значению которых идут самые частые выборки
+INDEXED = [
+    ("user", "phone"),
+    ("cart", "user_id"),
+    ("cart_item", "cart_id"),
+    ("cart_item", "dish_id"),
+    ("booking", "user_id"),
+    ("booking", "table_id"),
+    ("booking", "datetime"),
+    ("review", "dish_id"),
+    ("review", "restaurant"),
+    ("order", "user_id"),
+    ("order_item", "order_id"),
+]
+
+
+_IDENT = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+# Имена сущностей и атрибутов попадают в DDL, поэтому пропускаем только идентификаторы
+def check_name(name):
+    if not _IDENT.match(name):
+        raise ValueError(f"Недопустимое имя: {name!r}")
+    return name
+
+
+async def _columns(db, table):
+    rows = await db.execute_fetchall(f"PRAGMA table_info({table})")
+    return {row["name"] for row in rows}
+
+
+async def _m1_attr_catalog(db):
+    await db.executemany(
+        "INSERT INTO t_sys_ent (ent_name, ent_app) SELECT ?, ? "
+        "WHERE NOT EXISTS (SELECT 1 FROM t_sys_ent WHERE ent_name = ?)",
+        [(ent, app, ent) for ent, app in ENTS]
+    )
+    await db.executemany(
+        "INSERT INTO t_sys_attr (ent_name, attr_name, attr_type) SELECT ?, ?, ? "
+        "WHERE NOT EXISTS (SELECT 1 FROM t_sys_attr WHERE ent_name = ? AND attr_name = ?)",
+        [(ent, attr, typ, ent, attr) for ent, attr, typ in ATTRS]
+    )
+    if "is_indexed" not in await _columns(db, "t_sys_attr"):
+        await db.execute("ALTER TABLE t_sys_attr ADD COLUMN is_indexed INTEGER DEFAULT 0")
+        await db.execute(
+            "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) "
+            "VALUES ('column', 't_sys_attr', 'is_indexed', 'Строить ли индекс по значению атрибута (1 — да, 0 — нет)')"
+        )
+    await db.executemany(
+        "UPDATE t_sys_attr SET is_indexed = 1 WHERE ent_name = ? AND attr_name = ?",
+        INDEXED
+    )
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_sys_attr_name ON t_sys_attr (ent_name, attr_name)")
+
+
+async def _m2_projections(db):
+    if "is_projected" not in await _columns(db, "t_sys_ent"):
+        await db.execute("ALTER TABLE t_sys_ent ADD COLUMN is_projected INTEGER DEFAULT 0")
+        await db.execute(
+            "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) "
+            "VALUES ('column', 't_sys_ent', 'is_projected', 'Ведётся ли широкая таблица proj_<ent_name> (1 — да, 0 — нет)')"
+        )
+    # Все атрибуты одного экземпляра: нужны триггерам проекций и выборкам по ent_instance_id
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sys_data_entity ON t_sys_attr_values (ent_name, ent_instance_id)"
+    )
+
+
+async def _m3_sequences(db):
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS t_sys_seq (ent_name TEXT PRIMARY KEY, next_id INTEGER NOT NULL)"
+    )
+    await db.executemany(
+        "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) VALUES (?, 't_sys_seq', ?, ?)",
+        [
+            ("table", None, "Счётчики ent_instance_id по сущностям"),
+            ("column", "ent_name", "Имя сущности"),
+            ("column", "next_id", "Следующий ещё не выданный ent_instance_id"),
+        ]
+    )
+    await db.execute(
+        "INSERT OR IGNORE INTO t_sys_seq (ent_name, next_id) "
+        "SELECT ent_name, MAX(ent_instance_id) + 1 FROM t_sys_attr_values GROUP BY ent_name"
+    )
+
+
+async def _m4_rollups(db):
+    await rollups.create(db)
+    await db.executemany(
+        "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) VALUES (?, ?, ?, ?)",
+        rollups.DOCS
+    )
+    # Пересчёт дней после правок заказов ищет заказы диапазоном по created_at
+    await db.execute("UPDATE t_sys_attr SET is_indexed = 1 WHERE ent_name = 'order' AND attr_name = 'created_at'")
+
+
+async def _m5_staff_rollups(db):
+    await rollups.create(db)
+    await db.executemany(
+        "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) VALUES (?, ?, ?, ?)",
+        rollups.STAFF_DOCS
+    )
+    await db.execute("UPDATE t_sys_attr SET is_indexed = 1 WHERE ent_name = 'staff_shift' AND attr_name = 'start_time'")
+
+
+# Атрибуты с диапазонными индексами по value_num / value_ts
+RANGE_INDEXED = [
+    ("dish", "price"),
+    ("table", "seats"),
+    ("review", "rating"),
+    ("booking", "datetime"),
+    ("order", "created_at"),
+    ("staff_shift", "start_time"),
+]
+
+
+async def _m6_typed_values(db):
+    columns = await _columns(db, "t_sys_attr_values")
+    for column, sql_type, comment in (
+        ("value_num", "REAL", "Числовое значение для атрибутов INTEGER/NUMERIC/REAL (ведётся триггером)"),
+        ("value_ts", "INTEGER", "Дата атрибута DATETIME в секундах эпохи (ведётся триггером)"),
+    ):
+        if column not in columns:
+            await db.execute(f"ALTER TABLE t_sys_attr_values ADD COLUMN {column} {sql_type}")
+            await db.execute(
+                "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) "
+                "VALUES ('column', 't_sys_attr_values', ?, ?)",
+                (column, comment)
+            )
+    if "is_range_indexed" not in await _columns(db, "t_sys_attr"):
+        await db.execute("ALTER TABLE t_sys_attr ADD COLUMN is_range_indexed INTEGER DEFAULT 0")
+        await db.execute(
+            "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) "
+            "VALUES ('column', 't_sys_attr', 'is_range_indexed', 'Строить ли индекс по value_num/value_ts (1 — да, 0 — нет)')"
+        )
+    marks = ",".join("?" * len(typed.DATETIME_ATTRS))
+    await db.execute(
+        f"UPDATE t_sys_attr SET attr_type = 'DATETIME' WHERE attr_type = 'TEXT' AND attr_name IN ({marks})",
+        typed.DATETIME_ATTRS
+    )
+    await db.executemany(
+        "UPDATE t_sys_attr SET is_range_indexed = 1 WHERE ent_name = ? AND attr_name = ?",
+        RANGE_INDEXED
+    )
+    # Диапазоны по этим датам теперь идут по value_ts: текстовые индексы из миграций 4 и 5 не нужны
+    await db.execute(
+        "UPDATE t_sys_attr SET is_indexed = 0 "
+        "WHERE (ent_name, attr_name) IN (VALUES ('order', 'created_at'), ('staff_shift', 'start_time'))"
+    )
+    await typed.install(db)
+    await typed.backfill(db)
+    # Агрегаты читают value_num / value_ts, поэтому заполняются после типизации
+    await rollups.rebuild(db)
+    # Триггеры проекций пересоздаются с UPDATE OF ..., чтобы не срабатывать на типизацию
+    from core import projections
+    await projections.rebuild(db)
+
+
+async def _m7_versions(db):
+    await versions.create(db)
+    await db.executemany(
+        "INSERT INTO t_sys_doc (object_type, object_name, column_name, comment) VALUES (?, ?, ?, ?)",
+        versions.DOCS
+    )
+
+
+MIGRATIONS = [
+    _m1_attr_catalog,
+    _m2_projections,
+    _m3_sequences,
+    _m4_rollups,
+    _m5_staff_rollups,
+    _m6_typed_values,
+    _m7_versions,
+]
+
+
+async def migrate(db):
+    version = (await db.execute_fetchall("PRAGMA user_version"))[0][0]
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        await step(db)
+        await db.execute(f"PRAGMA user_version = {number}")
+        await db.commit()
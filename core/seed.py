@@ -0,0 +1,474 @@
+import asyncio
+import json
+import random
+import time
+from datetime import date, datetime, timedelta
+from itertools import accumulate, islice
+
+import numpy as np
+
+from core import indexes, projections, rollups, sequences, typed, versions
+
+# Синтетические данные в t_sys_attr_values в том же виде, в каком их пишут роутеры api/:
+# пользователи с адресом и лояльностью, категории и блюда, столы, брони, корзины,
+# заказы с позициями, отзывы и смены официантов. Одинаковый seed даёт одинаковую базу.
+#   python manage.py seed --orders 300000 --users 20000 --seed 42 --reset
+
+SEEDED = ("category", "dish", "table", "user", "staff_shift", "booking", "cart", "cart_item",
+          "order", "order_item", "review")
+
+CATEGORIES = {
+    "Супы": ("Борщ", "Солянка", "Уха", "Щи", "Рамен"),
+    "Салаты": ("Цезарь", "Оливье", "Греческий", "Винегрет", "Нисуаз"),
+    "Горячее": ("Стейк", "Бефстроганов", "Котлета по-киевски", "Утиная грудка", "Судак"),
+    "Паста": ("Карбонара", "Болоньезе", "Песто", "Арабьята", "Феттучини"),
+    "Пицца": ("Маргарита", "Пепперони", "Четыре сыра", "Гавайская", "Дьябола"),
+    "Закуски": ("Брускетта", "Сырная тарелка", "Хумус", "Тартар", "Крылышки"),
+    "Десерты": ("Тирамису", "Чизкейк", "Медовик", "Панна-котта", "Эклер"),
+    "Напитки": ("Морс", "Лимонад", "Капучино", "Чай", "Сок"),
+}
+PRICES = {"Супы": (250, 550), "Салаты": (300, 650), "Горячее": (550, 1600), "Паста": (400, 850),
+          "Пицца": (450, 950), "Закуски": (250, 700), "Десерты": (250, 500), "Напитки": (120, 350)}
+
+NAMES = ("Анна", "Иван", "Мария", "Дмитрий", "Елена", "Сергей", "Ольга", "Алексей", "Наталья", "Павел")
+CITIES = ("Москва", "Санкт-Петербург", "Казань", "Екатеринбург")
+STREETS = ("Ленина", "Мира", "Садовая", "Пушкина", "Гагарина", "Советская", "Лесная", "Школьная")
+LOCATIONS = ("зал", "веранда", "терраса", "VIP")
+COMMENTS = ("", "", "", "Вкусно!", "Быстрая доставка", "Порции могли быть больше", "Всё понравилось",
+            "Приду ещё", "Долго ждали")
+
+# Заказы чаще в обед и вечером, в пятницу-субботу больше
+HOUR_WEIGHTS = {10: 2, 11: 4, 12: 9, 13: 10, 14: 7, 15: 4, 16: 4, 17: 6, 18: 9, 19: 10, 20: 9, 21: 6, 22: 3}
+WEEKDAY_WEIGHTS = (0.8, 0.85, 0.9, 1.0, 1.3, 1.4, 1.1)
+# Окна броней по 2 часа — в одном окне у стола только одна бронь
+BOOKING_SLOTS = ("12:00", "14:00", "16:00", "18:00", "20:00")
+SHIFTS = (("10:00", "16:00"), ("16:00", "23:00"))
+# Статусы заказа по коду: последний день — вперемешку первые три, до него — доставлен или отменён
+STATUSES = ("pending", "cooking", "delivered", "cancelled")
+DELIVERED, CANCELLED = 2, 3
+QUANTITIES = (1, 1, 1, 2, 2, 3)
+# Скидка по сумме заказов: (порог, %)
+LOYALTY_TIERS = ((100000, 10), (50000, 7), (20000, 5), (0, 3))
+
+BATCH = 200000
+
+INSERT = "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value) VALUES (?, ?, ?, ?)"
+
+
+def _stamp(dt):
+    return dt.isoformat(timespec="seconds")
+
+
+def _hours(clock):
+    hour, minute = map(int, clock.split(":"))
+    return hour + minute / 60
+
+
+class Seeder:
+    def __init__(self, users=20000, orders=300000, bookings=40000, reviews=30000, dishes=150,
+                 tables=30, waiters=25, carts=1000, days=365, start=date(2025, 1, 1), seed=42):
+        self.counts = {"user": users, "order": orders, "booking": bookings, "review": reviews,
+                       "dish": dishes, "table": tables, "cart": min(carts, users)}
+        self.waiters = max(1, min(waiters, users))
+        self.days = days
+        self.start = datetime.combine(start, datetime.min.time())
+        self.rng = random.Random(seed)
+        self.np_rng = np.random.default_rng(seed)
+        self.ids = {}
+        self.spent = {}
+
+    # id выдаются через t_sys_seq, поэтому данные можно доливать в непустую базу
+    async def allocate(self, db, ent_name, count):
+        self.ids[ent_name] = await sequences.next_ids(db, ent_name, count) if count else []
+        return self.ids[ent_name]
+
+    def categories(self):
+        for cat_id, name in zip(self.ids["category"], CATEGORIES):
+            yield "category", "name", cat_id, name
+
+    def dishes(self):
+        rng = self.rng
+        names = list(CATEGORIES)
+        self.prices = {}
+        for n, dish_id in enumerate(self.ids["dish"], start=1):
+            category = names[n % len(names)]
+            low, high = PRICES[category]
+            price = float(rng.randrange(low, high, 10))
+            self.prices[dish_id] = price
+            created = self.start - timedelta(days=rng.randrange(30, 400))
+            yield from (
+                ("dish", "name", dish_id, f"{rng.choice(CATEGORIES[category])} №{n}"),
+                ("dish", "price", dish_id, str(price)),
+                ("dish", "description", dish_id, f"{category}, порция {rng.randrange(150, 450, 50)} г"),
+                ("dish", "category", dish_id, category),
+                ("dish", "image_url", dish_id, f"/static/img/dish_{n % 40}.jpg"),
+                ("dish", "is_active", dish_id, "true" if rng.random() > 0.05 else "false"),
+                ("dish", "created_at", dish_id, _stamp(created)),
+            )
+        # Популярность блюд неравномерна: первые в списке заказывают заметно чаще
+        self.dish_ids = self.ids["dish"]
+        self.dish_weights = list(accumulate(1 / (i + 1) ** 0.8 for i in range(len(self.dish_ids))))
+
+    def tables(self):
+        rng = self.rng
+        self.seats = {}
+        for n, table_id in enumerate(self.ids["table"], start=1):
+            seats = rng.choice((2, 2, 4, 4, 4, 6, 8))
+            self.seats[table_id] = seats
+            yield from (
+                ("table", "number", table_id, str(n)),
+                ("table", "seats", table_id, str(seats)),
+                ("table", "location", table_id, rng.choice(LOCATIONS)),
+            )
+
+    # Официанты — первые пользователи; график расписывается заранее на каждый день,
+    # чтобы waiter_id заказа всегда указывал на того, кто в этот час работал
+    def roster(self):
+        rng = self.rng
+        staff = self.ids["user"][:self.waiters]
+        self.on_duty = []
+        self.shift_rows = []
+        for day in range(self.days):
+            today = (self.start + timedelta(days=day)).date().isoformat()
+            working = [w for w in staff if rng.random() < 5 / 7] or [rng.choice(staff)]
+            halves = ([], [])
+            if len(working) == 1:
+                halves[0].append(working[0])
+                halves[1].append(working[0])
+                self.shift_rows.append((working[0], today, "10:00", "23:00"))
+            else:
+                for i, waiter in enumerate(working):
+                    halves[i % 2].append(waiter)
+                    self.shift_rows.append((waiter, today, *SHIFTS[i % 2]))
+            self.on_duty.append(halves)
+
+    def shifts(self):
+        for shift_id, (waiter, day, begin, end) in zip(self.ids["staff_shift"], self.shift_rows):
+            yield from (
+                ("staff_shift", "user_id", shift_id, str(waiter)),
+                ("staff_shift", "start_time", shift_id, f"{day}T{begin}:00"),
+                ("staff_shift", "end_time", shift_id, f"{day}T{end}:00"),
+            )
+
+    # Заказы и позиции — основная масса строк, поэтому генерируются колонками NumPy,
+    # а не кортежами: на выходе (сущность, атрибут, первый id, значения подряд идущих id)
+    def orders(self):
+        rng = self.np_rng
+        order_ids = np.array(self.ids["order"], dtype=np.int64)
+        n = len(order_ids)
+        users = np.array(self.ids["user"], dtype=np.int64)
+        day_weights = np.array([WEEKDAY_WEIGHTS[(self.start + timedelta(days=d)).weekday()] for d in range(self.days)])
+        hour_weights = np.array(list(HOUR_WEIGHTS.values()), dtype=np.float64)
+        days = rng.choice(self.days, size=n, p=day_weights / day_weights.sum())
+        hours = rng.choice(np.array(list(HOUR_WEIGHTS)), size=n, p=hour_weights / hour_weights.sum())
+        # id заказов растут вместе с created_at, как при живой работе
+        moments = np.sort(days * 86400 + hours * 3600 + rng.integers(0, 3600, n))
+        day, hour = moments // 86400, moments % 86400 // 3600
+        # Постоянные клиенты: младшие id заказывают чаще
+        user_id = users[(len(users) * rng.random(n) ** 1.5).astype(np.int64)]
+
+        # Официант — случайный из тех, кто работал в эту половину дня: списки on_duty
+        # склеены в один массив, слот (день, половина) даёт смещение и длину своего списка
+        duty = [half for halves in self.on_duty for half in halves]
+        lengths = np.array([len(half) for half in duty])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        staff = np.array([w for half in duty for w in half], dtype=np.int64)
+        slot = day * 2 + (hour >= 16)
+        waiter_id = staff[offsets[slot] + (rng.random(n) * lengths[slot]).astype(np.int64)]
+
+        status = np.where(rng.random(n) < 0.04, CANCELLED, DELIVERED)
+        last = day == self.days - 1
+        status[last] = rng.integers(0, 3, int(last.sum()))
+
+        # Позиции: блюдо по весам популярности, цена — из меню
+        item_order = np.repeat(np.arange(n), self.lines)
+        cum = np.array(self.dish_weights)
+        dish = np.searchsorted(cum, rng.random(len(item_order)) * cum[-1], side="right")
+        dish_id = np.array(self.dish_ids, dtype=np.int64)[dish]
+        price = np.array([self.prices[d] for d in self.dish_ids])[dish]
+        quantity = np.array(QUANTITIES)[rng.integers(0, len(QUANTITIES), len(item_order))]
+        total = np.bincount(item_order, weights=price * quantity, minlength=n)
+
+        kept = status != CANCELLED
+        spent = np.bincount(np.searchsorted(users, user_id[kept]), weights=total[kept], minlength=len(users))
+        self.spent = dict(zip(users.tolist(), spent.tolist()))
+        self.sold = (day, total, waiter_id, day[item_order], dish, quantity, price)
+
+        first_order, first_item = self.ids["order"][0], self.ids["order_item"][0]
+        created = typed.epoch(self.start) + moments
+        return [
+            ("order_item", "order_id", first_item, order_ids[item_order].tolist()),
+            ("order_item", "dish_id", first_item, dish_id.tolist()),
+            ("order_item", "quantity", first_item, quantity.tolist()),
+            ("order_item", "price", first_item, list(map(str, price.tolist()))),
+            ("order", "user_id", first_order, user_id.tolist()),
+            ("order", "address_id", first_order, [1] * n),
+            ("order", "status", first_order, np.array(STATUSES)[status].tolist()),
+            ("order", "total_price", first_order, list(map(str, total.tolist()))),
+            ("order", "created_at", first_order, created.tolist()),
+            ("order", "waiter_id", first_order, waiter_id.tolist()),
+        ]
+
+    # Дневные агрегаты (core/rollups.py) по тем же массивам, что ушли в заказы, и по графику смен
+    def aggregates(self):
+        day, total, waiter_id, item_day, dish, quantity, price = self.sold
+        labels = [(self.start + timedelta(days=d)).date().isoformat() for d in range(self.days)]
+
+        counts = np.bincount(day, minlength=self.days)
+        revenue = np.bincount(day, weights=total, minlength=self.days)
+        daily = [(labels[d], int(counts[d]), float(revenue[d])) for d in np.flatnonzero(counts)]
+
+        n_dishes = len(self.dish_ids)
+        key = item_day * n_dishes + dish
+        lines = np.bincount(key, minlength=self.days * n_dishes)
+        qty = np.bincount(key, weights=quantity, minlength=len(lines))
+        sums = np.bincount(key, weights=quantity * price, minlength=len(lines))
+        dishes = [(labels[k // n_dishes], self.dish_ids[k % n_dishes], int(qty[k]), float(sums[k]))
+                  for k in np.flatnonzero(lines)]
+
+        staff = {}
+        waiters, w = np.unique(waiter_id, return_inverse=True)
+        key = day * len(waiters) + w.reshape(-1)
+        orders = np.bincount(key, minlength=self.days * len(waiters))
+        sums = np.bincount(key, weights=total, minlength=len(orders))
+        for k in np.flatnonzero(orders):
+            staff[labels[k // len(waiters)], int(waiters[k % len(waiters)])] = [int(orders[k]), float(sums[k]), 0.0, 0]
+        for waiter, today, begin, end in self.shift_rows:
+            row = staff.setdefault((today, waiter), [0, 0.0, 0.0, 0])
+            row[2] += _hours(end) - _hours(begin)
+            row[3] += 1
+        return daily, dishes, [(d, w, *row) for (d, w), row in sorted(staff.items())]
+
+    # Пользователи пишутся после заказов: loyalty_total — сумма их не отменённых заказов
+    def users(self):
+        rng = self.rng
+        for user_id in self.ids["user"]:
+            total = round(self.spent.get(user_id, 0.0), 2)
+            discount = next(pct for limit, pct in LOYALTY_TIERS if total >= limit)
+            created = self.start - timedelta(days=rng.randrange(1, 700))
+            yield from (
+                ("user", "name", user_id, f"{rng.choice(NAMES)} {user_id}"),
+                ("user", "phone", user_id, f"+7{9000000000 + user_id}"),
+                ("user", "city", user_id, rng.choice(CITIES)),
+                ("user", "street", user_id, rng.choice(STREETS)),
+                ("user", "house", user_id, str(rng.randrange(1, 120))),
+                ("user", "building", user_id, rng.choice(("", "", "1", "2"))),
+                ("user", "floor", user_id, str(rng.randrange(1, 17))),
+                ("user", "flat", user_id, str(rng.randrange(1, 300))),
+                ("user", "created_at", user_id, _stamp(created)),
+                ("user", "loyalty_discount", user_id, str(discount)),
+                ("user", "loyalty_total", user_id, str(total)),
+            )
+
+    def bookings(self):
+        rng = self.rng
+        users = self.ids["user"]
+        tables = self.ids["table"]
+        per_day = len(tables) * len(BOOKING_SLOTS)
+        # Разные (день, стол, окно) — пересечений у одного стола не бывает
+        slots = sorted(rng.sample(range(self.days * per_day), len(self.ids["booking"])))
+        for booking_id, slot in zip(self.ids["booking"], slots):
+            day, rest = divmod(slot, per_day)
+            table_id = tables[rest // len(BOOKING_SLOTS)]
+            when = f"{(self.start + timedelta(days=day)).date().isoformat()}T{BOOKING_SLOTS[rest % len(BOOKING_SLOTS)]}"
+            created = self.start + timedelta(days=day) - timedelta(hours=rng.randrange(2, 24 * 14))
+            yield from (
+                ("booking", "user_id", booking_id, str(rng.choice(users))),
+                ("booking", "datetime", booking_id, when),
+                ("booking", "table_id", booking_id, str(table_id)),
+                ("booking", "guests", booking_id, str(rng.randint(1, self.seats[table_id]))),
+                ("booking", "comment", booking_id, rng.choice(("", "", "", "У окна", "День рождения", "С ребёнком"))),
+                ("booking", "created_at", booking_id, _stamp(created)),
+            )
+
+    def carts(self):
+        rng = self.rng
+        owners = rng.sample(self.ids["user"], len(self.ids["cart"]))
+        item_ids = iter(self.ids["cart_item"])
+        for cart_id, user_id, lines in zip(self.ids["cart"], owners, self.cart_lines):
+            yield "cart", "user_id", cart_id, str(user_id)
+            for dish_id in rng.sample(self.dish_ids, lines):
+                item_id = next(item_ids)
+                yield from (
+                    ("cart_item", "cart_id", item_id, str(cart_id)),
+                    ("cart_item", "dish_id", item_id, str(dish_id)),
+                    ("cart_item", "quantity", item_id, str(rng.choice((1, 1, 2, 3)))),
+                )
+
+    def reviews(self):
+        rng = self.rng
+        users = self.ids["user"]
+        for review_id in self.ids["review"]:
+            created = self.start + timedelta(days=rng.randrange(self.days), seconds=rng.randrange(86400))
+            yield from (
+                ("review", "user_id", review_id, str(rng.choice(users))),
+                ("review", "rating", review_id, str(rng.choices((1, 2, 3, 4, 5), weights=(1, 2, 5, 12, 20))[0])),
+                ("review", "comment", review_id, rng.choice(COMMENTS)),
+                ("review", "created_at", review_id, _stamp(created)),
+            )
+            if rng.random() < 0.2:
+                yield "review", "restaurant", review_id, "true"
+            else:
+                yield "review", "dish_id", review_id, str(rng.choices(self.dish_ids, cum_weights=self.dish_weights)[0])
+
+    async def run(self, db, log=print):
+        rng = self.rng
+        counts = self.counts
+        await self.allocate(db, "category", len(CATEGORIES))
+        await self.allocate(db, "dish", counts["dish"])
+        await self.allocate(db, "table", counts["table"])
+        await self.allocate(db, "user", counts["user"])
+        self.roster()
+        await self.allocate(db, "staff_shift", len(self.shift_rows))
+        await self.allocate(db, "booking", min(counts["booking"], self.days * counts["table"] * len(BOOKING_SLOTS)))
+        await self.allocate(db, "order", counts["order"])
+        self.lines = rng.choices((1, 2, 3, 4, 5, 6), weights=(15, 30, 25, 15, 10, 5), k=counts["order"])
+        await self.allocate(db, "order_item", sum(self.lines))
+        await self.allocate(db, "cart", counts["cart"])
+        self.cart_lines = [rng.randint(1, min(4, counts["dish"])) for _ in range(counts["cart"])]
+        await self.allocate(db, "cart_item", sum(self.cart_lines))
+        await self.allocate(db, "review", counts["review"])
+
+        total = 0
+        await db.execute("CREATE TEMP TABLE IF NOT EXISTS seed_rows (ent_name, attr_name, ent_instance_id, value)")
+        # Порядок важен: смены до заказов (официанты), заказы до пользователей (лояльность)
+        for stage, writer in ((self.categories, _rows), (self.dishes, _rows), (self.tables, _rows),
+                              (self.shifts, _rows), (self.orders, _columns), (self.users, _rows),
+                              (self.bookings, _rows), (self.carts, _rows), (self.reviews, _rows)):
+            started = time.perf_counter()
+            written = await writer(db, stage())
+            total += written
+            log(f"  {stage.__name__:<10} {written:>10} строк  {time.perf_counter() - started:6.2f} с")
+        await db.execute("DROP TABLE temp.seed_rows")
+        # Агрегаты аналитики — суммами по тем же массивам, без прохода по загруженным строкам
+        started = time.perf_counter()
+        await rollups.merge(db, *self.aggregates())
+        log(f"  {'агрегаты':<10} {'':>10}        {time.perf_counter() - started:6.2f} с")
+        return total
+
+
+async def _rows(db, rows):
+    written = 0
+    pending = None
+    while True:
+        # Следующая пачка генерируется, пока предыдущая пишется в потоке соединения
+        batch = list(islice(rows, BATCH))
+        if pending:
+            await pending
+        if not batch:
+            break
+        pending = asyncio.ensure_future(_write(db, batch))
+        written += len(batch)
+    return written
+
+
+# Пачка идёт через временную таблицу и переносится одним INSERT ... SELECT:
+# AUTOINCREMENT у val_id тогда обновляет sqlite_sequence раз на пачку, а не на строку.
+# value_num / value_ts считаются тут же по t_sys_attr, триггеры типизации на время загрузки сняты
+async def _write(db, batch):
+    await db.executemany("INSERT INTO temp.seed_rows VALUES (?, ?, ?, ?)", batch)
+    await db.execute(
+        "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value, value_num, value_ts) "
+        f"SELECT r.ent_name, r.attr_name, r.ent_instance_id, r.value, "
+        f"{typed.num_sql('r.value', 'a.attr_type')}, {typed.ts_sql('r.value', 'a.attr_type')} "
+        "FROM temp.seed_rows r LEFT JOIN t_sys_attr a ON a.ent_name = r.ent_name AND a.attr_name = r.attr_name"
+    )
+    await db.execute("DELETE FROM temp.seed_rows")
+
+
+# Колонка одного атрибута у подряд идущих id уходит пачкой в JSON-массиве и разворачивается
+# json_each прямо в INSERT ... SELECT: ни кортежа, ни параметра на строку. Значения — числа
+# или готовые строки (value — их текст), у DATETIME — секунды эпохи (value — ISO, как _stamp).
+# value_num берётся CAST без проверки текста: сидер пишет только корректные числа
+async def _columns(db, columns):
+    written = 0
+    for ent_name, attr_name, first_id, values in columns:
+        rows = await db.execute_fetchall(
+            "SELECT attr_type FROM t_sys_attr WHERE ent_name = ? AND attr_name = ?", (ent_name, attr_name)
+        )
+        column = typed.column_for(rows[0]["attr_type"]) if rows else None
+        value = "strftime('%Y-%m-%dT%H:%M:%S', j.value, 'unixepoch')" if column == "value_ts" else "CAST(j.value AS TEXT)"
+        num = "CAST(j.value AS REAL)" if column == "value_num" else "NULL"
+        ts = "j.value" if column == "value_ts" else "NULL"
+        for start in range(0, len(values), BATCH):
+            await db.execute(
+                "INSERT INTO t_sys_attr_values (ent_name, attr_name, ent_instance_id, value, value_num, value_ts) "
+                f"SELECT ?, ?, ? + j.key, {value}, {num}, {ts} FROM json_each(?) j",
+                (ent_name, attr_name, first_id + start, json.dumps(values[start:start + BATCH]))
+            )
+        written += len(values)
+    return written
+
+
+# Загрузочные прагмы: журнал отката в памяти и без fsync, с большим кэшем. ROLLBACK
+# при ошибке загрузки остаётся корректным (с journal_mode = OFF он не определён и может
+# испортить файл); падение самого процесса посреди загрузки базу не сохраняет — сидер
+# запускается только на остановленном приложении.
+LOADER_PRAGMAS = (
+    "PRAGMA journal_mode = MEMORY",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA cache_size = -262144",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA threads = 4",
+    # ANALYZE по выборке из индексов, а не полным проходом по каждому
+    "PRAGMA analysis_limit = 1000",
+)
+
+
+async def reset(db):
+    marks = ",".join("?" * len(SEEDED))
+    await db.execute(f"DELETE FROM t_sys_attr_values WHERE ent_name IN ({marks})", SEEDED)
+    await db.execute(f"UPDATE t_sys_seq SET next_id = 1 WHERE ent_name IN ({marks})", SEEDED)
+    await rollups.clear(db)
+    await db.commit()
+
+
+async def seed(db, seeder, wipe=False, log=print):
+    started = time.perf_counter()
+    for pragma in LOADER_PRAGMAS:
+        await db.execute_fetchall(pragma)
+    try:
+        # Счётчики версий на время загрузки не ведутся: один общий bump в конце
+        await versions.uninstall(db)
+        if wipe:
+            await reset(db)
+        # Все индексы t_sys_attr_values и проекции на время загрузки снимаются и строятся
+        # заново одним проходом по готовым данным — это в разы быстрее построчной поддержки
+        saved = await db.execute_fetchall(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 't_sys_attr_values' AND sql IS NOT NULL"
+        )
+        for row in saved:
+            await db.execute(f"DROP INDEX {row['name']}")
+        suspended = await projections.suspend(db)
+        await typed.uninstall(db)
+        await db.commit()
+        try:
+            total = await seeder.run(db, log)
+            await db.commit()
+            sequences.committed()
+            log(f"Записано {total} строк за {time.perf_counter() - started:.2f} с, строим индексы")
+        except BaseException:
+            await db.rollback()
+            sequences.rolled_back()
+            raise
+        finally:
+            stage = time.perf_counter()
+            await typed.install(db)
+            for row in saved:
+                await db.execute(row["sql"])
+            await indexes.sync_indexes(db)
+            if suspended:
+                await projections.rebuild(db, suspended)
+            log(f"  индексы и проекции    {time.perf_counter() - stage:6.2f} с")
+        stage = time.perf_counter()
+        await db.execute_fetchall("ANALYZE")
+        log(f"  ANALYZE               {time.perf_counter() - stage:6.2f} с")
+    finally:
+        await versions.install(db)
+        await versions.bump(db, SEEDED)
+        await db.commit()
+        await db.execute_fetchall("PRAGMA locking_mode = NORMAL")
+        await db.execute_fetchall("PRAGMA journal_mode = WAL")
+    log(f"Готово за {time.perf_counter() - started:.2f} с")
+    return total
@@ -0,0 +1,83 @@
+# Выдача ent_instance_id через t_sys_seq вместо SELECT MAX(ent_instance_id) + 1.
+# Счётчик сдвигается UPDATE ... RETURNING внутри пишущей транзакции, так что два
+# писателя (или два воркера) никогда не получат один и тот же id. Для частых сущностей
+# резервируется сразу блок, и следующие id выдаются из памяти без запросов.
+
+BLOCK_SIZES = {
+    "order": 20,
+    "order_item": 200,
+    "cart": 20,
+    "cart_item": 200,
+    "booking": 20,
+    "review": 20,
+    "support_message": 20,
+}
+
+# ent_name -> [следующий свободный id, граница блока]
+_blocks = {}
+# Сущности, блок которых зарезервирован в ещё не закоммиченной транзакции
+_pending = set()
+
+
+async def _reserve(db, ent_name, size):
+    rows = await db.execute_fetchall(
+        "UPDATE t_sys_seq SET next_id = next_id + ? WHERE ent_name = ? RETURNING next_id",
+        (size, ent_name)
+    )
+    if not rows:
+        await db.execute(
+            "INSERT OR IGNORE INTO t_sys_seq (ent_name, next_id) "
+            "SELECT ?, IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values WHERE ent_name = ?",
+            (ent_name, ent_name)
+        )
+        rows = await db.execute_fetchall(
+            "UPDATE t_sys_seq SET next_id = next_id + ? WHERE ent_name = ? RETURNING next_id",
+            (size, ent_name)
+        )
+    end = rows[0][0]
+    _pending.add(ent_name)
+    return [end - size, end]
+
+
+async def next_ids(db, ent_name, count):
+    block = _blocks.get(ent_name)
+    if block is None or block[1] - block[0] < count:
+        block = await _reserve(db, ent_name, max(BLOCK_SIZES.get(ent_name, 1), count))
+        _blocks[ent_name] = block
+    start = block[0]
+    block[0] += count
+    return list(range(start, start + count))
+
+
+async def next_id(db, ent_name):
+    return (await next_ids(db, ent_name, 1))[0]
+
+
+# Транзакция закоммичена — зарезервированные блоки принадлежат этому процессу
+def committed():
+    _pending.clear()
+
+
+# Транзакция откатилась вместе с UPDATE t_sys_seq — блоки из неё выдавать нельзя
+def rolled_back():
+    for ent_name in _pending:
+        _blocks.pop(ent_name, None)
+    _pending.clear()
+
+
+# Подтягивает счётчики вперёд, если строки добавили в обход t_sys_seq (импорт, ручной SQL)
+async def sync(db):
+    await db.execute(
+        "INSERT OR IGNORE INTO t_sys_seq (ent_name, next_id) SELECT ent_name, 1 FROM t_sys_ent"
+    )
+    await db.execute(
+        """
+        UPDATE t_sys_seq SET next_id = MAX(next_id, (
+            SELECT IFNULL(MAX(ent_instance_id), 0) + 1 FROM t_sys_attr_values v
+            WHERE v.ent_name = t_sys_seq.ent_name
+        ))
+        """
+    )
+    await db.commit()
+    _blocks.clear()
+    _pending.clear()
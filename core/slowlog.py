@@ -0,0 +1,155 @@
+import json
+import logging
+import os
+import re
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+# Журнал медленных запросов для соединений из get_db (см. TracedConnection в core/metrics.py).
+# Запрос дольше SLOW_QUERY_MS попадает в кольцевой буфер и в ротируемый файл вместе с
+# параметрами, длительностью и маршрутом. Для каждой формы запроса (SQL без литералов и
+# с ?, ?, ... свёрнутыми в один ?) один раз снимается EXPLAIN QUERY PLAN, и полные
+# просмотры t_sys_attr_values помечаются full_scan.
+
+THRESHOLD_MS = float(os.environ.get("SLOW_QUERY_MS", "100"))
+LOG_PATH = os.environ.get("SLOW_QUERY_LOG", "slow_queries.log")
+BUFFER_SIZE = int(os.environ.get("SLOW_QUERY_BUFFER", "500"))
+# Столько разных форм запросов помним; планы для следующих уже не снимаются
+MAX_SHAPES = 2000
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+_NUMBER = re.compile(r"\b\d+(\.\d+)?\b")
+_MARKS = re.compile(r"\?(\s*,\s*\?)+")
+_SPACES = re.compile(r"\s+")
+_ALIAS = re.compile(r"\bt_sys_attr_values\b(?:\s+(?:AS\s+)?(?!WHERE|JOIN|ON|GROUP|ORDER|LEFT|INNER|LIMIT)(\w+))?",
+                    re.IGNORECASE)
+
+recent = deque(maxlen=BUFFER_SIZE)
+# форма -> {"plan": [...], "full_scan": bool, "count", "total_ms", "max_ms", ...}
+shapes = {}
+# исходный SQL -> форма; роутеры шлют одни и те же строки, так что нормализация идёт один раз
+_shape_of = {}
+
+_file = None
+
+
+def shape(sql):
+    known = _shape_of.get(sql)
+    if known is None:
+        known = _SPACES.sub(" ", _MARKS.sub("?", _NUMBER.sub("N", sql))).strip()
+        if len(_shape_of) < MAX_SHAPES * 4:
+            _shape_of[sql] = known
+    return known
+
+
+# Полный просмотр таблицы — строка плана «SCAN <таблица или её псевдоним>» без USING INDEX
+def _full_scans(sql, plan):
+    names = {"t_sys_attr_values"}
+    for match in _ALIAS.finditer(sql):
+        if match.group(1):
+            names.add(match.group(1))
+    return [line for line in plan if line.startswith("SCAN ") and "USING" not in line
+            and line.split()[1] in names]
+
+
+async def _explain(conn, sql, parameters):
+    try:
+        rows = await conn.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}", parameters)
+    except Exception as e:
+        return [f"EXPLAIN не выполнен: {e}"]
+    return [row[3] for row in rows]
+
+
+def _write_file(record):
+    global _file
+    if not LOG_PATH:
+        return
+    if _file is None:
+        _file = logging.getLogger("restoflow.slow_queries")
+        _file.propagate = False
+        _file.setLevel(logging.INFO)
+        _file.addHandler(RotatingFileHandler(LOG_PATH, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8"))
+    _file.info(json.dumps(record, ensure_ascii=False))
+
+
+def _params(parameters):
+    if parameters is None:
+        return None
+    values = list(parameters)[:20] if isinstance(parameters, (list, tuple)) else parameters
+    return json.loads(json.dumps(values, ensure_ascii=False, default=str))
+
+
+def _new_shape(key, plan, scans):
+    return {
+        "shape": key, "plan": plan, "full_scan": bool(scans), "scans": scans,
+        "count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": [], "last_params": None,
+    }
+
+
+# Первая встреча формы запроса: снимаем план. Дальше это один поиск в словаре.
+async def seen(conn, sql, parameters, many=False):
+    key = shape(sql)
+    if key in shapes or len(shapes) >= MAX_SHAPES:
+        return
+    first_word = key.split(" ", 1)[0].upper()
+    plan = await _explain(conn, sql, parameters) if not many and first_word in EXPLAINABLE else []
+    shapes[key] = _new_shape(key, plan, _full_scans(sql, plan))
+
+
+# Запрос завершён за elapsed секунд (выполнение плюс чтение строк)
+def check(sql, parameters, elapsed, route, many=False):
+    ms = elapsed * 1000
+    if ms < THRESHOLD_MS:
+        return
+    key = shape(sql)
+    info = shapes.get(key)
+    if info is None:
+        info = shapes[key] = _new_shape(key, [], [])
+    info["count"] += 1
+    info["total_ms"] += ms
+    info["max_ms"] = max(info["max_ms"], ms)
+    info["last_params"] = None if many else _params(parameters)
+    if route and route not in info["routes"]:
+        info["routes"].append(route)
+    record = {
+        "at": datetime.now().isoformat(timespec="milliseconds"),
+        "route": route,
+        "ms": round(ms, 2),
+        "sql": key,
+        "params": info["last_params"],
+        "full_scan": info["full_scan"],
+    }
+    recent.append(record)
+    _write_file(dict(record, plan=info["plan"]))
+
+
+def _summary(info):
+    return {
+        "shape": info["shape"],
+        "count": info["count"],
+        "total_ms": round(info["total_ms"], 2),
+        "avg_ms": round(info["total_ms"] / info["count"], 2) if info["count"] else 0.0,
+        "max_ms": round(info["max_ms"], 2),
+        "routes": info["routes"],
+        "full_scan": info["full_scan"],
+        "scans": info["scans"],
+        "plan": info["plan"],
+        "last_params": info["last_params"],
+    }
+
+
+def worst(limit=20, order="total_ms"):
+    slow = [info for info in shapes.values() if info["count"]]
+    slow.sort(key=lambda info: info[order], reverse=True)
+    return [_summary(info) for info in slow[:limit]]
+
+
+def full_scans():
+    return [_summary(info) for info in shapes.values() if info["full_scan"]]
+
+
+def clear():
+    recent.clear()
+    shapes.clear()
@@ -0,0 +1,120 @@
+# Типизированные копии значений в t_sys_attr_values по t_sys_attr.attr_type:
+# числа (INTEGER, NUMERIC, REAL) — в value_num, даты (DATETIME) — в value_ts, секунды эпохи.
+# Текст в value остаётся как был. Колонки заполняют триггеры, поэтому любые записи
+# (роутеры, админка, ручной SQL) типизируются сами; сравнения, суммы и диапазоны идут
+# по ним без CAST и DATE на каждую строку, а индексы idx_rng_* дают range-поиск.
+
+import calendar
+from datetime import date, datetime
+
+NUMERIC = ("INTEGER", "NUMERIC", "REAL", "FLOAT")
+DATETIME = ("DATETIME",)
+
+# Атрибуты-даты, которые до типизации были объявлены TEXT
+DATETIME_ATTRS = ("created_at", "updated_at", "datetime", "start_time", "end_time")
+
+TRIGGERS = ("trg_typed_num_ins", "trg_typed_ts_ins", "trg_typed_upd")
+
+
+def _in(types):
+    return "(" + ", ".join(f"'{t}'" for t in types) + ")"
+
+
+def column_for(attr_type):
+    if attr_type in NUMERIC:
+        return "value_num"
+    if attr_type in DATETIME:
+        return "value_ts"
+    return None
+
+
+# Секунды эпохи так же, как strftime('%s'): время из ISO-строки считается UTC
+def epoch(value):
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    elif not isinstance(value, datetime) and isinstance(value, date):
+        value = datetime(value.year, value.month, value.day)
+    return calendar.timegm(value.timetuple())
+
+
+# Число из текста; нечисловой текст даёт NULL, а не 0, как голый CAST
+def number(value):
+    return (f"CASE WHEN trim({value}) <> '' AND trim({value}) NOT GLOB '*[^0-9.+-]*' "
+            f"THEN CAST({value} AS REAL) END")
+
+
+# ISO-дата в секунды эпохи; нераспознанная даёт NULL
+def stamp(value):
+    return f"CAST(strftime('%s', {value}) AS INTEGER)"
+
+
+# Выражения value_num и value_ts для строки с известным attr_type (массовые вставки и пересчёт)
+def num_sql(value, attr_type):
+    return f"CASE WHEN {attr_type} IN {_in(NUMERIC)} THEN {number(value)} END"
+
+
+def ts_sql(value, attr_type):
+    return f"CASE WHEN {attr_type} IN {_in(DATETIME)} THEN {stamp(value)} END"
+
+
+def _type_of(ref):
+    return (f"(SELECT attr_type FROM t_sys_attr "
+            f"WHERE ent_name = {ref}.ent_name AND attr_name = {ref}.attr_name)")
+
+
+def _trigger_sql():
+    # Типизирующий UPDATE меняет только value_num/value_ts: триггеры «OF value» на него не срабатывают
+    return [
+        f"""CREATE TRIGGER trg_typed_num_ins AFTER INSERT ON t_sys_attr_values
+        WHEN NEW.value_num IS NULL AND {_type_of("NEW")} IN {_in(NUMERIC)}
+        BEGIN
+            UPDATE t_sys_attr_values SET value_num = {number("NEW.value")} WHERE val_id = NEW.val_id;
+        END""",
+        f"""CREATE TRIGGER trg_typed_ts_ins AFTER INSERT ON t_sys_attr_values
+        WHEN NEW.value_ts IS NULL AND {_type_of("NEW")} IN {_in(DATETIME)}
+        BEGIN
+            UPDATE t_sys_attr_values SET value_ts = {stamp("NEW.value")} WHERE val_id = NEW.val_id;
+        END""",
+        f"""CREATE TRIGGER trg_typed_upd AFTER UPDATE OF ent_name, attr_name, value ON t_sys_attr_values
+        BEGIN
+            UPDATE t_sys_attr_values SET
+                value_num = {num_sql("NEW.value", _type_of("NEW"))},
+                value_ts = {ts_sql("NEW.value", _type_of("NEW"))}
+            WHERE val_id = NEW.val_id;
+        END""",
+    ]
+
+
+async def install(db):
+    await uninstall(db)
+    for sql in _trigger_sql():
+        await db.execute(sql)
+
+
+async def uninstall(db):
+    for name in TRIGGERS:
+        await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+# Пересчёт типизированных колонок по текущим attr_type (после миграции или смены типа атрибута)
+async def backfill(db, ent_name=None, attr_name=None):
+    where, params = "", []
+    if ent_name is None and attr_name is None:
+        # Вся таблица — только типизированные атрибуты: у текстовых колонки и так пустые
+        where = f" AND a.attr_type IN {_in(NUMERIC + DATETIME)}"
+    if ent_name is not None:
+        where += " AND v.ent_name = ?"
+        params.append(ent_name)
+    if attr_name is not None:
+        where += " AND v.attr_name = ?"
+        params.append(attr_name)
+    await db.execute(
+        f"""
+        UPDATE t_sys_attr_values AS v SET
+            value_num = {num_sql("v.value", "a.attr_type")},
+            value_ts = {ts_sql("v.value", "a.attr_type")}
+        FROM t_sys_attr a
+        WHERE a.ent_name = v.ent_name AND a.attr_name = v.attr_name {where}
+        """,
+        params
+    )
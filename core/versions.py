@@ -0,0 +1,123 @@
+from collections import defaultdict
+
+from core import metrics
+
+# Согласованность кэшей между воркерами (uvicorn --workers N).
+# Триггеры на t_sys_attr_values увеличивают t_sys_version.version сущности при любой
+# записи в её строки, а правки и удаления (не только вставки) ещё и edits. Кэши
+# подписываются на ent_name; перед выдачей данных из кэша sync() сверяет счётчики.
+# Сверка почти бесплатная: пока PRAGMA data_version соединения не изменилась,
+# ни один другой коннект ничего не коммитил и читать t_sys_version не нужно.
+
+TRIGGERS = ("trg_version_ins", "trg_version_upd", "trg_version_del")
+
+DOCS = [
+    ("table", "t_sys_version", None, "Счётчики изменений сущностей для сброса кэшей во всех воркерах"),
+    ("column", "t_sys_version", "ent_name", "Имя сущности"),
+    ("column", "t_sys_version", "version", "Растёт при любой записи в строки сущности (ведётся триггерами)"),
+    ("column", "t_sys_version", "edits", "Растёт при правке или удалении строк (вставки его не меняют)"),
+]
+
+# ent_name -> (version, edits), которые уже видел этот процесс
+_seen = {}
+# ent_name -> [async callback(db, ent_name, appended_only)]
+_subscribers = defaultdict(list)
+# соединение -> PRAGMA data_version при последней сверке
+_data_version = {}
+
+
+def _bump(ref, edits):
+    extra = ", edits = edits + 1" if edits else ""
+    return (f"INSERT INTO t_sys_version (ent_name, version, edits) VALUES ({ref}.ent_name, 1, {1 if edits else 0}) "
+            f"ON CONFLICT (ent_name) DO UPDATE SET version = version + 1{extra}")
+
+
+def _trigger_sql():
+    return [
+        f"""CREATE TRIGGER trg_version_ins AFTER INSERT ON t_sys_attr_values
+        BEGIN
+            {_bump("NEW", False)};
+        END""",
+        f"""CREATE TRIGGER trg_version_upd AFTER UPDATE OF ent_name, attr_name, ent_instance_id, value ON t_sys_attr_values
+        BEGIN
+            {_bump("OLD", True)};
+            {_bump("NEW", True)};
+        END""",
+        f"""CREATE TRIGGER trg_version_del AFTER DELETE ON t_sys_attr_values
+        BEGIN
+            {_bump("OLD", True)};
+        END""",
+    ]
+
+
+async def create(db):
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS t_sys_version ("
+        "ent_name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0, edits INTEGER NOT NULL DEFAULT 0)"
+    )
+    await install(db)
+
+
+async def install(db):
+    await uninstall(db)
+    for sql in _trigger_sql():
+        await db.execute(sql)
+
+
+async def uninstall(db):
+    for name in TRIGGERS:
+        await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+# Массовая загрузка шла без триггеров — помечаем сущности изменёнными одной командой
+async def bump(db, ent_names):
+    await db.executemany(
+        "INSERT INTO t_sys_version (ent_name, version, edits) VALUES (?, 1, 1) "
+        "ON CONFLICT (ent_name) DO UPDATE SET version = version + 1, edits = edits + 1",
+        [(e,) for e in ent_names]
+    )
+
+
+def subscribe(ent_names, callback):
+    for ent_name in ent_names:
+        _subscribers[ent_name].append(callback)
+
+
+async def _read(db):
+    rows = await db.execute_fetchall("SELECT ent_name, version, edits FROM t_sys_version")
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+# Точка отсчёта: кэши загружаются следом из того же состояния базы
+async def load(db):
+    _seen.clear()
+    _seen.update(await _read(db))
+    _data_version.clear()
+
+
+# Сверка перед чтением из кэша: подписчики изменившихся сущностей получают
+# appended_only=True, если с прошлой сверки в сущность были только вставки
+async def sync(db):
+    # сверка не считается запросом эндпоинта в метриках
+    conn = db._conn if isinstance(db, metrics.TracedConnection) else db
+    current = (await conn.execute_fetchall("PRAGMA data_version"))[0][0]
+    if _data_version.get(conn) == current:
+        return
+    _data_version[conn] = current
+    changed = []
+    for ent_name, (version, edits) in (await _read(conn)).items():
+        # сущности без строки в t_sys_version ещё никто не менял
+        seen = _seen.get(ent_name, (0, 0))
+        if seen == (version, edits):
+            continue
+        _seen[ent_name] = (version, edits)
+        if _subscribers.get(ent_name):
+            changed.append((ent_name, seen[1] == edits))
+    for ent_name, appended_only in changed:
+        for callback in _subscribers[ent_name]:
+            await callback(db, ent_name, appended_only)
+
+
+# Версии сущностей на момент последней сверки (для ETag ответов)
+def current(ent_names):
+    return tuple(_seen.get(ent_name, (0, 0)) for ent_name in ent_names)
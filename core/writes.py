@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+
+from core import metrics, sequences
+from db import writer
+
+# Все записи эндпоинтов идут через одну задачу, которая владеет соединением-писателем.
+# Запись — это единица: async def unit(db), которая читает и пишет на переданном
+# соединении, но сама не делает BEGIN и COMMIT. Единицы, пришедшие в течение WINDOW_MS
+# после первой, выполняются одной транзакцией (group commit): один fsync WAL на пачку
+# вместо одного на запрос. Каждая единица идёт в своей точке сохранения, так что ошибка
+# (в том числе HTTPException) откатывает только её, а вызывающий получает ровно свой
+# результат или своё исключение. Результаты отдаются только после COMMIT всей пачки.
+#
+# Операции, которые сами управляют транзакциями (DDL индексов и проекций), отправляются
+# с exclusive=True и выполняются отдельно, между пачками.
+
+# Сколько ждать попутчиков после первой единицы пачки
+WINDOW_MS = float(os.environ.get("WRITE_WINDOW_MS", "2"))
+MAX_BATCH = int(os.environ.get("WRITE_MAX_BATCH", "64"))
+
+# Сколько раз пробуем начать транзакцию, если базу держит писатель другого воркера (SQLITE_BUSY)
+BEGIN_ATTEMPTS = 5
+BEGIN_BACKOFF = 0.05
+
+log = logging.getLogger("restoflow.writes")
+
+
+class Unit:
+    __slots__ = ("run", "stats", "future", "exclusive", "result")
+
+    def __init__(self, run, stats, future, exclusive):
+        self.run = run
+        self.stats = stats
+        self.future = future
+        self.exclusive = exclusive
+        self.result = None
+
+    def conn(self, db):
+        # запросы единицы попадают в метрики и журнал медленных запросов её эндпоинта
+        return metrics.TracedConnection(db, self.stats) if self.stats is not None else db
+
+    def done(self, result):
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def fail(self, error):
+        if not self.future.done():
+            self.future.set_exception(error)
+
+
+_queue = None
+_task = None
+
+
+# Выполняет run(db) в общей пачке и возвращает его результат после COMMIT
+async def submit(run, exclusive=False):
+    if _queue is None:
+        raise RuntimeError("Писатель не запущен")
+    unit = Unit(run, metrics.current(), asyncio.get_running_loop().create_future(), exclusive)
+    _queue.put_nowait(unit)
+    return await unit.future
+
+
+def _is_busy(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+async def _begin(db):
+    for attempt in range(BEGIN_ATTEMPTS):
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            return
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e) or attempt == BEGIN_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(BEGIN_BACKOFF * 2 ** attempt * (1 + random.random()))
+
+
+# Единица в точке сохранения; False — единица откатилась и уже получила свою ошибку
+async def _apply(db, unit):
+    await db.execute("SAVEPOINT unit")
+    try:
+        unit.result = await unit.run(unit.conn(db))
+    except Exception as e:
+        await db.execute("ROLLBACK TO unit")
+        await db.execute("RELEASE unit")
+        # блоки id, зарезервированные откаченным UPDATE t_sys_seq, выдавать нельзя
+        sequences.rolled_back()
+        unit.fail(e)
+        return False
+    await db.execute("RELEASE unit")
+    return True
+
+
+# Пачка: первая единица и все, что успеют прийти за окно. Возвращает единицу,
+# которую нельзя было взять в пачку (exclusive или конец работы), или None.
+async def _batch(db, first):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WINDOW_MS / 1000
+    applied = []
+    held = None
+    unit = first
+    try:
+        await _begin(db)
+        while True:
+            if await _apply(db, unit):
+                applied.append(unit)
+            if len(applied) >= MAX_BATCH:
+                break
+            if _queue.empty():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    unit = await asyncio.wait_for(_queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            else:
+                unit = _queue.get_nowait()
+            if unit is None or unit.exclusive:
+                held = unit
+                break
+        await db.commit()
+    except Exception as e:
+        # сломалась сама транзакция (BEGIN, COMMIT, точка сохранения): не записалось ничего
+        if db.in_transaction:
+            await db.rollback()
+        sequences.rolled_back()
+        for failed in applied + ([unit] if unit is not None and unit is not held else []):
+            failed.fail(e)
+        return held
+    sequences.committed()
+    for done in applied:
+        done.done(done.result)
+    return held
+
+
+# Единица, которая сама коммитит: выполняется вне пачки, как раньше на writer()
+async def _alone(db, unit):
+    try:
+        result = await unit.run(unit.conn(db))
+    except Exception as e:
+        unit.fail(e)
+    else:
+        unit.done(result)
+    finally:
+        if db.in_transaction:
+            await db.rollback()
+            sequences.rolled_back()
+        else:
+            sequences.committed()
+
+
+async def _run(db):
+    held = None
+    while True:
+        unit = held if held is not None else await _queue.get()
+        held = None
+        if unit is None:
+            return
+        try:
+            if unit.exclusive:
+                await _alone(db, unit)
+            else:
+                held = await _batch(db, unit)
+        except Exception as e:
+            # например, не удался сам ROLLBACK: единица не должна ждать вечно, а писатель — умереть
+            log.exception("Сбой писателя")
+            unit.fail(e)
+
+
+async def start():
+    global _queue, _task
+    _queue = asyncio.Queue()
+
+    async def run():
+        async with writer() as db:
+            await _run(db)
+
+    _task = asyncio.ensure_future(run())
+
+
+# Единицы, уже стоящие в очереди, дописываются; новые после остановки не принимаются
+async def stop():
+    global _queue, _task
+    if _task is None:
+        return
+    _queue.put_nowait(None)
+    queue, _queue = _queue, None
+    try:
+        await _task
+    except Exception:
+        log.exception("Писатель остановился с ошибкой")
+    _task = None
+    while not queue.empty():
+        unit = queue.get_nowait()
+        if unit is not None:
+            unit.fail(RuntimeError("Писатель остановлен"))
@@ -1,8 +1,110 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
 import aiosqlite
+from fastapi import Request
+
+from core import metrics, sequences, versions
+
+DB_PATH = os.environ.get("DB_PATH", "david.db")
 
-DB_PATH = "david.db"
+# Пул: несколько читателей и один писатель (SQLite всё равно пишет по одному)
+READERS = int(os.environ.get("DB_READERS", "4"))
 
-async def get_db():
-    db = await aiosqlite.connect(DB_PATH)
+# Прагмы выставляются один раз на соединение
+PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+)
+
+
+async def connect(path=None, readonly=False):
+    db = await aiosqlite.connect(path or DB_PATH)
     db.row_factory = aiosqlite.Row
+    for pragma in PRAGMAS + (("PRAGMA query_only = ON",) if readonly else ()):
+        await db.execute_fetchall(pragma)
     return db
+
+
+class Pool:
+    def __init__(self, path, readers):
+        self.path = path
+        self.size = readers
+        self._readers = asyncio.Queue()
+        self._all = []
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+
+    async def open(self):
+        self._writer = await connect(self.path)
+        await self._writer.execute_fetchall("PRAGMA journal_mode = WAL")
+        self._all.append(self._writer)
+        for _ in range(self.size):
+            conn = await connect(self.path, readonly=True)
+            self._all.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        for conn in self._all:
+            await conn.close()
+        self._all.clear()
+
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        async with self._write_lock:
+            try:
+                yield self._writer
+            finally:
+                # незакоммиченное (например, после исключения) не должно утечь в следующий запрос
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+                    sequences.rolled_back()
+                else:
+                    sequences.committed()
+
+
+_pool = None
+
+
+async def init_pool():
+    global _pool
+    _pool = Pool(DB_PATH, READERS)
+    await _pool.open()
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def reader():
+    return _pool.reader()
+
+
+def writer():
+    return _pool.writer()
+
+
+async def get_db(request: Request):
+    # Эндпоинты только читают с реплик пула; писатель принадлежит задаче core/writes.py,
+    # и записи уходят ей единицами через writes.submit
+    async with reader() as db:
+        # Сверка версий почти бесплатна (PRAGMA data_version): кэши процесса, в том числе
+        # набор проекций для entity_table, узнают о записях других воркеров до запроса
+        await versions.sync(db)
+        stats = metrics.current()
+        yield metrics.TracedConnection(db, stats) if stats is not None else db
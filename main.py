@@ -1,8 +1,43 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from api import menu, cart, order, booking, tables, review, user, analytics, contact, news, admin_tools
+from db import init_pool, close_pool, writer
+from core.schema import migrate
+from core.indexes import sync_indexes
+from core import availability, columnar, httpcache, metrics, projections, refdata, resultcache, sequences, versions, writes
+
+
+# Пул соединений живёт столько же, сколько приложение
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_pool()
+    async with writer() as db:
+        await migrate(db)
+        await sync_indexes(db)
+        await projections.load(db)
+        await sequences.sync(db)
+        await versions.load(db)
+        await refdata.load(db)
+        await availability.load(db)
+    # дальше писателем владеет задача group commit (core/writes.py)
+    await writes.start()
+    # фоновый пересчёт аналитики на собственном соединении
+    await resultcache.start()
+    yield
+    await resultcache.stop()
+    # фоновая пересборка снимка аналитики
+    await columnar.stop()
+    await writes.stop()
+    await close_pool()
+
+
+app = FastAPI(title="RestoFlow", lifespan=lifespan)
 
-app = FastAPI(title="RestoFlow")
+# ETag и 304 для справочных эндпоинтов; внутри CORS, чтобы 304 тоже получал его заголовки
+app.add_middleware(httpcache.ConditionalMiddleware)
 
 # Настройка CORS (разрешить все источники — безопаснее ограничить на проде)
 app.add_middleware(
@@ -13,6 +48,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Счётчики запросов и SQL по маршрутам для /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Служебные эндпоинты
 @app.get("/ping")
 def ping():
@@ -22,6 +60,10 @@ def ping():
 def version():
     return {"version": "v1.0.0"}
 
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 # Подключение роутеров
 app.include_router(menu.router)
 app.include_router(cart.router)
@@ -35,25 +77,10 @@ app.include_router(contact.router)
 app.include_router(news.router)
 app.include_router(admin_tools.router)
 
-from fastapi import FastAPI, Request
-from fastapi.templating import Jinja2Templates
-from fastapi.staticfiles import StaticFiles
-
-app = FastAPI()
-
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-@app.get("/")
-async def index(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request})
-
-from fastapi import FastAPI, Request
+from fastapi import Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-app = FastAPI()
-
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
@@ -63,20 +90,19 @@ async def index(request: Request):
 
 from fastapi import Depends
 from db import get_db
+from core.projections import entity_table
 
 @app.get("/menu")
 async def menu_page(request: Request, db=Depends(get_db)):
-    query = """
-    SELECT ent_instance_id AS dish_id,
-           MAX(CASE WHEN attr_name = 'name' THEN value END) AS name,
-           MAX(CASE WHEN attr_name = 'price' THEN value END) AS price,
-           MAX(CASE WHEN attr_name = 'description' THEN value END) AS description
-    FROM t_sys_attr_values
-    WHERE ent_name = 'dish'
-    GROUP BY ent_instance_id
+    query = f"""
+    SELECT ent_instance_id AS dish_id, name, price, description
+    FROM {entity_table('dish', ('name', 'price', 'description'))}
     ORDER BY dish_id
     """
     cursor = await db.execute(query)
     rows = await cursor.fetchall()
     dishes = [dict(row) for row in rows]
     return templates.TemplateResponse("menu.html", {"request": request, "dishes": dishes})
+
+# Обёртки для метрик ставятся, когда все маршруты уже объявлены
+metrics.instrument(app)
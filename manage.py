@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+from datetime import date
+
+import db as database
+from core import projections, rollups
+from core.seed import Seeder, seed
+from core.schema import migrate
+
+# Служебные команды для david.db:
+#   python manage.py rebuild-projections [ent_name ...]
+#   python manage.py enable-projection dish order booking user table
+#   python manage.py rebuild-rollups
+#   python manage.py seed --orders 300000 --users 20000 --seed 42 --reset
+
+
+async def _open(path):
+    conn = await database.connect(path)
+    await conn.execute_fetchall("PRAGMA journal_mode = WAL")
+    await migrate(conn)
+    return conn
+
+
+async def rebuild_projections(args):
+    conn = await _open(args.db)
+    try:
+        rebuilt = await projections.rebuild(conn, args.ent_names)
+        print("Перестроены проекции:", ", ".join(rebuilt) or "нет включённых")
+    finally:
+        await conn.close()
+
+
+async def enable_projection(args):
+    conn = await _open(args.db)
+    try:
+        for ent_name in args.ent_names:
+            await projections.enable(conn, ent_name)
+            print("Включена проекция", projections.table_name(ent_name))
+    finally:
+        await conn.close()
+
+
+async def disable_projection(args):
+    conn = await _open(args.db)
+    try:
+        for ent_name in args.ent_names:
+            await projections.disable(conn, ent_name)
+            print("Отключена проекция", projections.table_name(ent_name))
+    finally:
+        await conn.close()
+
+
+async def rebuild_rollups(args):
+    conn = await _open(args.db)
+    try:
+        await rollups.rebuild(conn)
+        await conn.commit()
+        days = (await conn.execute_fetchall("SELECT COUNT(*) FROM agg_daily_orders"))[0][0]
+        print("Агрегаты аналитики перестроены, дней:", days)
+    finally:
+        await conn.close()
+
+
+async def seed_data(args):
+    conn = await _open(args.db)
+    try:
+        seeder = Seeder(
+            users=args.users, orders=args.orders, bookings=args.bookings, reviews=args.reviews,
+            dishes=args.dishes, tables=args.tables, waiters=args.waiters, carts=args.carts,
+            days=args.days, start=date.fromisoformat(args.start), seed=args.seed,
+        )
+        await seed(conn, seeder, wipe=args.reset)
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание базы RestoFlow")
+    parser.add_argument("--db", default=database.DB_PATH, help="путь к файлу базы")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd = commands.add_parser("rebuild-projections", help="заполнить проекции заново из t_sys_attr_values")
+    cmd.add_argument("ent_names", nargs="*")
+    cmd.set_defaults(handler=rebuild_projections)
+
+    cmd = commands.add_parser("enable-projection", help="включить проекцию для сущностей")
+    cmd.add_argument("ent_names", nargs="+")
+    cmd.set_defaults(handler=enable_projection)
+
+    cmd = commands.add_parser("disable-projection", help="отключить проекцию для сущностей")
+    cmd.add_argument("ent_names", nargs="+")
+    cmd.set_defaults(handler=disable_projection)
+
+    cmd = commands.add_parser("rebuild-rollups", help="пересчитать дневные агрегаты аналитики из заказов")
+    cmd.set_defaults(handler=rebuild_rollups)
+
+    cmd = commands.add_parser("seed", help="заполнить базу синтетическими данными")
+    cmd.add_argument("--users", type=int, default=20000)
+    cmd.add_argument("--orders", type=int, default=300000)
+    cmd.add_argument("--bookings", type=int, default=40000)
+    cmd.add_argument("--reviews", type=int, default=30000)
+    cmd.add_argument("--dishes", type=int, default=150)
+    cmd.add_argument("--tables", type=int, default=30)
+    cmd.add_argument("--waiters", type=int, default=25)
+    cmd.add_argument("--carts", type=int, default=1000, help="пользователей с непустой корзиной")
+    cmd.add_argument("--days", type=int, default=365, help="за сколько дней раскладывать заказы и брони")
+    cmd.add_argument("--start", default="2025-01-01", help="первый день периода")
+    cmd.add_argument("--seed", type=int, default=42, help="зерно генератора: одинаковое даёт одинаковую базу")
+    cmd.add_argument("--reset", action="store_true", help="удалить прежние строки этих сущностей")
+    cmd.set_defaults(handler=seed_data)
+
+    args = parser.parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()